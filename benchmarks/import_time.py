@@ -0,0 +1,76 @@
+""" Time importing bokeh_django in fresh interpreters.
+
+Run from the repository root:
+
+.. code-block:: sh
+
+    python benchmarks/import_time.py --runs 20
+
+Each case runs in a new process and reports the median and fastest wall time.
+The process exits with status 1 if a case imports one of the modules that
+should only be loaded by processes serving Bokeh sessions.
+
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SETUP = """
+import django
+from django.conf import settings
+settings.configure(INSTALLED_APPS=["channels", "bokeh_django"], ROOT_URLCONF=__name__)
+bokeh_apps = []
+"""
+
+CASES = {
+    "import bokeh_django": "import bokeh_django",
+    "public API": "from bokeh_django import autoload, directory, document, static_extensions, with_request, with_url_args",
+    "django.setup()": "django.setup()",
+    "document route": "import bokeh_django; bokeh_django.document('app', lambda doc: None)",
+}
+
+# Only processes serving Bokeh sessions should import these
+HEAVY = ("bokeh.server", "bokeh.embed", "bokeh.command", "bokeh.document", "tornado", "channels.generic")
+
+TIMED = """
+import json, sys, time
+{setup}
+started = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - started
+heavy = [prefix for prefix in {heavy!r} if any(name == prefix or name.startswith(prefix + ".") for name in sys.modules)]
+print(json.dumps(dict(elapsed=elapsed, heavy=heavy)))
+"""
+
+
+def run(statement: str) -> dict:
+    code = TIMED.format(setup=SETUP, statement=statement, heavy=HEAVY)
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    failed = False
+    for name, statement in CASES.items():
+        results = [run(statement) for _ in range(args.runs)]
+        times = [result["elapsed"] * 1000 for result in results]
+        heavy = results[-1]["heavy"]
+        failed |= bool(heavy)
+        print(f"{name:<20} median {statistics.median(times):7.1f} ms   min {min(times):7.1f} ms"
+              + (f"   imports {', '.join(heavy)}" if heavy else ""))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+""" Time routing a request with ``URLRouter`` and with ``CompiledRouter``.
+
+Run from the repository root:
+
+.. code-block:: sh
+
+    python benchmarks/routing.py --routes 10 100 500
+
+Each Bokeh route adds the patterns ``RoutingConfiguration`` adds for a
+``document`` and ``autoload`` route, and every tenth route takes a URL
+argument. The Django catch-all comes last. Each case reports the time to reach
+the consumer for a path. The process exits with status 1 if both routers do
+not pick the same consumer with the same ``url_route`` for every path.
+
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from django.conf import settings  # noqa: E402
+
+settings.configure()
+
+from channels.routing import URLRouter  # noqa: E402
+from django.urls import re_path  # noqa: E402
+
+from bokeh_django.router import CompiledRouter  # noqa: E402
+
+
+def consumer(name: str):
+    async def app(scope, receive, send):
+        return name, scope["url_route"]
+    return app
+
+
+def urlpatterns(count: int) -> list:
+    patterns = [re_path(r"^bokeh-django/autoload.js$", consumer("batch"))]
+    for i in range(count):
+        url = f"app{i}/(?P<arg>[\\w-]+)" if i % 10 == 9 else f"app{i}"
+        patterns.append(re_path(f"^{url}$", consumer(f"doc {i}")))
+        patterns.append(re_path(f"^{url}/autoload.js$", consumer(f"autoload {i}")))
+    patterns.append(re_path(r"", consumer("django")))
+    return patterns
+
+
+def paths(count: int) -> dict:
+    last = count - 1
+    return {
+        "first route": "/app0",
+        "last route": f"/app{last}" if last % 10 != 9 else f"/app{last}/value",
+        "last autoload": f"/app{last}/autoload.js" if last % 10 != 9 else f"/app{last}/value/autoload.js",
+        "argument route": "/app9/value" if count > 9 else "/app0",
+        "django page": "/admin/login/",
+    }
+
+
+def route(router, path: str):
+    coroutine = router({"type": "http", "path": path}, None, None)
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError("consumer did not return")
+
+
+def timeit(router, path: str, number: int) -> float:
+    started = time.perf_counter()
+    for _ in range(number):
+        route(router, path)
+    return (time.perf_counter() - started) / number
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--routes", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    status = 0
+    for count in args.routes:
+        patterns = urlpatterns(count)
+        routers = dict(URLRouter=URLRouter(patterns), CompiledRouter=CompiledRouter(patterns))
+        print(f"{count} routes ({len(patterns)} patterns)")
+        for case, path in paths(count).items():
+            results = {name: route(router, path) for name, router in routers.items()}
+            if results["URLRouter"] != results["CompiledRouter"]:
+                print(f"  {case}: routers disagree on {path}: {results}")
+                status = 1
+                continue
+            times = {name: timeit(router, path, args.number) * 1e6 for name, router in routers.items()}
+            print(f"  {case:<16} URLRouter {times['URLRouter']:8.1f}us  CompiledRouter {times['CompiledRouter']:6.1f}us")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
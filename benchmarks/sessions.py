@@ -0,0 +1,119 @@
+""" Time the per-session coordination of ``DjangoApplicationContext`` and ``WSConsumer``.
+
+Run from the repository root:
+
+.. code-block:: sh
+
+    python benchmarks/sessions.py --number 2000
+
+Reports the time of taking the send lock of a websocket for one message, with
+tornado's ``locks.Lock`` and with ``asyncio.Lock``, alone and with other
+senders waiting, and the time to create the session of an empty document,
+alone and with concurrent requests for the same session. Sessions are dropped
+without being destroyed: Bokeh's ``Document.destroy`` runs a full garbage
+collection that would hide everything else. The process exits with status 1
+if a failing document build does not reach every concurrent request for the
+session, or leaves a pending session behind.
+
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+settings.configure()
+django.setup()
+
+from bokeh.application import Application  # noqa: E402
+from bokeh.application.handlers.function import FunctionHandler  # noqa: E402
+from bokeh.util.token import generate_session_id  # noqa: E402
+from tornado import locks  # noqa: E402
+
+from bokeh_django.consumers import synthetic_request  # noqa: E402
+from bokeh_django.context import DjangoApplicationContext  # noqa: E402
+
+
+async def send(lock, yields: bool) -> None:
+    async with lock:
+        if yields:
+            # a send that has to wait for the transport, the other senders queue on the lock
+            await asyncio.sleep(0)
+
+
+async def time_lock(lock, number: int, senders: int) -> float:
+    started = time.perf_counter()
+    if senders == 1:
+        for _ in range(number):
+            await send(lock, False)
+    else:
+        for _ in range(number):
+            await asyncio.gather(*(send(lock, True) for _ in range(senders)))
+    return (time.perf_counter() - started) / (number * senders)
+
+
+async def time_sessions(number: int, waiters: int) -> float:
+    context = DjangoApplicationContext(Application(FunctionHandler(lambda doc: None)), url="bench")
+    request = synthetic_request("/bench")
+    elapsed = 0.0
+    started = time.perf_counter()
+    for _ in range(number):
+        session_id = generate_session_id(secret_key=None, signed=False)
+        await asyncio.gather(*(context.create_session_if_needed(session_id, request) for _ in range(waiters)))
+        elapsed += time.perf_counter() - started
+        del context._sessions[session_id], context._session_contexts[session_id]
+        started = time.perf_counter()
+    return elapsed / number
+
+
+async def check_errors(waiters: int) -> bool:
+    def fail(doc):
+        raise ValueError("document build failed")
+
+    context = DjangoApplicationContext(Application(FunctionHandler(fail, trap_exceptions=False)), url="failing")
+    request = synthetic_request("/failing")
+    try:
+        results = await asyncio.wait_for(asyncio.gather(*(context.create_session_if_needed("failing", request)
+                                                          for _ in range(waiters)), return_exceptions=True), 5)
+    except asyncio.TimeoutError:
+        print("  failing build: requests for the session still wait after 5s")
+        return False
+    ok = all(isinstance(result, ValueError) for result in results) and not context._pending_sessions
+    print(f"  failing build: {sum(isinstance(result, ValueError) for result in results)}/{waiters} requests "
+          f"got the error, {len(context._pending_sessions)} pending sessions left")
+    return ok
+
+
+async def run(number: int) -> int:
+    print("send lock, per message")
+    for senders in (1, 4):
+        tornado_lock = await time_lock(locks.Lock(), number, senders)
+        asyncio_lock = await time_lock(asyncio.Lock(), number, senders)
+        print(f"  {senders} sender{'s' if senders > 1 else ' '}   tornado {tornado_lock * 1e6:7.1f}us  "
+              f"asyncio {asyncio_lock * 1e6:7.1f}us")
+
+    print("create a session")
+    for waiters in (1, 4):
+        per_session = await time_sessions(number, waiters)
+        print(f"  {waiters} request{'s' if waiters > 1 else ' '}  {per_session * 1e6:7.1f}us")
+
+    return 0 if await check_errors(4) else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+    return asyncio.run(run(args.number))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
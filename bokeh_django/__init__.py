@@ -1,16 +1,53 @@
 import inspect
+from importlib import import_module
+from importlib.util import find_spec
+from typing import TYPE_CHECKING
 
-# Bokeh imports
-from bokeh.util.dependencies import import_required
+if TYPE_CHECKING:
+    from .apps import DjangoBokehConfig
+    from .consumers import AutoloadJsConsumer, WSConsumer
+    from .embed import server_batch_document, server_session_for_request
+    from .limits import MessageLimits
+    from .routing import autoload, directory, document
+    from .static import static_extensions
+    from .transport import TransportPolicy
 
-# Bokeh imports
-from .apps import DjangoBokehConfig
-from .consumers import AutoloadJsConsumer, WSConsumer
-from .routing import autoload, directory, document
-from .static import static_extensions
+# Every Django process imports this package, most of them never serve Bokeh: the names below are
+# imported on first use, so that the Bokeh server, tornado and channels are only loaded when needed
+_lazy = {
+    "DjangoBokehConfig": ".apps",
+    "AutoloadJsConsumer": ".consumers",
+    "WSConsumer": ".consumers",
+    "server_batch_document": ".embed",
+    "server_session_for_request": ".embed",
+    "MessageLimits": ".limits",
+    "autoload": ".routing",
+    "directory": ".routing",
+    "document": ".routing",
+    "static_extensions": ".static",
+    "TransportPolicy": ".transport",
+}
 
-import_required("django", "django is required by bokeh-django")
-import_required("channels", "The package channels is required by bokeh-django and must be installed")
+
+def __getattr__(name):
+    if name in _lazy:
+        value = getattr(import_module(_lazy[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted([*globals(), *_lazy])
+
+
+# Like bokeh.util.dependencies.import_required, without importing bokeh
+for _package, _message in [
+    ("django", "django is required by bokeh-django"),
+    ("channels", "The package channels is required by bokeh-django and must be installed"),
+]:
+    if find_spec(_package) is None:
+        raise RuntimeError(_message)
 
 
 def with_request(handler):
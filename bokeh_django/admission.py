@@ -0,0 +1,241 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import asyncio
+import os
+from typing import TYPE_CHECKING, Any, Dict, Iterable
+
+# Local imports
+from . import metrics
+from .conf import get_setting
+
+if TYPE_CHECKING:
+    from bokeh.server.contexts import ApplicationContext
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'AdmissionControl',
+    'LoopLagMonitor',
+    'SessionRejected',
+    'loop_lag',
+    'worker_load',
+)
+
+# How often queued session creations check again whether they can be admitted (seconds)
+QUEUE_POLL_INTERVAL = 0.05
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+class SessionRejected(Exception):
+    """ Raised instead of creating a session when the worker is over its limits.
+
+    HTTP consumers answer with ``503`` and a ``Retry-After`` header, websocket
+    consumers close the connection with code ``1013`` (try again later).
+
+    """
+
+    def __init__(self, reason: str, retry_after: int) -> None:
+        super().__init__(f"Session rejected ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class LoopLagMonitor:
+    """ Measure how late the event loop wakes up a task sleeping for ``interval`` seconds.
+
+    A worker whose loop is blocked by document builds or callbacks shows a
+    growing lag long before it runs out of memory or sessions.
+
+    """
+
+    def __init__(self, interval: float = 0.25) -> None:
+        self.interval = interval
+        self.lag = 0.0
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """ Start measuring on the running loop, if not already doing so. """
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._task.get_loop() is loop:
+            return
+        self._task = loop.create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - started - self.interval)
+
+
+loop_lag = LoopLagMonitor()
+
+
+class AdmissionControl:
+    """ Decide whether an application context may start creating a new session.
+
+    Per-route limits are given to the constructor (from ``Routing``), global
+    limits come from the Django settings:
+
+    * ``BOKEH_DJANGO_MAX_SESSIONS``: live sessions over all routes
+    * ``BOKEH_DJANGO_MAX_PENDING_SESSIONS``: sessions being created over all routes
+    * ``BOKEH_DJANGO_MAX_LOOP_LAG``: event loop lag in seconds
+    * ``BOKEH_DJANGO_MAX_SESSION_MEMORY``: estimated bytes of all sessions, see
+      ``bokeh_django.footprint``
+    * ``BOKEH_DJANGO_ADMISSION_QUEUE_TIMEOUT``: how long a request over the limits
+      waits for room before it is shed, in seconds (default: 0)
+    * ``BOKEH_DJANGO_RETRY_AFTER``: value of the ``Retry-After`` header, in seconds (default: 5)
+
+    Every shed session increments the ``sessions_shed`` counter (labelled with
+    the route and the reason), every queued one ``sessions_queued``. Both are
+    also counted in ``shed`` and ``queued``, which ``worker_load`` reports.
+
+    While ``draining`` is set, when the worker shuts down, every new session
+    is rejected.
+
+    """
+
+    draining = False
+
+    def __init__(self, max_sessions: int | None = None, max_pending_sessions: int | None = None) -> None:
+        self.max_sessions = max_sessions
+        self.max_pending_sessions = max_pending_sessions
+        self.queued = 0
+        self.shed = 0
+
+    def over_limit(self, context: ApplicationContext, contexts: Iterable[ApplicationContext]) -> str | None:
+        """ Return the name of the first exceeded limit, or ``None``. """
+        if self.draining:
+            return "shutdown"
+        if self.max_sessions is not None and len(context._sessions) >= self.max_sessions:
+            return "route_sessions"
+        if self.max_pending_sessions is not None and len(context._pending_sessions) >= self.max_pending_sessions:
+            return "route_pending_sessions"
+
+        max_sessions = get_setting("MAX_SESSIONS")
+        if max_sessions is not None and sum(len(c._sessions) for c in contexts) >= max_sessions:
+            return "sessions"
+        max_pending_sessions = get_setting("MAX_PENDING_SESSIONS")
+        if max_pending_sessions is not None and sum(len(c._pending_sessions) for c in contexts) >= max_pending_sessions:
+            return "pending_sessions"
+
+        max_loop_lag = get_setting("MAX_LOOP_LAG")
+        if max_loop_lag is not None and loop_lag.lag > max_loop_lag:
+            return "loop_lag"
+
+        max_memory = get_setting("MAX_SESSION_MEMORY")
+        if max_memory is not None and sum(_session_bytes(c) for c in contexts) >= max_memory:
+            return "memory"
+        return None
+
+    async def admit(self, context: ApplicationContext, contexts: Iterable[ApplicationContext]) -> None:
+        """ Return once a new session may be created, or raise ``SessionRejected``.
+
+        """
+        loop_lag.start()
+
+        reason = self.over_limit(context, contexts)
+        if reason is None:
+            return
+
+        route = context.url or ""
+        loop = asyncio.get_running_loop()
+        # a worker shutting down will not have room again
+        deadline = loop.time() + (get_setting("ADMISSION_QUEUE_TIMEOUT", 0) if reason != "shutdown" else 0)
+        if loop.time() < deadline:
+            self.queued += 1
+            metrics.increment("sessions_queued", route=route, reason=reason)
+        while reason is not None and loop.time() < deadline:
+            await asyncio.sleep(QUEUE_POLL_INTERVAL)
+            reason = self.over_limit(context, contexts)
+
+        if reason is not None:
+            self.shed += 1
+            metrics.increment("sessions_shed", route=route, reason=reason)
+            log.warning("Shedding new session for %r: %s limit reached", route, reason)
+            raise SessionRejected(reason, get_setting("RETRY_AFTER", 5))
+
+
+def worker_load(contexts: Iterable[ApplicationContext]) -> Dict[str, Any]:
+    """ The load of this worker, for a balancer sending new sessions to the least loaded one.
+
+    Only reads sizes that the event loop keeps up to date, so it is cheap
+    enough to be polled every second. ``queued`` and ``shed`` count the new
+    sessions that waited for room or were rejected since the worker started.
+
+    """
+    routes: Dict[str, Dict[str, int]] = {}
+    for context in list(contexts):
+        sessions = list(context._sessions.values())
+        admission = getattr(context, "_admission", None)
+        routes[context.url or ""] = dict(
+            sessions=len(sessions),
+            pending=len(context._pending_sessions),
+            connections=sum(session.connection_count for session in sessions),
+            session_bytes=_session_bytes(context),
+            queued=admission.queued if admission is not None else 0,
+            shed=admission.shed if admission is not None else 0,
+        )
+    return dict(
+        pid=os.getpid(),
+        sessions=sum(route["sessions"] for route in routes.values()),
+        pending=sum(route["pending"] for route in routes.values()),
+        connections=sum(route["connections"] for route in routes.values()),
+        session_bytes=sum(route["session_bytes"] for route in routes.values()),
+        queued=sum(route["queued"] for route in routes.values()),
+        shed=sum(route["shed"] for route in routes.values()),
+        loop_lag=loop_lag.lag,
+        rss=_rss_bytes(),
+        draining=AdmissionControl.draining,
+        routes=routes,
+    )
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+
+def _session_bytes(context: ApplicationContext) -> int:
+    # the footprint of DjangoServerSession, kept up to date by its document
+    return sum(session.footprint.estimated_bytes for session in list(context._sessions.values())
+               if hasattr(session, "footprint"))
+
+
+def _rss_bytes() -> int | None:
+    # statm is much cheaper to read than status or smaps (Linux only)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
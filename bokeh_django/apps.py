@@ -26,6 +26,7 @@ from django.apps import AppConfig
 from django.conf import settings
 
 # Bokeh imports
+from .conf import get_setting
 from .routing import Routing, RoutingConfiguration
 
 # -----------------------------------------------------------------------------
@@ -57,7 +58,7 @@ class DjangoBokehConfig(AppConfig):
     @property
     def routes(self) -> RoutingConfiguration:
         if self._routes is None:
-            self._routes = RoutingConfiguration(self.bokeh_apps)
+            self._routes = RoutingConfiguration(self.bokeh_apps, load_url=get_setting("LOAD_URL"))
         return self._routes
 
 # -----------------------------------------------------------------------------
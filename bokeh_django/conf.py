@@ -0,0 +1,57 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+from typing import Any
+
+# External imports
+from django.conf import settings
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'get_setting',
+)
+
+PREFIX = "BOKEH_DJANGO_"
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+def get_setting(name: str, default: Any = None) -> Any:
+    """ Read a ``BOKEH_DJANGO_<name>`` value from the Django settings.
+
+    """
+    return getattr(settings, PREFIX + name, default)
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
@@ -20,22 +20,25 @@ log = logging.getLogger(__name__)
 # Standard library imports
 import asyncio
 import calendar
+import contextlib
 import datetime as dt
 import json
-from typing import Any, Dict, Set
+import os
+import time
+import weakref
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Pattern, Set, Tuple
 from urllib.parse import parse_qs, urljoin, urlparse
 
 # External imports
 from channels.consumer import AsyncConsumer
+from channels.exceptions import StopConsumer
 from channels.generic.http import AsyncHttpConsumer
 from channels.generic.websocket import AsyncWebsocketConsumer
-from tornado import locks
-from tornado.ioloop import IOLoop
 
 # Bokeh imports
-from bokeh.core.templates import AUTOLOAD_JS
-from bokeh.embed.bundle import Script, bundle_for_objs_and_resources
-from bokeh.embed.elements import script_for_render_items
+from bokeh.core.templates import AUTOLOAD_JS, get_env
+from bokeh.embed.bundle import Bundle, Script, bundle_for_objs_and_resources
+from bokeh.embed.elements import html_page_for_render_items, script_for_render_items
 from bokeh.embed.server import server_html_page_for_session
 from bokeh.embed.util import RenderItem
 from bokeh.protocol import Protocol
@@ -56,6 +59,17 @@ from bokeh.util.token import (
     get_token_payload,
 )
 
+# Local imports
+from . import metrics, push, timing, tracing
+from .admission import SessionRejected, loop_lag, worker_load
+from .conf import get_setting
+from .keepalive import idle_reaper
+from .limits import MessageLimits
+from .templates import templates
+
+if TYPE_CHECKING:
+    from .routing import Routing
+
 # -----------------------------------------------------------------------------
 # Globals and constants
 # -----------------------------------------------------------------------------
@@ -63,9 +77,15 @@ from bokeh.util.token import (
 __all__ = (
     'DocConsumer',
     'AutoloadJsConsumer',
+    'BatchAutoloadJsConsumer',
+    'LoadConsumer',
     'WSConsumer',
 )
 
+# Set in each worker by the ``runbokeh`` management command when it runs with ``--affinity``
+WORKER_ENV = "BOKEH_DJANGO_WORKER"
+WORKER_COOKIE = "bokeh_django_worker"
+
 # -----------------------------------------------------------------------------
 # General API
 # -----------------------------------------------------------------------------
@@ -77,31 +97,38 @@ class ConsumerHelper(AsyncConsumer):
 
     @property
     def request(self) -> "AttrDict":
-        request = AttrDict(self.scope)
-        request["arguments"] = self.arguments
-
-        # patch for panel 1.4
-        request['protocol'] = request.get('scheme')
-        for k, v in request.headers:
-            request[k.decode()] = v.decode()
-        request['uri'] = request.get('path')
-
-        return request
+        return request_from_scope(self.scope, self.arguments)
 
     @property
     def arguments(self) -> Dict[str, str]:
+        return {name: values[-1] for name, values in self.all_arguments.items()}
+
+    @property
+    def all_arguments(self) -> Dict[str, List[str]]:
         parsed_url = urlparse("/?" + self.scope["query_string"].decode())
-        return {name: value for name, [value] in parse_qs(parsed_url.query).items()}
+        return parse_qs(parsed_url.query)
 
     def get_argument(self, name: str, default: str | None = None) -> str | None:
         return self.arguments.get(name, default)
 
+    def get_arguments(self, name: str) -> List[str]:
+        return self.all_arguments.get(name, [])
+
     def resources(self, absolute_url: str | None = None) -> Resources:
-        mode = settings.resources()
-        if mode == "server":
-            root_url = urljoin(absolute_url, self._prefix) if absolute_url else self._prefix
-            return Resources(mode="server", root_url=root_url, path_versioner=StaticHandler.append_version)
-        return Resources(mode=mode)
+        return resources_for(self._prefix, absolute_url)
+
+    @property
+    def route(self) -> str:
+        routing = getattr(self, "_routing", None)
+        return routing.url if routing is not None else ""
+
+    def affinity_headers(self) -> List[Tuple[bytes, bytes]]:
+        # Pin the browser (and so the websocket that follows) to the worker holding the session
+        worker = os.environ.get(WORKER_ENV)
+        if worker is None:
+            return []
+        cookie = f"{WORKER_COOKIE}={worker}; Path=/; HttpOnly; SameSite=Lax"
+        return [(b"Set-Cookie", cookie.encode())]
 
 
 class SessionConsumer(AsyncHttpConsumer, ConsumerHelper):
@@ -110,50 +137,39 @@ class SessionConsumer(AsyncHttpConsumer, ConsumerHelper):
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
+        tracing.routed()
         self._application_context = kwargs.get('app_context')
+        self._routing = kwargs.get('routing')
 
     @property
     def application_context(self) -> ApplicationContext:
-        # backwards compatibility
         if self._application_context is None:
-            self._application_context = self.scope["url_route"]["kwargs"]["app_context"]
-
-        # XXX: accessing asyncio's IOLoop directly doesn't work
-        if self._application_context.io_loop is None:
-            self._application_context._loop = IOLoop.current()
+            if self._routing is not None:
+                # built on the first request of the route
+                self._application_context = self._routing.app_context
+            else:
+                # backwards compatibility
+                self._application_context = self.scope["url_route"]["kwargs"]["app_context"]
         return self._application_context
 
-    async def _get_session(self) -> ServerSession:
-        session_id = self.arguments.get('bokeh-session-id',
-                                        generate_session_id(secret_key=None, signed=False))
-        payload = dict(
-            headers={k.decode('utf-8'): v.decode('utf-8') for k, v in self.request.headers},
-            cookies=dict(self.request.cookies),
-        )
-        token = generate_jwt_token(session_id,
-                                   secret_key=None,
-                                   signed=False,
-                                   expiration=300,
-                                   extra_payload=payload)
+    async def http_request(self, message: Dict[str, Any]) -> None:
         try:
-            session = await self.application_context.create_session_if_needed(session_id, self.request, token)
-        except Exception as e:
-            log.exception(e)
-        return session
-
-
-class AutoloadJsConsumer(SessionConsumer):
-
-    async def handle(self, body: bytes) -> None:
-        session = await self._get_session()
-
-        element_id = self.get_argument("bokeh-autoload-element", default=None)
-        if not element_id:
-            raise RuntimeError("No bokeh-autoload-element query parameter")
-
-        app_path = self.get_argument("bokeh-app-path", default="/")
-        absolute_url = self.get_argument("bokeh-absolute-url", default=None)
-
+            await super().http_request(message)
+        except SessionRejected as e:
+            headers = [(b"Retry-After", str(e.retry_after).encode()), (b"Content-Type", b"text/plain")]
+            await self.send_response(503, str(e).encode(), headers=headers)
+            raise StopConsumer()
+
+    async def _get_session(self, admitted: asyncio.Future[None] | None = None) -> ServerSession:
+        request = self.request
+        # bokeh.embed.server_session sends the id of a pre-created session as a header
+        session_id = self.arguments.get('bokeh-session-id', request.get('bokeh-session-id'))
+        if session_id is None:
+            session_id = generate_session_id(secret_key=None, signed=False)
+        with tracing.span("get_session", route=self.route, session_id=session_id):
+            return await create_session(self.application_context, request, session_id, admitted)
+
+    def bundle(self, absolute_url: str | None = None) -> Bundle:
         server_url: str | None
         if absolute_url:
             server_url = '{uri.scheme}://{uri.netloc}/'.format(uri=urlparse(absolute_url))
@@ -165,65 +181,222 @@ class AutoloadJsConsumer(SessionConsumer):
 
         root_url = urljoin(absolute_url, self._prefix) if absolute_url else self._prefix
         try:
-            bundle = bundle_for_objs_and_resources(None, resources, root_url=root_url)
+            return bundle_for_objs_and_resources(None, resources, root_url=root_url)
         except TypeError:
-            bundle = bundle_for_objs_and_resources(None, resources)
-
-        render_items = [RenderItem(token=session.token, elementid=element_id, use_for_title=False)]
-        bundle.add(Script(script_for_render_items({}, render_items, app_path=app_path, absolute_url=absolute_url)))
+            return bundle_for_objs_and_resources(None, resources)
 
+    async def send_autoload_js(self, bundle: Bundle, element_id: str | None) -> None:
         js = AUTOLOAD_JS.render(bundle=bundle, elementid=element_id)
         headers = [
             (b"Access-Control-Allow-Headers", b"*"),
             (b"Access-Control-Allow-Methods", b"PUT, GET, OPTIONS"),
             (b"Access-Control-Allow-Origin", b"*"),
-            (b"Content-Type", b"application/javascript")
+            (b"Content-Type", b"application/javascript"),
+            *self.affinity_headers(),
         ]
         await self.send_response(200, js.encode(), headers=headers)
 
 
+class AutoloadJsConsumer(SessionConsumer):
+
+    async def handle(self, body: bytes) -> None:
+        session = await self._get_session()
+
+        element_id = self.get_argument("bokeh-autoload-element", default=None)
+        if not element_id:
+            raise RuntimeError("No bokeh-autoload-element query parameter")
+
+        app_path = self.get_argument("bokeh-app-path", default="/")
+        absolute_url = self.get_argument("bokeh-absolute-url", default=None)
+
+        bundle = self.bundle(absolute_url)
+
+        render_items = [RenderItem(token=session.token, elementid=element_id, use_for_title=False)]
+        bundle.add(Script(script_for_render_items({}, render_items, app_path=app_path, absolute_url=absolute_url)))
+
+        await self.send_autoload_js(bundle, element_id)
+
+
+class BatchAutoloadJsConsumer(SessionConsumer):
+    """ Serve several autoload routes from one ``autoload.js`` request.
+
+    The query holds one ``bokeh-app-path`` and one ``bokeh-autoload-element``
+    per embedded app (in matching order) and optionally a single
+    ``bokeh-absolute-url`` with the base URL of the server. All sessions are
+    created concurrently and returned in one script that loads the BokehJS
+    resources once.
+
+    """
+
+    _routings: List[Tuple[Pattern[str], Routing]]
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._routings = kwargs.get('routings', [])
+
+    async def handle(self, body: bytes) -> None:
+        app_paths = self.get_arguments("bokeh-app-path")
+        element_ids = self.get_arguments("bokeh-autoload-element")
+        if not app_paths or len(app_paths) != len(element_ids):
+            await self.send_response(400, b"Expected matching bokeh-app-path and bokeh-autoload-element parameters")
+            return
+
+        absolute_url = self.get_argument("bokeh-absolute-url", default=None)
+
+        sessions = []
+        for app_path in app_paths:
+            with tracing.span("resolve", path=app_path):
+                resolved = resolve_routing(self._routings, app_path)
+            if resolved is None:
+                await self.send_response(404, f"No autoload route for {app_path}".encode())
+                return
+            application_context, url_route = resolved
+
+            request = self.request
+            request.update(path=app_path, uri=app_path, url_route=url_route)
+            session_id = generate_session_id(secret_key=None, signed=False)
+            sessions.append(create_session(application_context, request, session_id))
+
+        sessions = await asyncio.gather(*sessions)
+
+        bundle = self.bundle(absolute_url)
+        for session, app_path, element_id in zip(sessions, app_paths, element_ids):
+            render_items = [RenderItem(token=session.token, elementid=element_id, use_for_title=False)]
+            bundle.add(Script(script_for_render_items({}, render_items, app_path=app_path, absolute_url=absolute_url)))
+
+        await self.send_autoload_js(bundle, None)
+
+
+class LoadConsumer(AsyncHttpConsumer, ConsumerHelper):
+    """ Report the load of this worker as JSON (see ``worker_load``).
+
+    Answers ``503`` while the worker shuts down, so that balancers stop
+    sending it new sessions.
+
+    """
+
+    async def handle(self, body: bytes) -> None:
+        from .context import DjangoApplicationContext
+
+        loop_lag.start()
+        load = worker_load(DjangoApplicationContext._instances)
+        load["worker"] = os.environ.get(WORKER_ENV)
+        headers = [(b"Content-Type", b"application/json"), (b"Cache-Control", b"no-store")]
+        await self.send_response(503 if load["draining"] else 200, json.dumps(load).encode(), headers=headers)
+
+
 class DocConsumer(SessionConsumer):
 
     async def handle(self, body: bytes) -> None:
+        if self._routing is not None and self._routing.snapshots is not None:
+            await self._send_snapshot()
+            return
+
+        if self._routing is not None and self._routing.stream:
+            await self._stream_page()
+            return
+
         session = await self._get_session()
-        page = server_html_page_for_session(
-            session,
-            resources=self.resources(),
-            title=session.document.title,
-            template=session.document.template,
-            template_variables=session.document.template_variables
-        )
-        await self.send_response(200, page.encode(), headers=[(b"Content-Type", b"text/html")])
+        with tracing.span("html_page", route=self.route, session_id=session.id):
+            page = server_html_page_for_session(
+                session,
+                resources=self.resources(),
+                title=session.document.title,
+                template=templates.compiled(session.document.template),
+                template_variables=session.document.template_variables
+            )
+        headers = [(b"Content-Type", b"text/html"), *self.affinity_headers()]
+        await self.send_response(200, page.encode(), headers=headers)
+
+    async def _send_snapshot(self) -> None:
+        # Routes without Python callbacks are served as standalone pages, without session or websocket
+        path = self.scope["path"]
+        request = synthetic_request(path)
+        request["url_route"] = self.scope.get("url_route", request["url_route"])
+        snapshot = await self._routing.snapshots.get(path, lambda: self._routing.render_snapshot(request, self.resources()))
+
+        headers = [(b"ETag", snapshot.etag.encode()), (b"Cache-Control", b"no-cache")]
+        if_none_match = self.request.get("if-none-match")
+        if if_none_match is not None and snapshot.etag in (tag.strip() for tag in if_none_match.split(",")):
+            await self.send_response(304, b"", headers=headers)
+            return
+        await self.send_response(200, snapshot.html, headers=[(b"Content-Type", b"text/html"), *headers])
+
+    async def _stream_page(self) -> None:
+        # Send the head with the resource tags while the document is still being built,
+        # so that the browser downloads BokehJS in the meantime
+        admitted = asyncio.get_running_loop().create_future()
+        creating = asyncio.ensure_future(self._get_session(admitted))
+        # errors are logged by create_session, this one is not awaited when sending the head fails
+        creating.add_done_callback(lambda task: task.cancelled() or task.exception())
+        try:
+            # a request over the limits of admission control waits here and is answered with 503, not streamed
+            await asyncio.wait([creating, admitted], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            admitted.cancel()
+        if creating.done():
+            creating.result()
+
+        headers = [(b"Content-Type", b"text/html; charset=utf-8"), *self.affinity_headers()]
+        await self.send_headers(status=200, headers=headers)
+        await self.send_body(stream_head(self.resources()).encode(), more_body=True)
+
+        try:
+            session = await creating
+            with tracing.span("html_page", route=self.route, session_id=session.id):
+                tail = stream_tail(session)
+        except Exception as e:
+            # the 200 is already out, end the response instead of leaving the browser waiting for the rest
+            log.error("Error streaming page of %r: %s", self.route, e, exc_info=True)
+            await self.send_body(b"  </head>\n  <body>Internal Server Error</body>\n</html>\n")
+            return
+        await self.send_body(tail.encode())
 
 
 class WSConsumer(AsyncWebsocketConsumer, ConsumerHelper):
 
+    # The open websockets of this process, closed by ``bokeh_django.lifespan`` on shutdown
+    _instances: weakref.WeakSet[WSConsumer] = weakref.WeakSet()
+
     _clients: Set[ServerConnection]
 
     _application_context: ApplicationContext | None
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
+        tracing.routed()
         self._application_context = kwargs.get('app_context')
+        self._routing = kwargs.get('routing')
         self._clients = set()
-        self.lock = locks.Lock()
+        self._push_groups: List[str] = []
+        self._in_flight = 0
+        self._closing = False
+        # messages are sent as several frames, which must not interleave
+        self.lock = asyncio.Lock()
+        limits = getattr(self._routing, "limits", None) or MessageLimits()
+        self.limiter = limits.limiter(self.route)
+        idle_timeout = getattr(self._routing, "idle_timeout", None)
+        self.idle_timeout = idle_timeout if idle_timeout is not None else get_setting("WS_IDLE_TIMEOUT")
+        self.last_activity = time.monotonic()
 
     @property
     def application_context(self) -> ApplicationContext:
-        # backward compatiblity
         if self._application_context is None:
-            self._application_context = self.scope["url_route"]["kwargs"]["app_context"]
-
-        # Explicitly set io_loop here (likely running in multi-worker environment)
-        if self._application_context._loop is None:
-            self._application_context._loop = IOLoop.current()
-            log.debug("io_loop has been re-set")
-
+            if self._routing is not None:
+                # built on the first request of the route
+                self._application_context = self._routing.app_context
+            else:
+                # backward compatiblity
+                self._application_context = self.scope["url_route"]["kwargs"]["app_context"]
         return self._application_context
 
     async def connect(self):
         log.info('WebSocket connection opened')
 
+        with tracing.span("connect", route=self.route):
+            await self._connect()
+
+    async def _connect(self) -> None:
         subprotocols = self.scope["subprotocols"]
         if len(subprotocols) != 2 or subprotocols[0] != 'bokeh':
             await self.close()
@@ -234,20 +407,21 @@ class WSConsumer(AsyncWebsocketConsumer, ConsumerHelper):
             await self.close()
             raise RuntimeError("No token received in subprotocol header")
 
-        now = calendar.timegm(dt.datetime.now(dt.UTC).utctimetuple())
-        payload = get_token_payload(token)
-        if 'session_expiry' not in payload:
-            await self.close()
-            raise RuntimeError("Session expiry has not been provided")
-        elif now >= payload['session_expiry']:
-            await self.close()
-            raise RuntimeError("Token is expired.")
-        elif not check_token_signature(token,
-                                       signed=False,
-                                       secret_key=None):
-            session_id = get_session_id(token)
-            log.error("Token for session %r had invalid signature", session_id)
-            raise RuntimeError("Invalid token signature")
+        with tracing.span("check_token", route=self.route):
+            now = calendar.timegm(dt.datetime.now(dt.UTC).utctimetuple())
+            payload = get_token_payload(token)
+            if 'session_expiry' not in payload:
+                await self.close()
+                raise RuntimeError("Session expiry has not been provided")
+            elif now >= payload['session_expiry']:
+                await self.close()
+                raise RuntimeError("Token is expired.")
+            elif not check_token_signature(token,
+                                           signed=False,
+                                           secret_key=None):
+                session_id = get_session_id(token)
+                log.error("Token for session %r had invalid signature", session_id)
+                raise RuntimeError("Invalid token signature")
 
         def on_fully_opened(future):
             e = future.exception()
@@ -264,38 +438,107 @@ class WSConsumer(AsyncWebsocketConsumer, ConsumerHelper):
         task = asyncio.ensure_future(future)
         task.add_done_callback(on_fully_opened)
         await self.accept("bokeh")
+        self._instances.add(self)
+        if self.idle_timeout is not None:
+            idle_reaper.start()
 
     async def disconnect(self, close_code):
-        if hasattr(self, "connection"):
-            self.connection.session.destroy()
+        self._instances.discard(self)
+        session = self._detach()
+        if session is not None:
+            await self.application_context.discard_session(session)
+        for group in self._push_groups:
+            await self.channel_layer.group_discard(group, self.channel_name)
         await super().disconnect(close_code)
 
-    async def receive(self, text_data) -> None:
-        fragment = text_data
+    @property
+    def session(self) -> ServerSession | None:
+        """ The session of the connection, ``None`` before it is open and once it is detached. """
+        # ServerConnection.session asserts that the session is still attached
+        if not hasattr(self, "connection"):
+            return None
+        return self.connection._session
+
+    async def reap(self) -> None:
+        """ Close the websocket of a peer that stayed silent for longer than ``idle_timeout``.
+
+        The session is discarded at once, the ASGI server may only report the
+        disconnection much later.
+
+        """
+        log.info("Closing websocket of %r, idle for more than %ss", self.route, self.idle_timeout)
+        metrics.increment("ws_reaped", route=self.route)
+        self._instances.discard(self)
+        self._closing = True
+        await self.close(code=1001)  # going away
+        session = self._detach()
+        if session is not None:
+            await self.application_context.discard_session(session)
+
+    def _detach(self) -> ServerSession | None:
+        """ Detach the connection from its session, which is returned (once). """
+        session = self.session
+        if session is None:
+            return None
+        session.notify_connection_lost()
+        self.connection.detach_session()
+        self._clients.discard(self.connection)
+        return session
 
+    async def receive(self, text_data=None, bytes_data=None) -> None:
+        # the buffers of a Bokeh message arrive as binary frames
+        fragment = text_data if text_data is not None else bytes_data
+        self.last_activity = time.monotonic()
+        with self._handling():
+            await self._receive(fragment)
+
+    async def _receive(self, fragment: str | bytes) -> None:
+        if self._closing:
+            # frames that were on their way when the websocket was closed
+            return
+        violation = await self.limiter.admit(fragment)
+        if violation is not None:
+            code, reason = violation
+            log.warning("Closing websocket of %r: %s", self.route, reason)
+            self._closing = True
+            await self.close(code=code)
+            return
+
+        await self.application_context.touch_session(self.connection.session)
         message = await self.receiver.consume(fragment)
         if message:
-            work = await self.handler.handle(message, self.connection)
-            if work:
-                await self._send_bokeh_message(work)
+            self.limiter.message_done()
+            # the document sent on the first pull is usually the biggest message of a session
+            traced = tracing.span("pull_doc", route=self.route, session_id=self.connection.session.id) \
+                if message.msgtype == "PULL-DOC-REQ" else contextlib.nullcontext()
+            with traced:
+                session = self.connection.session
+                work = await timing.timed_call("message", message.msgtype, session, session.route,
+                                               self.handler.handle, message, self.connection)
+                if work:
+                    await self._send_bokeh_message(work)
 
     async def _async_open(self, token: str) -> None:
+        with tracing.span("async_open", route=self.route, session_id=get_session_id(token)):
+            await self._open(token)
+
+    async def _open(self, token: str) -> None:
         try:
             session_id = get_session_id(token)
 
-            # Ensure io_loop is set before creating session (likely running in multi-worker environment)
-            if self._application_context._loop is None:
-                self._application_context._loop = IOLoop.current()
-                log.debug("io_loop has been re-set")
-
             # Try to create or get session
             try:
                 session = await self.application_context.create_session_if_needed(session_id, self.request, token)
 
+            except SessionRejected:
+                raise
             except Exception as e:
                 log.error("Error creating session: %s", e)
                 raise e
 
+            # a reconnecting client brings a spilled session back into memory
+            await self.application_context.touch_session(session)
+
             protocol = Protocol()
             self.receiver = Receiver(protocol)
             log.debug("Receiver created for %r", protocol)
@@ -306,15 +549,26 @@ class WSConsumer(AsyncWebsocketConsumer, ConsumerHelper):
             self.connection = self._new_connection(protocol, self, self.application_context, session)
             log.info("ServerConnection created")
 
+            await self._join_push_groups(session)
+
+        except SessionRejected as e:
+            log.warning("Could not create new server session, reason: %s", e)
+            await self.close(code=1013)  # try again later
+            raise e
         except Exception as e:
             log.error("Could not create new server session, reason: %s", e)
             await self.close()
             raise e
 
-        msg = self.connection.protocol.create('ACK')
-        await self._send_bokeh_message(msg)
+        with tracing.span("ack", route=self.route, session_id=session_id):
+            msg = self.connection.protocol.create('ACK')
+            await self._send_bokeh_message(msg)
 
     async def _send_bokeh_message(self, message: Message) -> int:
+        route = self.route
+        if self._routing is not None and self._routing.transport is not None:
+            self._routing.transport.apply(message, route)
+
         sent = 0
         try:
             async with self.lock:
@@ -333,21 +587,52 @@ class WSConsumer(AsyncWebsocketConsumer, ConsumerHelper):
                     else:
                         # buffer is bokeh.core.serialization.Buffer (Bokeh 3)
                         header = {'id': buffer.id}
-                        payload = buffer.data.tobytes()
+                        payload = buffer.to_bytes()
 
-                    await self.send(text_data=json.dumps(header))
+                    header = json.dumps(header)
+                    await self.send(text_data=header)
                     await self.send(bytes_data=payload)
                     sent += len(header) + len(payload)
 
+            # a page that is only watched sends nothing, what the server sends it keeps it alive
+            self.last_activity = time.monotonic()
+
         except Exception as e:  # Tornado 4.x may raise StreamClosedError
             # on_close() is / will be called anyway
             log.exception(e)
             log.warning("Failed sending message as connection was closed")
+
+        metrics.increment("ws_messages_sent", route=route, msgtype=message.msgtype)
+        metrics.increment("ws_bytes_sent", sent, route=route, msgtype=message.msgtype)
         return sent
 
     async def send_message(self, message: Message) -> int:
         return await self._send_bokeh_message(message)
 
+    async def bokeh_push(self, message: Dict[str, Any]) -> None:
+        # a payload published with bokeh_django.push.publish
+        session = self.session
+        if session is not None:
+            with self._handling():
+                await push.apply_push(session, message, self._routing.url)
+
+    @contextlib.contextmanager
+    def _handling(self) -> Iterator[None]:
+        # counts the messages being handled, which a shutdown lets finish
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+
+    async def _join_push_groups(self, session: ServerSession) -> None:
+        if self.channel_layer is None or self._routing is None:
+            return
+        for topic in push.topics(session.document):
+            group = push.group_name(self._routing.url, topic)
+            await self.channel_layer.group_add(group, self.channel_name)
+            self._push_groups.append(group)
+
     def _new_connection(self,
             protocol: Protocol,
             socket: AsyncConsumer,
@@ -374,6 +659,136 @@ class AttrDict(dict):
     def __getattr__(self, key):
         return self[key]
 
+
+# Everything the page template renders before this marker was already sent by ``stream_head``
+_STREAM_MARKER = "<!-- bokeh-django: stream -->"
+
+_STREAM_TAIL = get_env().from_string(
+    "{% extends bokeh_django_page %}"
+    "{% block head %}" + _STREAM_MARKER + "{{ self.inner_head() }}\n  </head>\n{% endblock %}"
+)
+
+
+def request_from_scope(scope: Dict[str, Any], arguments: Dict[str, str]) -> AttrDict:
+    request = AttrDict(scope)
+    request["arguments"] = arguments
+
+    # patch for panel 1.4
+    request['protocol'] = request.get('scheme')
+    for k, v in request.headers:
+        request[k.decode()] = v.decode()
+    request['uri'] = request.get('path')
+
+    return request
+
+
+def resolve_routing(routings: List[Tuple[Pattern[str], Routing]],
+        app_path: str) -> Tuple[ApplicationContext, Dict[str, Any]] | None:
+    """ Find the application context of the first routing matching ``app_path``
+    together with the ``url_route`` that Channels would have put in the scope.
+
+    """
+    path = app_path.lstrip("/")
+    for pattern, routing in routings:
+        match = pattern.match(path)
+        if match:
+            kwargs = match.groupdict()
+            args = () if kwargs else match.groups()
+            return routing.app_context, dict(args=args, kwargs=kwargs)
+    return None
+
+
+async def create_session(application_context: ApplicationContext, request: AttrDict,
+        session_id: str, admitted: asyncio.Future[None] | None = None) -> ServerSession:
+    """ Get or create the session ``session_id`` with the headers and cookies of ``request``.
+
+    ``admitted`` is resolved once admission control let the session be
+    created, see ``DjangoApplicationContext.create_session_if_needed``.
+
+    """
+    from .context import DjangoApplicationContext
+
+    payload = dict(
+        headers={k.decode('utf-8'): v.decode('utf-8') for k, v in request.headers},
+        cookies=dict(request.cookies),
+    )
+    token = generate_jwt_token(session_id,
+                               secret_key=None,
+                               signed=False,
+                               expiration=300,
+                               extra_payload=payload)
+    options = {}
+    if isinstance(application_context, DjangoApplicationContext):
+        options["admitted"] = admitted
+    elif admitted is not None:
+        # no admission control
+        admitted.set_result(None)
+    try:
+        return await application_context.create_session_if_needed(session_id, request, token, **options)
+    except SessionRejected:
+        raise
+    except Exception as e:
+        log.exception(e)
+        raise
+
+
+def resources_for(prefix: str = "/", absolute_url: str | None = None) -> Resources:
+    mode = settings.resources()
+    if mode == "server":
+        root_url = urljoin(absolute_url, prefix) if absolute_url else prefix
+        return Resources(mode="server", root_url=root_url, path_versioner=StaticHandler.append_version)
+    return Resources(mode=mode)
+
+
+def stream_head(resources: Resources) -> str:
+    """ The start of a page, up to and including the BokehJS resource tags. """
+    bokeh_js, bokeh_css = bundle_for_objs_and_resources(None, resources)
+    return f'<!DOCTYPE html>\n<html lang="en">\n  <head>\n{bokeh_css}\n{bokeh_js}\n'
+
+
+def stream_tail(session: ServerSession) -> str:
+    """ The rest of the page of a session, following ``stream_head``.
+
+    The session's template is rendered as usual, except that its ``head`` block
+    only keeps the content of ``inner_head`` (title, preamble, postamble) with
+    the resources left out, since these were already sent.
+
+    """
+    document = session.document
+    template = templates.compiled(document.template)
+
+    render_item = RenderItem(token=session.token, roots=document.roots, use_for_title=True)
+    template_variables = {**document.template_variables, "bokeh_django_page": template}
+    html = html_page_for_render_items(("", ""), {}, [render_item], document.title,
+                                      template=_STREAM_TAIL, template_variables=template_variables)
+    return html.split(_STREAM_MARKER, 1)[1]
+
+
+def synthetic_request(path: str) -> AttrDict:
+    """ Build a request with the same shape as ``ConsumerHelper.request`` for
+    documents that are built outside of any HTTP or websocket connection.
+
+    """
+    request = AttrDict(
+        type="http",
+        scheme="http",
+        protocol="http",
+        path=path,
+        uri=path,
+        query_string=b"",
+        headers=[],
+        cookies={},
+        arguments={},
+        url_route={"args": (), "kwargs": {}},
+    )
+    try:
+        from django.contrib.auth.models import AnonymousUser
+    except Exception:
+        pass
+    else:
+        request["user"] = AnonymousUser()
+    return request
+
 # -----------------------------------------------------------------------------
 # Code
 # -----------------------------------------------------------------------------
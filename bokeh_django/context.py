@@ -0,0 +1,333 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import inspect
+import logging  # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import asyncio
+import weakref
+from typing import TYPE_CHECKING, Any, Callable, Tuple
+
+# External imports
+from channels.db import database_sync_to_async
+from tornado.ioloop import IOLoop
+
+# Bokeh imports
+from bokeh.application import Application
+from bokeh.application.handlers.function import FunctionHandler, handle_exception
+from bokeh.document import Document
+from bokeh.server.contexts import (
+    ApplicationContext,
+    BokehSessionContext,
+    ProtocolError,
+    ServerSession,
+    _RequestProxy,
+)
+from bokeh.settings import settings as bokeh_settings
+from bokeh.util.token import generate_session_id, get_token_payload
+
+# Local imports
+from . import tracing
+from .admission import AdmissionControl
+from .conf import get_setting
+from .consumers import synthetic_request
+from .session import DjangoServerSession
+from .spill import SpillStore
+
+if TYPE_CHECKING:
+    from bokeh.server.contexts import ID, HTTPServerRequest
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'AsyncApplication',
+    'AsyncFunctionHandler',
+    'DjangoApplicationContext',
+)
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+class AsyncApplication(Application):
+    async def create_document(self) -> Document:
+        """ Creates and initializes a document using the Application's handlers.
+
+        """
+        doc = Document()
+        await self.initialize_document(doc)
+        return doc
+
+    async def initialize_document(self, doc: Document) -> None:
+        """ Fills in a new document using the Application's handlers.
+
+        """
+        for h in self._handlers:
+            result = h.modify_document(doc)
+            if inspect.iscoroutine(result):
+                await result
+            if h.failed:
+                log.error("Error running application handler %r: %s %s ", h, h.error, h.error_detail)
+
+        if bokeh_settings.perform_document_validation():
+            doc.validate()
+
+
+class AsyncFunctionHandler(FunctionHandler):
+    async def modify_document(self, doc: Document) -> None:
+        """ Execute the configured ``func`` to modify the document.
+
+        After this method is first executed, ``safe_to_fork`` will return
+        ``False``.
+
+        """
+        try:
+            await self._func(doc)
+        except Exception as e:
+            if self._trap_exceptions:
+                handle_exception(self, e)
+            else:
+                raise
+        finally:
+            self._safe_to_fork = False
+
+
+class DjangoApplicationContext(ApplicationContext):
+    # All contexts of this process, for limits and reports that span every route
+    _instances: weakref.WeakSet[DjangoApplicationContext] = weakref.WeakSet()
+
+    _admission: AdmissionControl
+    _maintenance: asyncio.Task | None
+    _spill: SpillStore | None
+    _shared_session_id: ID | None
+    _diff_data: bool
+
+    def __init__(self, *args: Any, max_sessions: int | None = None, max_pending_sessions: int | None = None,
+            spill_after: float | None = None, shared: bool = False, diff_data: bool | None = None,
+            **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._admission = AdmissionControl(max_sessions, max_pending_sessions)
+        self._maintenance = None
+        if spill_after is None:
+            spill_after = get_setting("SPILL_AFTER")
+        self._spill = SpillStore(spill_after) if spill_after is not None else None
+        self._shared_session_id = generate_session_id(secret_key=None, signed=False) if shared else None
+        self._diff_data = diff_data if diff_data is not None else get_setting("DIFF_DATA", False)
+        self._closing = False
+        self._instances.add(self)
+
+    async def create_session_if_needed(self, session_id: ID, request: HTTPServerRequest | None = None,
+            token: str | None = None, admitted: asyncio.Future[None] | None = None) -> ServerSession:
+        """ The session ``session_id``, created if needed once admission control lets it.
+
+        ``admitted`` is resolved as soon as the session holds its place among the
+        sessions of the route, before its document is built.
+
+        """
+        # this is because empty session_ids would be "falsey" and
+        # potentially open up a way for clients to confuse us
+        if len(session_id) == 0:
+            raise ProtocolError("Session ID must not be empty")
+
+        if self._shared_session_id is not None:
+            # every viewer gets the one session of the route, built without any viewer's request or token
+            session_id = self._shared_session_id
+            request = synthetic_request(self.url or "/")
+            token = None
+
+        self._bind_loop()
+        if session_id not in self._sessions and \
+           session_id not in self._pending_sessions:
+            await self._admission.admit(self, self._instances)
+            self._start_maintenance()
+
+        # check again, the same session may have been started while waiting for admission
+        if session_id not in self._sessions and \
+           session_id not in self._pending_sessions:
+            future = self._pending_sessions[session_id] = asyncio.get_running_loop().create_future()
+            _resolve(admitted)
+            try:
+                session, session_context = await self._new_session(session_id, request, token)
+            except BaseException as e:
+                del self._pending_sessions[session_id]
+                # everyone waiting on the pending session gets the error instead of waiting forever
+                if not isinstance(e, Exception):
+                    e = RuntimeError(f"Creating session {session_id!r} was cancelled")
+                future.set_exception(e)
+                # retrieved here, there may be nobody waiting
+                future.exception()
+                raise
+
+            del self._pending_sessions[session_id]
+            self._sessions[session_id] = session
+            session_context._set_session(session)
+            self._session_contexts[session_id] = session_context
+
+            # notify anyone waiting on the pending session
+            future.set_result(session)
+
+        _resolve(admitted)
+        if session_id in self._pending_sessions:
+            # another create_session_if_needed is working on
+            # creating this session
+            session = await self._pending_sessions[session_id]
+        else:
+            session = self._sessions[session_id]
+
+        return session
+
+    async def discard_session(self, session: ServerSession) -> None:
+        """ Destroy a session whose last connection has gone and forget about it.
+
+        """
+        if session.destroyed or session.connection_count > 0 or session.id not in self._sessions:
+            return
+        if session.id == self._shared_session_id:
+            return
+        await self._discard_session(session, lambda session: session.connection_count == 0)
+
+    async def touch_session(self, session: ServerSession) -> None:
+        """ Record that a client used the session, bringing back its data if it was spilled.
+
+        """
+        if self._spill is not None:
+            await self._spill.touch(session)
+
+    async def close(self) -> None:
+        """ Destroy every session without connections, the shared one included, running their destroy hooks,
+        and remove the spilled files.
+
+        """
+        self._closing = True
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+            self._maintenance = None
+        for session in list(self._sessions.values()):
+            if session.connection_count > 0:
+                log.warning("Not destroying session %r, it still has connections", session.id)
+                continue
+            try:
+                await self._discard_session(session, lambda session: True)
+            except Exception as e:
+                log.error("Error destroying session %r: %s", session.id, e, exc_info=True)
+        if self._spill is not None:
+            self._spill.close()
+
+    async def _discard_session(self, session: ServerSession, should_discard: Callable[[ServerSession], bool]) -> None:
+        if session.id == self._shared_session_id and not self._closing:
+            # kept for the lifetime of the worker, like the app itself
+            return
+        await super()._discard_session(session, should_discard)
+        if self._spill is not None and session.destroyed:
+            self._spill.forget(session)
+
+    async def _new_session(self, session_id: ID, request: HTTPServerRequest | None,
+            token: str | None) -> Tuple[DjangoServerSession, BokehSessionContext]:
+        doc = Document()
+
+        session_context = BokehSessionContext(session_id,
+                                              self.server_context,
+                                              doc,
+                                              logout_url=self._logout_url)
+        if request is not None:
+            payload = get_token_payload(token) if token else {}
+            if ('cookies' in payload and 'headers' in payload
+                and not 'Cookie' in payload['headers']):
+                # Restore Cookie header from cookies dictionary
+                payload['headers']['Cookie'] = '; '.join([
+                    f'{k}={v}' for k, v in payload['cookies'].items()
+                ])
+            # using private attr so users only have access to a read-only property
+            session_context._request = _RequestProxy(request,
+                                                     cookies=payload.get('cookies'),
+                                                     headers=payload.get('headers'))
+        session_context._token = token
+
+        # expose the session context to the document
+        # use the _attribute to set the public property .session_context
+        doc._session_context = weakref.ref(session_context)
+
+        with tracing.span("on_session_created", route=self.url, session_id=session_id):
+            try:
+                await self._application.on_session_created(session_context)
+            except Exception as e:
+                log.error("Failed to run session creation hooks %r", e, exc_info=True)
+
+        with tracing.span("initialize_document", route=self.url, session_id=session_id):
+            await self._initialize_document(doc)
+
+        session = DjangoServerSession(session_id, doc, io_loop=self._loop, token=token,
+                                      shared=self._shared_session_id is not None,
+                                      diff_data=self._diff_data, route=self.url or "", spill=self._spill)
+        return session, session_context
+
+    def _bind_loop(self) -> None:
+        # Bokeh's sessions schedule their callbacks through a tornado IOLoop, which wraps the running asyncio loop
+        loop = asyncio.get_running_loop()
+        if self._loop is None or getattr(self._loop, "asyncio_loop", None) is not loop:
+            self._loop = IOLoop.current()
+
+    def _start_maintenance(self) -> None:
+        # Discards sessions that were created by an HTTP request but never connected to, like Bokeh's server does
+        loop = asyncio.get_running_loop()
+        if self._maintenance is not None and not self._maintenance.done() and self._maintenance.get_loop() is loop:
+            return
+        self._maintenance = loop.create_task(self._maintain())
+
+    async def _maintain(self) -> None:
+        check_seconds = get_setting("CHECK_UNUSED_SESSIONS_MS", 17000) / 1000
+        unused_lifetime_ms = get_setting("UNUSED_SESSION_LIFETIME_MS", 15000)
+        while True:
+            await asyncio.sleep(check_seconds)
+            try:
+                await self._cleanup_sessions(unused_lifetime_ms)
+            except Exception as e:
+                log.error("Error cleaning up unused sessions %r", e, exc_info=True)
+            if self._spill is not None:
+                try:
+                    await self._spill.sweep(self._sessions.values(), route=self.url or "")
+                except Exception as e:
+                    log.error("Error spilling idle sessions %r", e, exc_info=True)
+
+    async def _initialize_document(self, doc: Document) -> None:
+        if isinstance(self._application, AsyncApplication):
+            await self._application.initialize_document(doc)
+        else:
+            # This needs to be wrapped in the database_sync_to_async wrapper just in case the handler function
+            # accesses Django ORM.
+            await database_sync_to_async(self._application.initialize_document)(doc)
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+
+def _resolve(admitted: asyncio.Future[None] | None) -> None:
+    if admitted is not None and not admitted.done():
+        admitted.set_result(None)
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
@@ -0,0 +1,444 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+""" Share large read-only datasets between all workers and sessions.
+
+A dataset is written once, as one ``.npy`` file per column, and every process
+maps these files read-only. The pages are shared through the operating
+system's page cache, however many workers and sessions use the dataset.
+
+.. code-block:: python
+
+    from bokeh_django.datasets import store
+
+    store.register("sea_surface", lambda: pd.read_csv(SEA_SURFACE_CSV, parse_dates=["time"]))
+
+    def sea_surface_handler(doc):
+        df = store.attach("sea_surface", document=doc).data
+        ...
+
+Names of datasets are used as directory names: they must not be empty, start
+with a dot or contain a path separator, and ``ValueError`` is raised otherwise.
+
+Registering a name that already exists does not call the loader again, so the
+data is loaded by the first worker only. ``register(..., replace=True)`` writes
+a new version: later ``attach`` calls get the new data, while sessions that
+attached the old version keep it until they release it.
+
+"""
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import contextlib
+import json
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# External imports
+import numpy as np
+
+# Local imports
+from .conf import get_setting
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from bokeh.document import Document
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'Dataset',
+    'DatasetStore',
+    'store',
+)
+
+DatasetLike = Union[np.ndarray, Dict[str, Any], "pd.DataFrame"]
+
+CURRENT = "CURRENT"
+META = "meta.json"
+
+# Prefix of the columns holding where the values of a string column are missing
+MISSING = "__missing__"
+
+# Column holding the index of a DataFrame that is not a RangeIndex
+INDEX = "__index__"
+
+_SMAPS_HEADER = re.compile(r"^[0-9a-f]+-[0-9a-f]+\s")
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+class Dataset:
+    """ One attachment to a version of a dataset, released with ``release()``. """
+
+    def __init__(self, store: DatasetStore, name: str, version: int, data: DatasetLike) -> None:
+        self.store = store
+        self.name = name
+        self.version = version
+        self.data = data
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.store._release(self.name, self.version)
+
+    def __enter__(self) -> Dataset:
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.release()
+
+    def __repr__(self) -> str:
+        return f"<Dataset {self.name!r} version {self.version}>"
+
+
+class DatasetStore:
+    """ Named, versioned datasets kept in memory-mapped files.
+
+    Supported values are numpy arrays, dicts of one-dimensional arrays and
+    pandas DataFrames. Numeric and datetime columns are mapped without
+    copying, timezone-aware ones are stored in UTC and converted back to
+    their timezone when attached. Columns of strings are stored as
+    fixed-width strings, with their missing values (``None`` or ``NaN``)
+    coming back as ``None``, and are copied into Python objects in every
+    process. Other object columns raise ``TypeError``.
+
+    Files go to ``directory``, by default ``BOKEH_DJANGO_DATASET_DIR`` or a
+    ``bokeh_django_datasets`` directory in the temporary directory. All
+    workers of a deployment must use the same directory.
+
+    """
+
+    def __init__(self, directory: str | os.PathLike[str] | None = None) -> None:
+        self._directory = directory
+        self._attached: Dict[Tuple[str, int], DatasetLike] = {}
+        self._refcounts: Dict[Tuple[str, int], int] = {}
+
+    @property
+    def directory(self) -> Path:
+        directory = self._directory
+        if directory is None:
+            directory = get_setting("DATASET_DIR") or Path(tempfile.gettempdir()) / "bokeh_django_datasets"
+        return Path(directory)
+
+    def register(self, name: str, data: DatasetLike | Callable[[], DatasetLike], *, replace: bool = False) -> int:
+        """ Store a dataset under ``name``, unless it exists and ``replace`` is false.
+
+        ``data`` may be a callable, which is only called when the data has to
+        be written. Returns the current version.
+
+        """
+        _check_name(name)
+        with self._locked(name):
+            current = self.current_version(name)
+            if current is not None and not replace:
+                return current
+
+            if callable(data):
+                data = data()
+            version = max(self._versions(name), default=0) + 1
+            self._write(name, version, data)
+            log.info("Registered dataset %r version %d", name, version)
+
+        self.collect(name)
+        return version
+
+    def attach(self, name: str, *, document: Document | None = None) -> Dataset:
+        """ Map the current version of ``name``.
+
+        With a ``document``, the dataset is released when its session is destroyed.
+
+        """
+        version = self.current_version(name)
+        if version is None:
+            raise KeyError(f"No dataset named {name!r}")
+
+        key = (name, version)
+        if key not in self._attached:
+            self._attached[key] = self._read(name, version)
+            marker = self._version_dir(name, version) / "refs" / str(os.getpid())
+            marker.parent.mkdir(exist_ok=True)
+            marker.touch()
+        self._refcounts[key] = self._refcounts.get(key, 0) + 1
+
+        dataset = Dataset(self, name, version, self._attached[key])
+        if document is not None:
+            document.on_session_destroyed(lambda session_context: dataset.release())
+        return dataset
+
+    def current_version(self, name: str) -> int | None:
+        _check_name(name)
+        try:
+            return int((self.directory / name / CURRENT).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def collect(self, name: str | None = None) -> None:
+        """ Delete the versions that are not current and not attached by any live process. """
+        if name is not None:
+            _check_name(name)
+        names = [name] if name is not None else self._names()
+        for name in names:
+            current = self.current_version(name)
+            for version in self._versions(name):
+                if version != current and not self._live_refs(name, version):
+                    shutil.rmtree(self._version_dir(name, version), ignore_errors=True)
+
+    def report(self) -> List[Dict[str, Any]]:
+        """ Size on disk, users and memory use (in this process) of every version.
+
+        ``rss`` and ``pss`` (Linux only) are the bytes of the dataset resident
+        in this process; ``pss`` divides shared pages between the processes
+        mapping them.
+
+        """
+        mapped = _mapped_memory(self.directory)
+        report = []
+        for name in self._names():
+            current = self.current_version(name)
+            for version in self._versions(name):
+                directory = self._version_dir(name, version)
+                memory = mapped.get(directory.resolve(), {})
+                report.append(dict(
+                    name=name,
+                    version=version,
+                    current=version == current,
+                    nbytes=sum(f.stat().st_size for f in directory.glob("*.npy")),
+                    refcount=self._refcounts.get((name, version), 0),
+                    processes=len(self._live_refs(name, version)),
+                    rss=memory.get("Rss", 0),
+                    pss=memory.get("Pss", 0),
+                ))
+        return report
+
+    def _release(self, name: str, version: int) -> None:
+        key = (name, version)
+        self._refcounts[key] -= 1
+        if self._refcounts[key] > 0:
+            return
+        del self._refcounts[key]
+        del self._attached[key]
+        with contextlib.suppress(OSError):
+            (self._version_dir(name, version) / "refs" / str(os.getpid())).unlink()
+        if version != self.current_version(name):
+            self.collect(name)
+
+    def _version_dir(self, name: str, version: int) -> Path:
+        return self.directory / name / str(version)
+
+    def _names(self) -> List[str]:
+        if not self.directory.exists():
+            return []
+        return sorted(entry.name for entry in self.directory.iterdir() if entry.is_dir())
+
+    def _versions(self, name: str) -> List[int]:
+        directory = self.directory / name
+        if not directory.exists():
+            return []
+        return sorted(int(entry.name) for entry in directory.iterdir() if entry.is_dir() and entry.name.isdigit())
+
+    def _live_refs(self, name: str, version: int) -> List[int]:
+        refs = self._version_dir(name, version) / "refs"
+        if not refs.exists():
+            return []
+        return [int(ref.name) for ref in refs.iterdir() if ref.name.isdigit() and _is_alive(int(ref.name))]
+
+    @contextlib.contextmanager
+    def _locked(self, name: str) -> Iterator[None]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / f".{name}.lock", "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _write(self, name: str, version: int, data: DatasetLike) -> None:
+        kind, columns, meta = _columns_of(data)
+
+        final = self._version_dir(name, version)
+        building = final.with_name(f".{version}.tmp")
+        shutil.rmtree(building, ignore_errors=True)
+        building.mkdir(parents=True)
+        for i, column in enumerate(columns.values()):
+            np.save(building / f"{i}.npy", column, allow_pickle=False)
+        (building / META).write_text(json.dumps(dict(meta, kind=kind, columns=list(columns))))
+        os.rename(building, final)
+
+        # readers see either the old or the new version, never a partial one
+        pointer = self.directory / name / f".{CURRENT}.tmp"
+        pointer.write_text(str(version))
+        os.replace(pointer, self.directory / name / CURRENT)
+
+    def _read(self, name: str, version: int) -> DatasetLike:
+        directory = self._version_dir(name, version)
+        meta = json.loads((directory / META).read_text())
+        columns = {column: np.load(directory / f"{i}.npy", mmap_mode="r") for i, column in enumerate(meta["columns"])}
+
+        for column in meta.get("missing", []):
+            values = columns[column].astype(object)
+            values[columns.pop(MISSING + column)] = None
+            columns[column] = values
+        if meta.get("tz"):
+            import pandas as pd
+            for column, tz in meta["tz"].items():
+                columns[column] = pd.DatetimeIndex(columns[column]).tz_localize("UTC").tz_convert(tz).array
+
+        if meta["kind"] == "ndarray":
+            return columns["values"]
+        if meta["kind"] == "dict":
+            return columns
+
+        import pandas as pd
+        index = columns.pop(INDEX, None)
+        if index is None:
+            index = pd.RangeIndex(*meta["range_index"])
+        else:
+            index = pd.Index(index, copy=False)
+        return pd.DataFrame(columns, index=index, copy=False)
+
+
+store = DatasetStore()
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+
+def _columns_of(data: DatasetLike) -> Tuple[str, Dict[str, np.ndarray], Dict[str, Any]]:
+    columns: Dict[str, np.ndarray] = {}
+    meta: Dict[str, Any] = {}
+    if isinstance(data, np.ndarray):
+        _add_column(columns, meta, "values", data)
+        return "ndarray", columns, meta
+    if isinstance(data, dict):
+        for name, column in data.items():
+            _add_column(columns, meta, _column_name(name), column)
+        return "dict", columns, meta
+
+    import pandas as pd
+    if not isinstance(data, pd.DataFrame):
+        raise TypeError(f"Cannot store {type(data).__name__}, expected an ndarray, a dict of arrays or a DataFrame")
+
+    for name in data.columns:
+        _add_column(columns, meta, _column_name(name), data[name])
+    if isinstance(data.index, pd.RangeIndex):
+        meta["range_index"] = [data.index.start, data.index.stop, data.index.step]
+    else:
+        _add_column(columns, meta, INDEX, data.index)
+    return "frame", columns, meta
+
+
+def _check_name(name: str) -> None:
+    if not isinstance(name, str) or not name or name.startswith(".") or "\0" in name \
+            or any(sep in name for sep in (os.sep, os.altsep, "/") if sep):
+        raise ValueError(f"Invalid dataset name {name!r}, it must be a file name that does not start with a dot")
+
+
+def _column_name(name: Any) -> str:
+    name = str(name)
+    if name.startswith(MISSING) or name == INDEX:
+        raise ValueError(f"Invalid column name {name!r}, {MISSING}* and {INDEX} are reserved")
+    return name
+
+
+def _add_column(columns: Dict[str, np.ndarray], meta: Dict[str, Any], name: str, column: Any) -> None:
+    """ Add ``column`` as an array that can be memory-mapped, noting in ``meta`` how to restore it. """
+    tz = getattr(getattr(column, "dtype", None), "tz", None)
+    if tz is not None:
+        import pandas as pd
+        columns[name] = pd.DatetimeIndex(column).tz_convert("UTC").tz_localize(None).to_numpy()
+        meta.setdefault("tz", {})[name] = str(tz)
+        return
+
+    array = np.asarray(column)
+    if array.dtype.kind != "O":
+        columns[name] = array
+        return
+
+    # object arrays cannot be memory-mapped, only strings are stored in their place
+    missing = np.fromiter((_is_missing(value) for value in array.flat), dtype=bool, count=array.size)
+    missing = missing.reshape(array.shape)
+    others = sorted({type(value).__name__ for value in array[~missing] if not isinstance(value, str)})
+    if others:
+        raise TypeError(f"Cannot store column {name!r}: object columns may only hold strings and missing "
+                        f"values, found {', '.join(others)}")
+    columns[name] = np.where(missing, "", array).astype(str)
+    if missing.any():
+        columns[MISSING + name] = missing
+        meta.setdefault("missing", []).append(name)
+
+
+def _is_missing(value: Any) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, float):
+        return value != value
+    # pandas.NA and pandas.NaT
+    return type(value).__name__ in ("NAType", "NaTType")
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _mapped_memory(directory: Path) -> Dict[Path, Dict[str, int]]:
+    """ Resident bytes of the files mapped from ``directory``, by version directory. """
+    memory: Dict[Path, Dict[str, int]] = {}
+    try:
+        with open("/proc/self/smaps") as f:
+            lines = f.readlines()
+    except OSError:
+        return memory
+
+    prefix = str(directory.resolve())
+    current: Dict[str, int] | None = None
+    for line in lines:
+        fields = line.split()
+        if _SMAPS_HEADER.match(line):
+            mapped = len(fields) >= 6 and fields[5].startswith(prefix)
+            current = memory.setdefault(Path(fields[5]).parent, {}) if mapped else None
+        elif current is not None and fields and fields[0] in ("Rss:", "Pss:"):
+            key = fields[0][:-1]
+            current[key] = current.get(key, 0) + int(fields[1]) * 1024
+    return memory
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
@@ -0,0 +1,189 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import asyncio
+from typing import TYPE_CHECKING, Dict, List, Literal, Sequence, Set, Tuple
+from urllib.parse import urlencode
+
+# External imports
+from django.apps import apps
+
+# Bokeh imports
+from bokeh.core.templates import AUTOLOAD_REQUEST_TAG
+from bokeh.embed.server import (
+    _clean_url,
+    _get_app_path,
+    _process_arguments,
+    _process_resources,
+    server_session,
+)
+from bokeh.util.serialization import make_globally_unique_css_safe_id
+from bokeh.util.token import generate_session_id
+
+# Local imports
+from .admission import SessionRejected
+from .consumers import create_session, request_from_scope
+from .routing import BATCH_AUTOLOAD_URL
+
+if TYPE_CHECKING:
+    from django.http import HttpRequest
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'server_batch_document',
+    'server_session_for_request',
+)
+
+# Keeps sessions started by ``server_session_for_request`` from being garbage collected while they build
+_pending_sessions: Set[asyncio.Task] = set()
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+def server_batch_document(urls: Sequence[str], batch_url: str | None = None, absolute_url: str | None = None,
+        resources: Literal["default"] | None = "default", arguments: Dict[str, str] | None = None,
+        headers: Dict[str, str] | None = None, with_credentials: bool = False) -> Tuple[str, List[str]]:
+    """ Embed several autoload apps with a single ``autoload.js`` request.
+
+    Each entry of ``urls`` must match an ``autoload`` route. The sessions of all
+    apps are created together and the BokehJS resources are loaded only once.
+
+    Args:
+        urls (seq[str]) : the URLs (or paths) of the autoload routes to embed
+        batch_url (str, optional) : URL of the batch autoload route
+            (default: ``/bokeh-django/autoload.js``)
+        absolute_url (str, optional) : base URL of the server, if the page is
+            served from another origin
+        resources, arguments, headers, with_credentials :
+            same as for ``bokeh.embed.server_document``
+
+    Returns:
+        (script, divs) : the ``<script>`` tag making the request and one
+        placeholder ``<div>`` per URL, in the order of ``urls``
+
+    """
+    if batch_url is None:
+        batch_url = "/" + BATCH_AUTOLOAD_URL
+
+    query: List[Tuple[str, str]] = []
+    divs: List[str] = []
+    for url in urls:
+        elementid = make_globally_unique_css_safe_id()
+        query += [("bokeh-app-path", _get_app_path(_clean_url(url))), ("bokeh-autoload-element", elementid)]
+        divs.append(f'<div id="{elementid}"></div>')
+    if absolute_url is not None:
+        query.append(("bokeh-absolute-url", absolute_url))
+
+    src_path = f"{batch_url}?{urlencode(query)}"
+    src_path += _process_resources(resources)
+    src_path += _process_arguments(arguments)
+
+    if headers and with_credentials:
+        raise ValueError("'headers' and 'with_credentials' are mutually exclusive")
+    elif not headers:
+        headers = {}
+
+    script = AUTOLOAD_REQUEST_TAG.render(
+        src_path         = src_path,
+        app_path         = batch_url,
+        elementid        = make_globally_unique_css_safe_id(),
+        headers          = headers,
+        with_credentials = with_credentials,
+    )
+    return script, divs
+
+
+async def server_session_for_request(request: HttpRequest, url: str | None = None, relative_urls: bool = False,
+        resources: Literal["default"] | None = "default") -> str:
+    """ Start creating the session of an autoload route from a Django view.
+
+    The document is built in the background while the page is sent to the
+    browser, and the returned ``<script>`` tag attaches to that session instead
+    of asking for a new one. The session is created with the view's request, so
+    handlers see the same headers, cookies and user.
+
+    The session lives in the worker process that ran the view, which the
+    websocket of the script must reach. Another worker builds a session of
+    its own, and the one built by the view is only discarded once it has been
+    unused for ``BOKEH_DJANGO_UNUSED_SESSION_LIFETIME_MS``.
+
+    Args:
+        request (HttpRequest) : the request of an async (ASGI) Django view
+        url (str, optional) : URL of the autoload route (default: ``request.path``)
+        relative_urls, resources : same as for ``bokeh.embed.server_session``
+
+    Returns:
+        str : a ``<script>`` tag to render in the template
+
+    """
+    scope = getattr(request, "scope", None)
+    if scope is None:
+        raise ValueError("server_session_for_request needs a request served through ASGI")
+
+    if url is None:
+        url = request.path
+    app_path = _get_app_path(_clean_url(url))
+
+    resolved = apps.get_app_config('bokeh_django').routes.resolve_autoload(app_path)
+    if resolved is None:
+        raise ValueError(f"No autoload route matches {url!r}")
+    application_context, url_route = resolved
+
+    session_request = request_from_scope(scope, {name: request.GET[name] for name in request.GET})
+    session_request.update(path=app_path, uri=app_path, url_route=url_route)
+    if "cookies" not in session_request:
+        session_request["cookies"] = request.COOKIES
+
+    session_id = generate_session_id(secret_key=None, signed=False)
+    task = asyncio.ensure_future(create_session(application_context, session_request, session_id))
+    _pending_sessions.add(task)
+    task.add_done_callback(lambda task: _session_created(task, session_id))
+
+    return server_session(session_id=session_id, url=url, relative_urls=relative_urls, resources=resources)
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+
+def _session_created(task: asyncio.Task, session_id: str) -> None:
+    # nobody awaits the task, its error is retrieved here
+    _pending_sessions.discard(task)
+    if task.cancelled():
+        log.warning("Creating session %r for a view was cancelled", session_id)
+        return
+    e = task.exception()
+    if isinstance(e, SessionRejected):
+        log.warning("Session %r for a view was not created: %s", session_id, e)
+    elif e is not None:
+        log.error("Could not create session %r for a view: %s", session_id, e)
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
@@ -0,0 +1,233 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+""" Estimate how much memory each session takes.
+
+Every ``DjangoServerSession`` keeps a ``SessionFootprint`` of its document:
+the number of models, the bytes of the ``ColumnDataSource`` columns and the
+periodic callbacks. The column sizes are updated from the change events of
+the document, one source at a time, and the sources are only looked up again
+when models are added or removed. This bookkeeping is left out of the time of
+the callbacks that change the document, see ``bokeh_django.timing``.
+
+Columns backed by a file (spilled columns, datasets attached from the shared
+store) are counted apart as ``mapped_bytes``, their pages belong to the page
+cache rather than to the session.
+
+"""
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import mmap
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Tuple
+
+# External imports
+import numpy as np
+
+# Bokeh imports
+from bokeh.document.events import (
+    ColumnDataChangedEvent,
+    ColumnsPatchedEvent,
+    ColumnsStreamedEvent,
+    DocumentChangedEvent,
+    ModelChangedEvent,
+    RootAddedEvent,
+    RootRemovedEvent,
+)
+from bokeh.model import Model
+from bokeh.models import ColumnDataSource
+from bokeh.server.callbacks import PeriodicCallback
+
+# Local imports
+from .timing import untimed
+
+if TYPE_CHECKING:
+    from bokeh.document import Document
+    from bokeh.server.contexts import ApplicationContext
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'SessionFootprint',
+    'report',
+)
+
+# Rough memory of one model with its properties, measured on the models of a small figure
+MODEL_BYTES = 6 * 1024
+
+# Size assumed for every item of a column that is a list rather than an array
+ITEM_BYTES = 8
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+class SessionFootprint:
+    """ The estimated memory of a session's document, kept up to date by its change events. """
+
+    def __init__(self, document: Document) -> None:
+        self.data_bytes = 0
+        self.mapped_bytes = 0
+        self._document = document
+        self._sources: Dict[str, Tuple[int, int]] = {}
+        self._model_count = 0
+        self._rescan()
+        document.on_change(self._changed)
+
+    @property
+    def models(self) -> int:
+        self._check()
+        return self._model_count
+
+    @property
+    def periodic_callbacks(self) -> int:
+        return sum(1 for callback in self._document.session_callbacks if isinstance(callback, PeriodicCallback))
+
+    @property
+    def estimated_bytes(self) -> int:
+        """ Resident column data plus ``MODEL_BYTES`` per model. """
+        self._check()
+        return self.data_bytes + self._model_count * MODEL_BYTES
+
+    def columns_replaced(self, source: ColumnDataSource) -> None:
+        """ Take note that columns of ``source`` were swapped without a change event. """
+        if source.id in self._sources:
+            self._update(source)
+
+    def to_dict(self) -> Dict[str, int]:
+        return dict(
+            models=self.models,
+            data_bytes=self.data_bytes,
+            mapped_bytes=self.mapped_bytes,
+            periodic_callbacks=self.periodic_callbacks,
+            estimated_bytes=self.estimated_bytes,
+        )
+
+    @untimed
+    def _changed(self, event: DocumentChangedEvent) -> None:
+        if isinstance(event, (ColumnDataChangedEvent, ColumnsStreamedEvent, ColumnsPatchedEvent)):
+            self._update(event.model)
+        elif isinstance(event, ModelChangedEvent):
+            if isinstance(event.model, ColumnDataSource) and event.attr == "data":
+                self._update(event.model)
+            elif _refers_to_models(event.new):
+                # models that are no longer referenced show up in the count of _check
+                self._rescan()
+        elif isinstance(event, (RootAddedEvent, RootRemovedEvent)):
+            self._rescan()
+
+    def _check(self) -> None:
+        # models attached while the model manager was frozen only show up afterwards
+        if len(self._document.models) != self._model_count:
+            self._rescan()
+
+    def _update(self, source: ColumnDataSource) -> None:
+        data, mapped = self._sources.get(source.id, (0, 0))
+        self.data_bytes -= data
+        self.mapped_bytes -= mapped
+        data, mapped = _source_bytes(source)
+        self._sources[source.id] = data, mapped
+        self.data_bytes += data
+        self.mapped_bytes += mapped
+
+    def _rescan(self) -> None:
+        sources = {model.id: model for model in self._document.models if isinstance(model, ColumnDataSource)}
+        for id in self._sources.keys() - sources.keys():
+            data, mapped = self._sources.pop(id)
+            self.data_bytes -= data
+            self.mapped_bytes -= mapped
+        for id, source in sources.items():
+            if id not in self._sources:
+                self._update(source)
+        self._model_count = len(self._document.models)
+
+
+def report(top: int = 10, contexts: Iterable[ApplicationContext] | None = None) -> Dict[str, Any]:
+    """ The footprint of the sessions summed per route, and the ``top`` sessions by estimated bytes. """
+    if contexts is None:
+        from .context import DjangoApplicationContext
+        contexts = DjangoApplicationContext._instances
+
+    routes: Dict[str, Dict[str, int]] = {}
+    sessions = []
+    for context in list(contexts):
+        route = context.url or ""
+        totals = routes.setdefault(route, dict(sessions=0, models=0, data_bytes=0, mapped_bytes=0,
+                                               periodic_callbacks=0, estimated_bytes=0))
+        for session in list(context._sessions.values()):
+            footprint = getattr(session, "footprint", None)
+            if footprint is None:
+                continue
+            counts = footprint.to_dict()
+            totals["sessions"] += 1
+            for name, value in counts.items():
+                totals[name] += value
+            sessions.append(dict(id=session.id, route=route, **counts))
+
+    sessions.sort(key=lambda session: session["estimated_bytes"], reverse=True)
+    return dict(routes=routes, sessions=sessions[:top])
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+
+def _refers_to_models(value: Any) -> bool:
+    if isinstance(value, Model):
+        return True
+    if isinstance(value, (list, tuple)):
+        return any(isinstance(item, Model) for item in value)
+    if isinstance(value, dict):
+        return any(isinstance(item, Model) for item in value.values())
+    return False
+
+
+def _source_bytes(source: ColumnDataSource) -> Tuple[int, int]:
+    """ Resident and file backed bytes of the columns of ``source``. """
+    data = mapped = 0
+    for column in source.data.values():
+        if isinstance(column, np.ndarray):
+            if _is_mapped(column):
+                mapped += column.nbytes
+            else:
+                data += column.nbytes
+        elif hasattr(column, "nbytes"):
+            # pandas
+            data += int(column.nbytes)
+        elif hasattr(column, "__len__"):
+            data += ITEM_BYTES * len(column)
+    return data, mapped
+
+
+def _is_mapped(array: np.ndarray) -> bool:
+    base: Any = array
+    while base is not None:
+        if isinstance(base, (np.memmap, mmap.mmap)):
+            return True
+        base = getattr(base, "base", None)
+    return False
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
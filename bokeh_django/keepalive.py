@@ -0,0 +1,129 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+""" Close websockets whose peer has gone silent.
+
+A connection that dies without a close frame (a NAT entry timing out, a
+suspended laptop) keeps its consumer and session, with the document and its
+periodic callbacks, until the ASGI server notices. ASGI gives an application
+no way to send pings or see pongs, and BokehJS answers nothing the server
+sends, so the websockets of a route with an idle timeout record when they
+last received a frame from their peer or sent it a message, and
+``idle_reaper`` closes the ones idle for longer and discards their sessions
+right away.
+
+Documents with periodic callbacks or push handlers are fed by the server,
+which may stay quiet for longer than the timeout while someone watches them:
+their websockets are never reaped, and only the pings of the ASGI server
+detect their dead peers.
+
+"""
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import asyncio
+import time
+from typing import TYPE_CHECKING
+
+# Bokeh imports
+from bokeh.server.callbacks import PeriodicCallback
+
+# Local imports
+from . import push
+from .conf import get_setting
+
+if TYPE_CHECKING:
+    from bokeh.document import Document
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'IdleReaper',
+    'fed_by_server',
+    'idle_reaper',
+)
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+class IdleReaper:
+    """ Check the open websockets every ``interval`` seconds and reap the idle ones.
+
+    ``interval`` defaults to ``BOKEH_DJANGO_WS_IDLE_CHECK_SECONDS`` or 5.
+
+    """
+
+    def __init__(self, interval: float | None = None) -> None:
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """ Start checking on the running loop, if not already doing so. """
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._task.get_loop() is loop:
+            return
+        self._task = loop.create_task(self._run())
+
+    async def reap(self) -> int:
+        """ Close the websockets idle for longer than their timeout, return how many. """
+        from .consumers import WSConsumer
+
+        now = time.monotonic()
+        reaped = 0
+        for consumer in list(WSConsumer._instances):
+            if consumer.idle_timeout is None or now - consumer.last_activity <= consumer.idle_timeout:
+                continue
+            session = consumer.session
+            if session is not None and fed_by_server(session.document):
+                continue
+            try:
+                await consumer.reap()
+            except Exception as e:
+                log.error("Error closing idle websocket of %r: %s", consumer.route, e, exc_info=True)
+            reaped += 1
+        return reaped
+
+    async def _run(self) -> None:
+        interval = self.interval if self.interval is not None else get_setting("WS_IDLE_CHECK_SECONDS", 5)
+        while True:
+            await asyncio.sleep(interval)
+            await self.reap()
+
+
+idle_reaper = IdleReaper()
+
+
+def fed_by_server(document: Document) -> bool:
+    """ Whether the server changes ``document`` on its own, with periodic callbacks or push handlers. """
+    return any(isinstance(callback, PeriodicCallback) for callback in document.session_callbacks) \
+        or bool(push.topics(document))
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
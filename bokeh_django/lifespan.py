@@ -0,0 +1,185 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+""" Warm a worker up when it starts and close its sessions when it stops.
+
+``Lifespan`` wraps the ASGI application and handles the ASGI lifespan
+protocol, for servers that implement it (Uvicorn, Hypercorn):
+
+.. code-block:: python
+
+    routes = apps.get_app_config('bokeh_django').routes
+    application = routes.lifespan(ProtocolTypeRouter({
+        'websocket': AuthMiddlewareStack(URLRouter(routes.get_websocket_urlpatterns())),
+        'http': AuthMiddlewareStack(URLRouter(routes.get_http_urlpatterns())),
+    }))
+
+Daphne does not implement it; the ``runbokeh`` command calls ``startup``
+before forking its workers and ``shutdown`` when a worker is terminated.
+
+"""
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import asyncio
+from typing import TYPE_CHECKING, Any, Callable, Dict
+
+# Local imports
+from .conf import get_setting
+
+if TYPE_CHECKING:
+    from .routing import RoutingConfiguration
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'Lifespan',
+)
+
+# Websocket close code telling the browser that the server is going away
+GOING_AWAY = 1001
+
+# How long a shutdown waits for the closed websockets to disconnect (seconds)
+CLOSE_TIMEOUT = 1.0
+
+# How often a shutdown checks whether the messages being handled are done (seconds)
+DRAIN_POLL_INTERVAL = 0.05
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+class Lifespan:
+    """ ASGI middleware handling the ``lifespan`` scope for the Bokeh routes.
+
+    On startup, every route builds and discards one document (see
+    ``Routing.warm``, unless ``warm`` is false) and the BokehJS bundle and page
+    templates are rendered once.
+
+    On shutdown, new sessions are rejected, the messages being handled get up
+    to ``shutdown_timeout`` seconds to finish (default:
+    ``BOKEH_DJANGO_SHUTDOWN_TIMEOUT`` or 10), the websockets are closed with
+    code ``1001`` and the remaining sessions are destroyed, which runs their
+    ``on_session_destroyed`` hooks.
+
+    """
+
+    def __init__(self, app: Callable[..., Any] | None, routes: RoutingConfiguration | None = None, *,
+            warm: bool = True, shutdown_timeout: float | None = None) -> None:
+        self.app = app
+        self.warm = warm
+        self.shutdown_timeout = shutdown_timeout
+        self._routes = routes
+
+    @property
+    def routes(self) -> RoutingConfiguration:
+        if self._routes is None:
+            from django.apps import apps
+            self._routes = apps.get_app_config("bokeh_django").routes
+        return self._routes
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable[..., Any], send: Callable[..., Any]) -> Any:
+        if scope["type"] != "lifespan":
+            return await self.app(scope, receive, send)
+
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    log.error("Bokeh startup failed: %s", e, exc_info=True)
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                try:
+                    await self.shutdown()
+                except Exception as e:
+                    log.error("Bokeh shutdown failed: %s", e, exc_info=True)
+                    await send({"type": "lifespan.shutdown.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def startup(self) -> None:
+        # importing the consumers compiles Bokeh's page templates
+        from .consumers import resources_for, stream_head
+
+        routings = self.routes.routings
+        if self.warm:
+            for routing in routings:
+                await routing.warm()
+        else:
+            for routing in routings:
+                routing.app_context
+
+        # collects the extensions of the models imported by the apps into the BokehJS bundle
+        stream_head(resources_for())
+        log.info("Bokeh routes ready: %d", len(routings))
+
+    async def shutdown(self) -> None:
+        from .admission import AdmissionControl
+        from .consumers import WSConsumer
+        from .context import DjangoApplicationContext
+
+        AdmissionControl.draining = True
+        timeout = self.shutdown_timeout
+        if timeout is None:
+            timeout = get_setting("SHUTDOWN_TIMEOUT", 10)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while any(consumer._in_flight for consumer in WSConsumer._instances) and loop.time() < deadline:
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+
+        busy = sum(1 for consumer in WSConsumer._instances if consumer._in_flight)
+        if busy:
+            log.warning("Closing %d websockets still handling messages after %ss", busy, timeout)
+
+        consumers = list(WSConsumer._instances)
+        for consumer in consumers:
+            try:
+                await consumer.close(code=GOING_AWAY)
+            except Exception as e:
+                log.debug("Could not close websocket: %s", e)
+
+        # the server answers each close with a disconnect, which detaches the connection from its session
+        deadline = loop.time() + CLOSE_TIMEOUT
+        while any(consumer in WSConsumer._instances for consumer in consumers) and loop.time() < deadline:
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+        for consumer in consumers:
+            consumer._detach()
+
+        for context in list(DjangoApplicationContext._instances):
+            await context.close()
+        log.info("Closed %d websockets", len(consumers))
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
@@ -0,0 +1,210 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+""" Limit what a browser may send over the websocket of its session.
+
+All sessions of a worker are handled by one event loop, so one client
+flooding its websocket with messages, or sending huge ones, delays every other
+session. A ``MessageLimits`` of a route bounds the rate of the frames of each
+connection with a token bucket, the size of a frame and the bytes of a Bokeh
+message buffered until all its frames arrived.
+
+"""
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import asyncio
+import time
+from typing import Tuple
+
+# Local imports
+from . import metrics
+from .conf import get_setting
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'ConnectionLimiter',
+    'MessageLimits',
+)
+
+# Close codes of RFC 6455
+POLICY_VIOLATION = 1008
+MESSAGE_TOO_BIG = 1009
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+class MessageLimits:
+    """ Limits of the websocket frames received from each connection of a route.
+
+    Args:
+        rate (float, optional) :
+            frames per second a connection may send on average, a Bokeh
+            message takes three frames plus two per binary buffer
+            (default: ``BOKEH_DJANGO_WS_RATE`` or ``None``, no limit)
+
+        burst (int, optional) :
+            frames a connection may send at once above ``rate``
+            (default: ``BOKEH_DJANGO_WS_BURST`` or one second of ``rate``)
+
+        max_frame_bytes (int, optional) :
+            size of one frame (default: ``BOKEH_DJANGO_WS_MAX_FRAME_BYTES`` or
+            ``None``, no limit)
+
+        max_message_bytes (int, optional) :
+            size of the frames of one Bokeh message, which are buffered until
+            the message is complete (default: ``BOKEH_DJANGO_WS_MAX_MESSAGE_BYTES``
+            or ``None``, no limit)
+
+        throttle_timeout (float, optional) :
+            seconds a connection may be throttled in a row before it is closed
+            (default: ``BOKEH_DJANGO_WS_THROTTLE_TIMEOUT`` or ``5``)
+
+    A connection over ``rate`` is throttled: its frames are handled as the
+    bucket refills, and it is closed with code ``1008`` when it stays throttled
+    for ``throttle_timeout``. A connection over a size limit is closed with
+    code ``1009``.
+
+    """
+
+    def __init__(self, rate: float | None = None, burst: int | None = None, max_frame_bytes: int | None = None,
+            max_message_bytes: int | None = None, throttle_timeout: float | None = None) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_frame_bytes = max_frame_bytes
+        self.max_message_bytes = max_message_bytes
+        self.throttle_timeout = throttle_timeout
+
+    def limiter(self, route: str = "") -> ConnectionLimiter:
+        """ The state of the limits of one connection, with the settings filled in. """
+        rate = _value(self.rate, "WS_RATE")
+        burst = _value(self.burst, "WS_BURST")
+        if rate is not None and burst is None:
+            burst = max(1, int(rate))
+        return ConnectionLimiter(
+            rate=rate,
+            burst=burst,
+            max_frame_bytes=_value(self.max_frame_bytes, "WS_MAX_FRAME_BYTES"),
+            max_message_bytes=_value(self.max_message_bytes, "WS_MAX_MESSAGE_BYTES"),
+            throttle_timeout=_value(self.throttle_timeout, "WS_THROTTLE_TIMEOUT", 5),
+            route=route,
+        )
+
+
+class ConnectionLimiter:
+    """ The token bucket and buffered bytes of one connection.
+
+    Throttled frames are counted in ``ws_throttled`` and the time they waited
+    in ``ws_throttled_seconds``, connections closed over a limit in
+    ``ws_limit_exceeded`` by route and ``limit``.
+
+    """
+
+    def __init__(self, rate: float | None, burst: int | None, max_frame_bytes: int | None,
+            max_message_bytes: int | None, throttle_timeout: float, route: str = "") -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_frame_bytes = max_frame_bytes
+        self.max_message_bytes = max_message_bytes
+        self.throttle_timeout = throttle_timeout
+        self.route = route
+        self.exceeded: str | None = None
+        self._tokens = float(burst or 0)
+        self._updated = time.monotonic()
+        self._throttled_since: float | None = None
+        self._buffered = 0
+
+    async def admit(self, fragment: str | bytes) -> Tuple[int, str] | None:
+        """ Wait until ``fragment`` may be handled.
+
+        Returns the close code and the reason when the connection went over a
+        limit, and again for every later fragment.
+
+        """
+        if self.exceeded is not None:
+            return self._violation()
+
+        size = len(fragment)
+        if self.max_frame_bytes is not None and size > self.max_frame_bytes:
+            return self._exceed("frame")
+        self._buffered += size
+        if self.max_message_bytes is not None and self._buffered > self.max_message_bytes:
+            return self._exceed("message")
+
+        if self.rate is not None and not await self._take():
+            return self._exceed("rate")
+        return None
+
+    def message_done(self) -> None:
+        """ Take note that the buffered frames made a complete message. """
+        self._buffered = 0
+
+    async def _take(self) -> bool:
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            self._throttled_since = None
+            return True
+
+        now = time.monotonic()
+        if self._throttled_since is None:
+            self._throttled_since = now
+        wait = (1 - self._tokens) / self.rate
+        if now + wait - self._throttled_since > self.throttle_timeout:
+            return False
+        metrics.increment("ws_throttled", route=self.route)
+        metrics.increment("ws_throttled_seconds", wait, route=self.route)
+        await asyncio.sleep(wait)
+        self._refill()
+        self._tokens -= 1
+        return True
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _exceed(self, limit: str) -> Tuple[int, str]:
+        self.exceeded = limit
+        metrics.increment("ws_limit_exceeded", route=self.route, limit=limit)
+        return self._violation()
+
+    def _violation(self) -> Tuple[int, str]:
+        if self.exceeded == "rate":
+            return POLICY_VIOLATION, "rate limit exceeded"
+        return MESSAGE_TOO_BIG, f"{self.exceeded} size limit exceeded"
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+
+def _value(value: float | None, setting: str, default: float | None = None) -> float | None:
+    return value if value is not None else get_setting(setting, default)
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
@@ -0,0 +1,223 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+""" Profile building the document of one Bokeh route.
+
+The document is built the way a new session builds it, by the application
+context of the route from a synthetic request, then validated and serialized
+like the reply to the first pull of the browser. Each stage is timed on its
+own, and the whole run is profiled with ``cProfile``:
+
+.. code-block:: sh
+
+    python manage.py profilebokeh /sea_surface --count 20 --output sea_surface.prof
+
+The ``.prof`` file is the ``pstats`` format read by ``snakeviz``, ``tuna`` or
+``flameprof`` (``flameprof sea_surface.prof > sea_surface.svg``).
+
+"""
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import contextlib
+import cProfile
+import io
+import pstats
+import re
+import statistics
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator, List, Tuple
+
+# External imports
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+STAGES = ("build", "validate", "serialize")
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+class Command(BaseCommand):
+    help = "Build the document of a Bokeh route several times and report where the time and memory go."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path",
+                            help="URL path of the document, matched against the Bokeh routes (e.g. /sea_surface)")
+        parser.add_argument("-n", "--count", type=int, default=10,
+                            help="Number of documents to build and profile (default: 10)")
+        parser.add_argument("--top", type=int, default=25,
+                            help="Number of functions to list (default: 25)")
+        parser.add_argument("--sort", default="cumulative",
+                            help="pstats sort key of the listed functions (default: cumulative)")
+        parser.add_argument("-o", "--output", default=None,
+                            help="Write the profile to this file, in pstats format")
+
+    def handle(self, *args, **options):
+        from bokeh.settings import settings as bokeh_settings
+
+        from bokeh_django.context import AsyncApplication
+
+        if options["count"] < 1:
+            raise CommandError("--count must be at least 1")
+        routing, request = self._resolve(options["path"])
+        # an async handler runs in the event loop thread, a sync one in this thread (thread sensitive)
+        handler_in_loop = isinstance(routing.app, AsyncApplication)
+        validating = bokeh_settings.perform_document_validation()
+
+        # the first build imports the app's modules and fills caches, it is reported on its own
+        started = time.perf_counter()
+        first = self._build(routing, request)
+        cold = time.perf_counter() - started
+        models = len(first.models)
+        content, buffers, buffer_count = _serialized_size(first)
+
+        tracemalloc.start()
+        self._build(routing, request)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        this_thread, loop_thread = cProfile.Profile(), cProfile.Profile()
+        times: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+        with _validation_disabled(bokeh_settings.perform_document_validation):
+            for _ in range(options["count"]):
+                started = time.perf_counter()
+                if handler_in_loop:
+                    doc = self._build(routing, request, loop_thread)
+                else:
+                    with _profiling(this_thread):
+                        doc = self._build(routing, request)
+                times["build"].append(time.perf_counter() - started)
+
+                with _profiling(this_thread):
+                    if validating:
+                        started = time.perf_counter()
+                        doc.validate()
+                        times["validate"].append(time.perf_counter() - started)
+                    started = time.perf_counter()
+                    _serialize(doc)
+                    times["serialize"].append(time.perf_counter() - started)
+
+        self.stdout.write(f"Profiled {options['count']} documents of {options['path']} (route {routing.url})")
+        self.stdout.write(f"  {'first build':<12} {cold * 1000:9.1f} ms (imports and caches)")
+        for stage in STAGES:
+            if not times[stage]:
+                self.stdout.write(f"  {stage:<12}  disabled (BOKEH_VALIDATE_DOC)")
+                continue
+            self.stdout.write(f"  {stage:<12} {statistics.mean(times[stage]) * 1000:9.1f} ms mean, "
+                              f"{min(times[stage]) * 1000:.1f} ms min")
+        self.stdout.write(f"  {'models':<12} {models:9d}")
+        self.stdout.write(f"  {'serialized':<12} {content / 1024:9.1f} KiB content, "
+                          f"{buffers / 1024:.1f} KiB in {buffer_count} buffers")
+        self.stdout.write(f"  {'peak memory':<12} {peak / 1024 ** 2:9.1f} MiB while building one document")
+
+        # pstats writes a line in several pieces, which the command's output wrapper would end each of
+        out = io.StringIO()
+        stats = pstats.Stats(this_thread, stream=out)
+        if handler_in_loop:
+            stats.add(loop_thread)
+        stats.sort_stats(options["sort"]).print_stats(options["top"])
+        self.stdout.write(f"Top {options['top']} functions by {options['sort']}:")
+        self.stdout.write(out.getvalue())
+        if options["output"]:
+            stats.dump_stats(options["output"])
+            self.stdout.write(f"Profile written to {options['output']}")
+
+    def _resolve(self, path: str) -> Tuple[Any, Dict[str, Any]]:
+        from bokeh_django.consumers import synthetic_request
+
+        config = apps.get_app_config("bokeh_django")
+        for routing in config.routes.routings:
+            match = re.fullmatch(routing.url.strip("^$/"), path.strip("/"))
+            if match is None or not (routing.document or routing.autoload):
+                continue
+            request = synthetic_request("/" + path.strip("/"))
+            # the same arguments as Django's RegexPattern.match
+            kwargs = {name: value for name, value in match.groupdict().items() if value is not None}
+            request["url_route"] = {"args": () if match.groupdict() else match.groups(), "kwargs": kwargs}
+            return routing, request
+        raise CommandError(f"No Bokeh route matches {path}")
+
+    def _build(self, routing: Any, request: Dict[str, Any], profile: cProfile.Profile | None = None) -> Any:
+        async def build():
+            with _profiling(profile):
+                return await routing._build_document(request)
+        return async_to_sync(build)()
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+
+class _validation_disabled:
+    """ Leave validation out of the build, it is timed as a stage of its own. """
+
+    def __init__(self, setting: Any) -> None:
+        self.setting = setting
+
+    def __enter__(self) -> None:
+        self.was_set = self.setting.is_set
+        self.value = self.setting()
+        self.setting.set_value(False)
+
+    def __exit__(self, *exc: Any) -> None:
+        if self.was_set:
+            self.setting.set_value(self.value)
+        else:
+            self.setting.unset_value()
+
+
+@contextlib.contextmanager
+def _profiling(profile: cProfile.Profile | None) -> Iterator[None]:
+    # a profile only sees the thread it is enabled in
+    if profile is None:
+        yield
+        return
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+
+
+def _serialize(doc: Any) -> Any:
+    # what the server sends when the browser pulls the document
+    from bokeh.protocol import Protocol
+
+    return Protocol().create("PULL-DOC-REPLY", "profile", doc)
+
+
+def _serialized_size(doc: Any) -> Tuple[int, int, int]:
+    message = _serialize(doc)
+    content = len(message.header_json) + len(message.metadata_json) + len(message.content_json)
+    buffers = sum(len(buffer.to_bytes()) for buffer in message.buffers)
+    return content, buffers, len(message.buffers)
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
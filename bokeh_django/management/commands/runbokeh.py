@@ -0,0 +1,352 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+""" Run several ASGI workers that share preloaded Bokeh applications.
+
+The parent process imports the ASGI application and every ``Routing`` in
+``bokeh_apps``, optionally builds one throwaway document per route, freezes the
+garbage collector and only then forks the workers. Everything loaded up to that
+point is shared copy-on-write between the workers instead of being rebuilt in
+each of them.
+
+All workers accept connections from one listening socket. With ``--affinity``
+each worker additionally listens on its own port (``--affinity-port + N``) and
+labels its responses with a ``bokeh_django_worker`` cookie, so that a balancer
+can send the websocket of a session to the worker that created the session.
+
+"""
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import asyncio
+import gc
+import importlib.util
+import os
+import select
+import signal
+import socket
+import time
+from typing import Dict, List
+
+# External imports
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+# Bokeh imports
+from bokeh_django.conf import get_setting
+from bokeh_django.consumers import WORKER_ENV
+from bokeh_django.lifespan import Lifespan
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+# A worker that exits before reporting ready this many times in a row stops the server
+MAX_START_FAILURES = 5
+
+# Longest wait before restarting a worker that exited before reporting ready
+MAX_RESTART_DELAY = 30
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+class Command(BaseCommand):
+    help = "Preload the Bokeh applications once, then fork ASGI workers sharing one listening socket."
+
+    def add_arguments(self, parser):
+        parser.add_argument("-b", "--bind", dest="host", default="127.0.0.1",
+                            help="Address to listen on (default: 127.0.0.1)")
+        parser.add_argument("-p", "--port", type=int, default=8000,
+                            help="Port to listen on (default: 8000)")
+        parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                            help="Number of worker processes (default: number of CPUs)")
+        parser.add_argument("--backlog", type=int, default=1024,
+                            help="Listen backlog of the shared socket (default: 1024)")
+        parser.add_argument("--no-warm-documents", dest="warm_documents", action="store_false",
+                            help="Only import the applications, do not build a throwaway document per route")
+        parser.add_argument("--affinity", action="store_true",
+                            help="Give every worker its own port and label responses with a worker cookie")
+        parser.add_argument("--affinity-port", type=int, default=None,
+                            help="First per-worker port used with --affinity (default: port + 1)")
+        parser.add_argument("--ping-interval", type=int, default=get_setting("WS_PING_INTERVAL", 20),
+                            help="Seconds between websocket pings (default: BOKEH_DJANGO_WS_PING_INTERVAL or 20)")
+        parser.add_argument("--ping-timeout", type=int, default=get_setting("WS_PING_TIMEOUT", 30),
+                            help="Seconds before an unanswered ping closes the websocket "
+                                 "(default: BOKEH_DJANGO_WS_PING_TIMEOUT or 30)")
+        parser.add_argument("--ready-timeout", type=float, default=60,
+                            help="Seconds to wait for each worker to start listening (default: 60)")
+
+    def handle(self, *args, **options):
+        if not hasattr(os, "fork"):
+            raise CommandError("runbokeh needs os.fork and is not available on this platform")
+        if options["workers"] < 1:
+            raise CommandError("--workers must be at least 1")
+        # daphne is only imported in the workers, check it is there before preloading and forking
+        if importlib.util.find_spec("daphne") is None:
+            raise CommandError("runbokeh needs daphne, install it with: pip install bokeh-django[runbokeh]")
+
+        started = time.monotonic()
+        self.options = options
+        self.application = self._preload()
+        preloaded = time.monotonic()
+        self.stdout.write(f"Preloaded application in {preloaded - started:.2f}s, parent {_format_memory(os.getpid())}")
+
+        self.sock = socket.create_server((options["host"], options["port"]), backlog=options["backlog"])
+        self.sock.set_inheritable(True)
+        self.workers: Dict[int, int] = {}
+        self.ready: Dict[int, bool] = {}
+
+        ready = {index: self._spawn(index) for index in range(options["workers"])}
+        for index, fd in ready.items():
+            waited = _wait_ready(fd, options["ready_timeout"])
+            pid = self.workers[index]
+            self.ready[index] = waited is not None
+            status = f"ready after {waited:.2f}s" if waited is not None else "did not report ready"
+            self.stdout.write(f"Worker {index} (pid {pid}) {status}, {_format_memory(pid)}")
+
+        self.stdout.write(f"{len(self.workers)} workers listening on "
+                          f"{options['host']}:{options['port']}, startup took {time.monotonic() - started:.2f}s")
+        self._supervise()
+
+    def _preload(self):
+        from channels.routing import get_default_application
+
+        config = apps.get_app_config("bokeh_django")
+        application = get_default_application()
+
+        # Builds the apps, which would otherwise happen in every worker on first use
+        self.lifespan = Lifespan(None, config.routes, warm=self.options["warm_documents"])
+        # Unlike asyncio.run, async_to_sync runs thread sensitive code in this thread, so no executor
+        # thread is left behind that the forked workers would wait on forever
+        async_to_sync(self.lifespan.startup)()
+
+        # Forked children must not share the parent's database connections
+        connections.close_all()
+
+        # Keep the collector from touching (and so un-sharing) the pages of preloaded objects
+        gc.collect()
+        gc.freeze()
+        return application
+
+    def _spawn(self, index: int) -> int:
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            code = 0
+            try:
+                self._run_worker(index, write_fd)
+            except BaseException:
+                log.exception("Worker %d failed", index)
+                code = 1
+            finally:
+                os._exit(code)
+
+        os.close(write_fd)
+        self.workers[index] = pid
+        return read_fd
+
+    def _run_worker(self, index: int, ready_fd: int) -> None:
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        endpoints = [f"fd:fileno={self.sock.fileno()}"]
+        if self.options["affinity"]:
+            os.environ[WORKER_ENV] = str(index)
+            first_port = self.options["affinity_port"] or self.options["port"] + 1
+            host = self.options["host"].strip("[]").replace(":", r"\:")
+            endpoints.append(f"tcp:port={first_port + index}:interface={host}")
+
+        # daphne installs its Twisted reactor on import, so it must only happen in the child
+        from daphne.server import Server
+
+        from twisted.internet import reactor
+
+        def ready():
+            os.write(ready_fd, b"1")
+            os.close(ready_fd)
+
+        def handle_signals():
+            # Twisted's own handlers would stop the reactor right away, killing every connection
+            loop = asyncio.get_event_loop()
+            stopping = None
+
+            async def stop():
+                try:
+                    await self.lifespan.shutdown()
+                finally:
+                    reactor.stop()
+
+            def shutdown():
+                nonlocal stopping
+                if stopping is None:
+                    stopping = loop.create_task(stop())
+
+            loop.add_signal_handler(signal.SIGTERM, shutdown)
+            loop.add_signal_handler(signal.SIGINT, shutdown)
+
+        reactor.callWhenRunning(handle_signals)
+        Server(
+            application=self.application,
+            endpoints=endpoints,
+            ping_interval=self.options["ping_interval"],
+            ping_timeout=self.options["ping_timeout"],
+            ready_callable=ready,
+            verbosity=self.options["verbosity"],
+            signal_handlers=False,
+        ).run()
+
+    def _supervise(self) -> None:
+        """ Restart the workers that exit, until the command is stopped.
+
+        A worker that exits before it reported ready is restarted after a delay
+        that doubles up to ``MAX_RESTART_DELAY`` seconds, and after
+        ``MAX_START_FAILURES`` such exits in a row the server is stopped.
+
+        """
+        stopping = False
+        failed = False
+        failures: Dict[int, int] = {}
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+            for pid in self.workers.values():
+                _kill(pid, signal.SIGTERM)
+
+        def pause(delay: float) -> None:
+            until = time.monotonic() + delay
+            while not stopping and time.monotonic() < until:
+                time.sleep(min(0.1, until - time.monotonic()))
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+
+            index = next((i for i, p in self.workers.items() if p == pid), None)
+            if index is None:
+                continue
+            del self.workers[index]
+            if stopping:
+                continue
+
+            exited = f"Worker {index} (pid {pid}) exited with status {_exit_code(status)}"
+            if self.ready.pop(index, False):
+                failures[index] = 0
+                self.stderr.write(f"{exited}, restarting")
+            else:
+                failures[index] = failures.get(index, 0) + 1
+                if failures[index] >= MAX_START_FAILURES:
+                    self.stderr.write(f"{exited} before reporting ready, {failures[index]} times in a row, stopping")
+                    failed = True
+                    stop(None, None)
+                    continue
+                delay = min(2 ** (failures[index] - 1), MAX_RESTART_DELAY)
+                self.stderr.write(f"{exited} before reporting ready, restarting in {delay}s")
+                pause(delay)
+                if stopping:
+                    continue
+
+            fd = self._spawn(index)
+            waited = _wait_ready(fd, self.options["ready_timeout"])
+            self.ready[index] = waited is not None
+            if waited is not None:
+                self.stdout.write(f"Worker {index} (pid {self.workers[index]}) ready after {waited:.2f}s")
+
+        self.sock.close()
+        if failed:
+            raise CommandError("A worker kept exiting before it was ready")
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+
+def _wait_ready(fd: int, timeout: float) -> float | None:
+    started = time.monotonic()
+    try:
+        readable, _, _ = select.select([fd], [], [], timeout)
+        if readable and os.read(fd, 1):
+            return time.monotonic() - started
+        return None
+    finally:
+        os.close(fd)
+
+
+def _exit_code(status: int) -> int:
+    """ The exit code in a status of ``os.wait``, or minus the signal that killed the process. """
+    # os.waitstatus_to_exitcode needs Python 3.9
+    if os.WIFEXITED(status):
+        return os.WEXITSTATUS(status)
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return status
+
+
+def _kill(pid: int, signum: int) -> None:
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def _memory_kb(pid: int) -> Dict[str, int]:
+    """ Resident, proportional and shared memory of a process in kB (Linux only).
+
+    PSS splits shared pages between the processes sharing them, which makes it
+    the fair per-worker figure when workers share preloaded pages.
+
+    """
+    memory: Dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines: List[str] = f.readlines()
+    except OSError:
+        return memory
+    for line in lines:
+        key, _, value = line.partition(":")
+        if key in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty"):
+            memory[key] = int(value.split()[0])
+    return memory
+
+
+def _format_memory(pid: int) -> str:
+    memory = _memory_kb(pid)
+    if not memory:
+        return "memory n/a"
+    shared = memory.get("Shared_Clean", 0) + memory.get("Shared_Dirty", 0)
+    return f"rss {memory.get('Rss', 0) / 1024:.1f} MiB, pss {memory.get('Pss', 0) / 1024:.1f} MiB, " \
+           f"shared {shared / 1024:.1f} MiB"
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
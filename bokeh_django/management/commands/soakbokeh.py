@@ -0,0 +1,285 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+""" Open and close Bokeh sessions over and over to find memory leaks.
+
+Each cycle loads the page of every selected route (or its ``autoload.js``),
+opens the websocket of the new session, pulls the document and disconnects,
+all in this process through Channels' test communicators. Pages loaded with
+``--orphans`` never connect, and are cleaned up at the end of the cycle like
+the server does for unused sessions. The pages of snapshot routes have no
+session, they are only loaded, and only when the route is selected with
+``--route``.
+
+After ``--warmup`` cycles the traced memory (``tracemalloc``) and the number
+of objects tracked by the garbage collector are sampled every
+``--sample-every`` cycles. The command fails if the memory keeps growing by
+more than ``--max-growth`` bytes per cycle, and reports the allocation sites
+that grew the most since the first sample.
+
+"""
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import asyncio
+import gc
+import json
+import re
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, List, Sequence, Tuple
+
+# External imports
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+# Objects whose live count points at what is kept alive after the sessions are gone
+WATCHED_TYPES = ("ServerSession", "DjangoServerSession", "ServerConnection", "Document", "BokehSessionContext",
+                 "WSConsumer", "PeriodicCallback", "Future")
+
+TOKEN = re.compile(r'\\?"token\\?":\s*\\?"([^"\\]+)')
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+class Command(BaseCommand):
+    help = "Open and close Bokeh sessions in a loop and fail if memory keeps growing."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--route", action="append", dest="routes", default=None,
+                            help="URL of a route to soak, may be repeated "
+                                 "(default: every route without URL arguments or snapshots)")
+        parser.add_argument("--cycles", type=int, default=200,
+                            help="Number of measured cycles (default: 200)")
+        parser.add_argument("--warmup", type=int, default=20,
+                            help="Cycles run before measuring, to fill caches (default: 20)")
+        parser.add_argument("--sample-every", type=int, default=10,
+                            help="Cycles between two memory samples (default: 10)")
+        parser.add_argument("--orphans", type=int, default=0,
+                            help="Pages loaded per route and cycle without opening their websocket (default: 0)")
+        parser.add_argument("--max-growth", type=float, default=2048,
+                            help="Bytes per cycle the traced memory may keep growing by (default: 2048)")
+        parser.add_argument("--frames", type=int, default=None,
+                            help="Stack frames recorded per allocation, more is slower "
+                                 "(default: 1, or 10 with --group-by traceback)")
+        parser.add_argument("--top", type=int, default=15,
+                            help="Number of allocation sites to report (default: 15)")
+        parser.add_argument("--group-by", choices=("lineno", "traceback"), default="lineno",
+                            help="Group allocations by line or by whole traceback (default: lineno)")
+
+    def handle(self, *args, **options):
+        if options["cycles"] < 2 * options["sample_every"]:
+            raise CommandError("--cycles must cover at least two samples")
+        self.options = options
+        if not async_to_sync(self._soak)():
+            raise CommandError("Memory keeps growing, see the allocation sites above")
+
+    async def _soak(self) -> bool:
+        from channels.routing import get_default_application
+
+        options = self.options
+        application = get_default_application()
+        routings = self._routings()
+        self.stdout.write(f"Soaking {', '.join(map(_describe, routings))}")
+
+        for _ in range(options["warmup"]):
+            await self._cycle(application, routings)
+
+        frames = options["frames"] or (10 if options["group_by"] == "traceback" else 1)
+        tracemalloc.start(frames)
+        try:
+            samples: List[Tuple[int, int, int]] = []
+            baseline = None
+            started = time.monotonic()
+            for cycle in range(options["cycles"] + 1):
+                if cycle % options["sample_every"] == 0:
+                    gc.collect()
+                    samples.append((cycle, tracemalloc.get_traced_memory()[0], len(gc.get_objects())))
+                    if baseline is None:
+                        baseline = tracemalloc.take_snapshot()
+                    self.stdout.write(f"cycle {cycle:>6}: traced {samples[-1][1] / 1024:10.1f} KiB, "
+                                      f"{samples[-1][2]} objects")
+                if cycle < options["cycles"]:
+                    await self._cycle(application, routings)
+            final = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+
+        elapsed = time.monotonic() - started
+        growth = _slope([(cycle, memory) for cycle, memory, _ in samples])
+        recent = _slope([(cycle, memory) for cycle, memory, _ in samples[len(samples) // 2:]])
+        objects = _slope([(cycle, count) for cycle, _, count in samples])
+        self.stdout.write(f"{options['cycles']} cycles in {elapsed:.1f}s: {growth:.0f} bytes per cycle "
+                          f"({recent:.0f} over the last half), {objects:.2f} objects per cycle")
+
+        self._report_sites(baseline, final)
+        self._report_objects(routings)
+        return growth <= options["max_growth"] or recent <= options["max_growth"]
+
+    def _routings(self) -> List[Any]:
+        config = apps.get_app_config("bokeh_django")
+        routings = config.routes.routings
+        if self.options["routes"]:
+            wanted = {url.strip("/") for url in self.options["routes"]}
+            selected = [routing for routing in routings if routing.url.strip("/") in wanted]
+            missing = wanted - {routing.url.strip("/") for routing in selected}
+            if missing:
+                raise CommandError(f"No Bokeh route for {', '.join(sorted(missing))}")
+        else:
+            # snapshot pages are rendered without a session, they are only soaked when asked for
+            selected = [routing for routing in routings if not re.compile(routing.url).groups
+                        and not _serves_snapshots(routing)]
+        selected = [routing for routing in selected if routing.document or routing.autoload]
+        if not selected:
+            raise CommandError("No route to soak")
+        return selected
+
+    async def _cycle(self, application: Any, routings: Sequence[Any]) -> None:
+        for routing in routings:
+            for _ in range(self.options["orphans"]):
+                await _load_page(application, routing)
+            token = await _load_page(application, routing)
+            if token is not None:
+                await _open_websocket(application, routing, token)
+            # like the maintenance task of the context, without waiting for the unused session lifetime
+            await routing.app_context._cleanup_sessions(0)
+
+    def _report_sites(self, baseline: tracemalloc.Snapshot | None, final: tracemalloc.Snapshot) -> None:
+        if baseline is None:
+            return
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ]
+        group_by = self.options["group_by"]
+        stats = final.filter_traces(filters).compare_to(baseline.filter_traces(filters), group_by)
+        grown = [stat for stat in stats if stat.size_diff > 0][:self.options["top"]]
+        self.stdout.write(f"Top {len(grown)} allocation sites by growth since the first sample:")
+        for stat in grown:
+            frame = stat.traceback[0]
+            self.stdout.write(f"  {stat.size_diff / 1024:+9.1f} KiB {stat.count_diff:+7d} blocks  "
+                              f"{frame.filename}:{frame.lineno}")
+            if group_by == "traceback":
+                for line in stat.traceback.format()[2:]:
+                    self.stdout.write(f"      {line}")
+
+    def _report_objects(self, routings: Sequence[Any]) -> None:
+        from bokeh_django.consumers import WSConsumer
+
+        gc.collect()
+        counts = Counter(type(obj).__name__ for obj in gc.get_objects())
+        alive = ", ".join(f"{name} {counts[name]}" for name in WATCHED_TYPES if counts[name])
+        self.stdout.write(f"Alive after the last cycle: {alive or 'none of ' + ', '.join(WATCHED_TYPES)}")
+        for routing in routings:
+            context = routing.app_context
+            self.stdout.write(f"  {_describe(routing)}: {len(context._sessions)} sessions, "
+                              f"{len(context._pending_sessions)} pending, "
+                              f"{len(WSConsumer._instances)} open websockets")
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+
+def _describe(routing: Any) -> str:
+    kind = "snapshot" if _serves_snapshots(routing) else "document" if routing.document else "autoload"
+    return f"{routing.url} ({kind})"
+
+
+def _serves_snapshots(routing: Any) -> bool:
+    return routing.snapshots is not None and not routing.autoload
+
+
+async def _load_page(application: Any, routing: Any) -> str | None:
+    """ Load the page of the route, return the token of its session (``None`` for a snapshot). """
+    from channels.testing import HttpCommunicator
+
+    path = "/" + routing.url.strip("^$/")
+    if not routing.document:
+        path += "/autoload.js?bokeh-autoload-element=soak"
+    response = await HttpCommunicator(application, "GET", path).get_response(timeout=30)
+    if response["status"] != 200:
+        raise CommandError(f"GET {path} returned {response['status']}: {response['body'][:200]!r}")
+    if _serves_snapshots(routing):
+        return None
+    match = TOKEN.search(response["body"].decode())
+    if match is None:
+        raise CommandError(f"No session token in the response to GET {path}")
+    return match.group(1)
+
+
+async def _open_websocket(application: Any, routing: Any, token: str) -> None:
+    from bokeh.protocol import Protocol
+    from channels.testing import WebsocketCommunicator
+
+    path = "/" + routing.url.strip("^$/") + "/ws"
+    ws = WebsocketCommunicator(application, path, subprotocols=["bokeh", token])
+    connected, _ = await ws.connect(timeout=30)
+    if not connected:
+        raise CommandError(f"Websocket {path} was refused")
+    try:
+        header = await _receive_message(ws)
+        if header["msgtype"] != "ACK":
+            raise CommandError(f"Websocket {path} sent {header['msgtype']} instead of ACK")
+        request = Protocol().create("PULL-DOC-REQ")
+        for fragment in (request.header_json, request.metadata_json, request.content_json):
+            await ws.send_to(text_data=fragment)
+        while (await _receive_message(ws))["msgtype"] != "PULL-DOC-REPLY":
+            pass
+    finally:
+        await ws.disconnect()
+        # let the consumer detach and discard the session
+        await asyncio.sleep(0)
+
+
+async def _receive_message(ws: Any) -> dict:
+    header = json.loads(await ws.receive_from(timeout=30))
+    # metadata, content and the binary buffers, each announced by a text frame
+    for _ in range(2 + 2 * header.get("num_buffers", 0)):
+        await ws.receive_output(timeout=30)
+    return header
+
+
+def _slope(points: Sequence[Tuple[int, int]]) -> float:
+    """ Least squares growth of ``y`` per unit of ``x``. """
+    if len(points) < 2:
+        return 0.0
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    if var == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
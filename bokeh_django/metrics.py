@@ -0,0 +1,89 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import threading
+from typing import Dict, List, Tuple
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'increment',
+    'get',
+    'reset',
+    'snapshot',
+)
+
+# Counters of this worker process, keyed by name and sorted label items
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+
+# Counters are also incremented from executor threads, e.g. by the template cache of rendered snapshots
+_lock = threading.Lock()
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+def increment(name: str, value: float = 1, **labels: str) -> None:
+    """ Add ``value`` to the counter ``name`` with the given labels.
+
+    Counters only live in the current process. They are dictionary updates
+    under an uncontended lock, cheap enough to call per message and safe to
+    call from any thread.
+
+    """
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def get(name: str, **labels: str) -> float:
+    """ Return the current value of one counter (0 if it was never incremented).
+
+    """
+    return _counters.get((name, tuple(sorted(labels.items()))), 0)
+
+
+def snapshot() -> List[Dict[str, object]]:
+    """ Return all counters as a list of ``{"name", "labels", "value"}`` dicts.
+
+    """
+    with _lock:
+        counters = sorted(_counters.items())
+    return [dict(name=name, labels=dict(labels), value=value) for (name, labels), value in counters]
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
@@ -0,0 +1,166 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+""" Push data into live sessions through the Channels layer.
+
+Documents register handlers with ``on_push``, and any process that shares the
+channel layer (views, signal handlers, management commands, background
+workers) publishes a payload once with ``publish``:
+
+.. code-block:: python
+
+    from bokeh_django.push import on_push, publish
+
+    def handler(doc):
+        source = ColumnDataSource(...)
+        on_push(doc, lambda payload: source.stream(payload), topic="readings")
+
+    # elsewhere
+    publish("sea-surface", {"time": [...], "temperature": [...]}, topic="readings")
+
+Each websocket joins one channel layer group per topic its document handles,
+the handlers without a topic listening to the route itself. This works with any
+channel layer, including ``InMemoryChannelLayer`` in tests, but only a shared
+layer (like ``channels_redis``) reaches other processes. A session receives
+every payload once, even when
+it has several connections (shared sessions), and applies it with the
+document locked, like a callback.
+
+"""
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import hashlib
+import re
+import uuid
+import weakref
+from collections import deque
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, List
+
+# External imports
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+# Local imports
+from . import metrics, timing
+
+if TYPE_CHECKING:
+    from bokeh.document import Document
+    from bokeh.server.session import ServerSession
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'apublish',
+    'group_name',
+    'on_push',
+    'publish',
+)
+
+# Type of the channel layer messages, handled by ``WSConsumer.bokeh_push``
+MESSAGE_TYPE = "bokeh.push"
+
+# How many recent message ids a session remembers to apply each payload once
+SEEN_MESSAGES = 128
+
+PushHandler = Callable[[Any], Any]
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+def on_push(doc: Document, handler: PushHandler, topic: str | None = None) -> None:
+    """ Call ``handler(payload)`` for every payload published to the route of
+    ``doc`` (and to ``topic``, if given).
+
+    Handlers must be registered while the document is built, before its
+    websocket connects. Async handlers are awaited.
+
+    """
+    _handlers.setdefault(doc, {}).setdefault(topic, []).append(handler)
+
+
+def group_name(route: str, topic: str | None = None) -> str:
+    """ The channel layer group of a route, or of a topic of the route. """
+    name = "bokeh." + _GROUP_UNSAFE.sub("_", route.strip("^$/"))
+    if topic is not None:
+        name += "." + _GROUP_UNSAFE.sub("_", topic)
+    if len(name) >= 100:
+        name = "bokeh." + hashlib.sha1(name.encode()).hexdigest()
+    return name
+
+
+async def apublish(route: str, payload: Any, topic: str | None = None) -> None:
+    """ Send ``payload`` to every session of ``route`` handling ``topic``.
+
+    The payload must be serializable by the configured channel layer.
+
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        raise RuntimeError("Publishing to Bokeh sessions needs a channel layer (CHANNEL_LAYERS setting)")
+    message = dict(type=MESSAGE_TYPE, id=uuid.uuid4().hex, topic=topic, payload=payload)
+    await channel_layer.group_send(group_name(route, topic), message)
+    metrics.increment("push_published", route=route)
+
+
+def publish(route: str, payload: Any, topic: str | None = None) -> None:
+    """ Synchronous ``apublish``, for views, signal handlers and management commands. """
+    async_to_sync(apublish)(route, payload, topic)
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+
+def topics(doc: Document) -> List[str | None]:
+    return list(_handlers.get(doc, {}))
+
+
+async def apply_push(session: ServerSession, message: Dict[str, Any], route: str = "") -> None:
+    """ Run the handlers of a pushed message on the document of a session, once per session. """
+    seen = _seen.setdefault(session, deque(maxlen=SEEN_MESSAGES))
+    if message["id"] in seen:
+        return
+    seen.append(message["id"])
+
+    handlers = _handlers.get(session.document, {}).get(message.get("topic"), [])
+    for handler in handlers:
+        try:
+            name = getattr(handler, "__qualname__", repr(handler))
+            await timing.timed_call("push", name, session, route, session.with_document_locked, handler, message["payload"])
+        except Exception as e:
+            log.error("Error running push handler %r: %s", handler, e, exc_info=True)
+    metrics.increment("push_applied", route=route)
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+
+_GROUP_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]")
+
+_handlers: weakref.WeakKeyDictionary[Document, Dict[str | None, List[PushHandler]]] = weakref.WeakKeyDictionary()
+
+_seen: weakref.WeakKeyDictionary[ServerSession, Deque[str]] = weakref.WeakKeyDictionary()
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
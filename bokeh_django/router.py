@@ -0,0 +1,206 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+""" Route requests without trying every URL pattern in turn.
+
+``URLRouter`` matches the path against its patterns one after the other. With
+a few hundred Bokeh routes (three patterns each) in front of the Django
+catch-all, every ordinary Django request first fails all of them.
+``CompiledRouter`` takes the same patterns and gives the same results, but
+only tries the patterns that can match the path: the ones whose whole path is
+fixed are looked up in a dict, the others in a trie of the literal text their
+regex starts with.
+
+"""
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+from typing import Any, Callable, Dict, List, Tuple
+
+# External imports
+from channels.routing import URLRouter
+from django.urls.exceptions import Resolver404
+from django.urls.resolvers import RegexPattern, RoutePattern
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'CompiledRouter',
+)
+
+# Characters with a meaning in a regex, the literal prefix of a pattern ends at the first of them
+REGEX_SPECIAL = frozenset(".^$*+?{}[]|()\\")
+
+# Quantifiers make the character before them optional or repeated
+REGEX_QUANTIFIERS = frozenset("*?{")
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+class CompiledRouter(URLRouter):
+    """ A drop-in ``URLRouter`` for long lists of routes.
+
+    The first pattern of ``routes`` that matches still wins, and the
+    ``url_route`` of the scope is the same as with ``URLRouter``.
+
+    """
+
+    def __init__(self, routes: List[Any]) -> None:
+        super().__init__(routes)
+        self._exact: Dict[str, int] = {}
+        self._trie = _Node()
+        for index, route in enumerate(self.routes):
+            path = _exact_path(route)
+            if path is not None:
+                self._exact.setdefault(path, index)
+            else:
+                self._trie.insert(_literal_prefix(route.pattern), index)
+
+    def candidates(self, path: str) -> List[int]:
+        """ The indices of the routes that can match ``path``, in order. """
+        found = self._trie.lookup(path)
+        exact = self._exact.get(path)
+        if exact is not None:
+            found.append(exact)
+        found.sort()
+        return found
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable[..., Any], send: Callable[..., Any]) -> Any:
+        # The same as URLRouter.__call__, for the candidates only
+        path = scope.get("path_remaining", scope.get("path", None))
+        if path is None:
+            raise ValueError("No 'path' key in connection scope, cannot route URLs")
+
+        if "path_remaining" not in scope:
+            root_path = scope.get("root_path", "")
+            if root_path and not path.startswith(root_path):
+                raise ValueError("No route found for path %r." % path)
+            path = path[len(root_path):]
+
+        path = path.lstrip("/")
+        for index in self.candidates(path):
+            route = self.routes[index]
+            try:
+                match = route.pattern.match(path)
+                if match:
+                    new_path, args, kwargs = match
+                    kwargs.update(route.default_args)
+                    outer = scope.get("url_route", {})
+                    return await route.callback(
+                        dict(
+                            scope,
+                            path_remaining=new_path,
+                            url_route={
+                                "args": outer.get("args", ()) + args,
+                                "kwargs": {**outer.get("kwargs", {}), **kwargs},
+                            },
+                        ),
+                        receive,
+                        send,
+                    )
+            except Resolver404:
+                pass
+
+        if "path_remaining" in scope:
+            raise Resolver404("No route found for path %r." % path)
+        raise ValueError("No route found for path %r." % path)
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+
+class _Node:
+    __slots__ = ("children", "routes")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, _Node] = {}
+        self.routes: List[int] = []
+
+    def insert(self, prefix: str, index: int) -> None:
+        node = self
+        for char in prefix:
+            node = node.children.setdefault(char, _Node())
+        node.routes.append(index)
+
+    def lookup(self, path: str) -> List[int]:
+        found = list(self.routes)
+        node = self
+        for char in path:
+            node = node.children.get(char)
+            if node is None:
+                break
+            found.extend(node.routes)
+        return found
+
+
+def _parse_literal(regex: str) -> Tuple[str, int]:
+    """ The literal text ``regex`` starts with, and where it ends. """
+    chars: List[str] = []
+    i = 0
+    while i < len(regex):
+        char = regex[i]
+        if char == "\\":
+            if i + 1 < len(regex) and not regex[i + 1].isalnum():
+                chars.append(regex[i + 1])
+                i += 2
+                continue
+            break
+        if char in REGEX_SPECIAL:
+            if char in REGEX_QUANTIFIERS and chars:
+                chars.pop()
+            break
+        chars.append(char)
+        i += 1
+    return "".join(chars), i
+
+
+def _literal_prefix(pattern: Any) -> str:
+    # Shorter prefixes are always safe, they only make a route a candidate for more paths
+    # translated patterns (gettext_lazy) depend on the active language
+    if isinstance(pattern, RoutePattern):
+        return pattern._route.partition("<")[0] if isinstance(pattern._route, str) else ""
+    if not isinstance(pattern, RegexPattern):
+        return ""
+    regex = pattern._regex
+    if not isinstance(regex, str) or not regex.startswith("^") or "|" in regex:
+        return ""
+    return _parse_literal(regex[1:])[0]
+
+
+def _exact_path(route: Any) -> str | None:
+    # Only patterns matching the whole path, and nothing else, can be looked up by path
+    pattern = route.pattern
+    if not isinstance(pattern, RegexPattern) or not pattern._is_endpoint:
+        return None
+    regex = pattern._regex
+    if not (isinstance(regex, str) and regex.startswith("^") and regex.endswith("$")):
+        return None
+    literal, end = _parse_literal(regex[1:-1])
+    return literal if end == len(regex) - 2 else None
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
@@ -19,41 +19,27 @@ log = logging.getLogger(__name__)
 # -----------------------------------------------------------------------------
 
 # Standard library imports
-from pathlib import Path
-from typing import Callable, List, Union, TYPE_CHECKING
+import asyncio
+import re
 import weakref
-
-# External imports
-from django.core.asgi import get_asgi_application
-from django.urls import re_path
-from django.urls.resolvers import URLPattern
-from channels.db import database_sync_to_async
-from tornado import gen
-
-# Bokeh imports
-from bokeh.application import Application
-from bokeh.settings import settings as bokeh_settings
-from bokeh.application.handlers.document_lifecycle import DocumentLifecycleHandler
-from bokeh.application.handlers.function import FunctionHandler, handle_exception
-from bokeh.command.util import build_single_handler_application, build_single_handler_applications
-from bokeh.server.contexts import (
-    ApplicationContext,
-    BokehSessionContext,
-    _RequestProxy,
-    ServerSession,
-    ProtocolError,
-)
-from bokeh.document import Document
-from bokeh.util.token import get_token_payload
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Pattern, Tuple, Union
 
 # Local imports
-from .consumers import AutoloadJsConsumer, DocConsumer, WSConsumer
+from .snapshot import SnapshotCache
 
 if TYPE_CHECKING:
-    from bokeh.server.contexts import (
-        ID,
-        HTTPServerRequest,
-    )
+    from bokeh.application import Application
+    from bokeh.document import Document
+    from bokeh.resources import Resources
+    from bokeh.server.contexts import ApplicationContext
+    from django.urls.resolvers import URLPattern
+
+    from .context import DjangoApplicationContext
+    from .lifespan import Lifespan
+    from .limits import MessageLimits
+    from .router import CompiledRouter
+    from .transport import TransportPolicy
 
 # -----------------------------------------------------------------------------
 # Globals and constants
@@ -63,195 +49,252 @@ __all__ = (
     'RoutingConfiguration',
 )
 
+# Path of the route that serves several autoload apps from one request, see ``server_batch_document``
+BATCH_AUTOLOAD_URL = "bokeh-django/autoload.js"
 
-class AsyncApplication(Application):
-    async def create_document(self) -> Document:
-        """ Creates and initializes a document using the Application's handlers.
+ApplicationLike = Union["Application", Callable, Path]
 
-        """
-        doc = Document()
-        await self.initialize_document(doc)
-        return doc
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
 
-    async def initialize_document(self, doc: Document) -> None:
-        """ Fills in a new document using the Application's handlers.
 
-        """
-        for h in self._handlers:
-            result = h.modify_document(doc)
-            if inspect.iscoroutine(result):
-                await result
-            if h.failed:
-                log.error("Error running application handler %r: %s %s ", h, h.error, h.error_detail)
+class Routing:
+    """ A Bokeh application served at ``url``.
 
-        if bokeh_settings.perform_document_validation():
-            doc.validate()
+    Routings are declared in ``urls.py``, which every Django process imports.
+    The application and its context are only built on first use, so that
+    processes which do not serve Bokeh (management commands, WSGI workers)
+    never import the Bokeh server.
 
+    """
 
-class AsyncFunctionHandler(FunctionHandler):
-    async def modify_document(self, doc: Document) -> None:
-        """ Execute the configured ``func`` to modify the document.
+    url: str
+    document: bool
+    autoload: bool
+    stream: bool
+    shared: bool
+    snapshots: SnapshotCache | None
+    transport: TransportPolicy | None
+    limits: MessageLimits | None
+    idle_timeout: float | None
+
+    def __init__(self, url: str, app: ApplicationLike, *, document: bool = False, autoload: bool = False,
+            max_sessions: int | None = None, max_pending_sessions: int | None = None, stream: bool = False,
+            spill_after: float | None = None, shared: bool = False, snapshot: bool = False,
+            snapshot_ttl: float | None = None, diff_data: bool | None = None,
+            transport: TransportPolicy | None = None, limits: MessageLimits | None = None,
+            idle_timeout: float | None = None) -> None:
+        self.url = url
+        self.document = document
+        self.autoload = autoload
+        self.stream = stream
+        self.shared = shared
+        self.snapshots = SnapshotCache(snapshot_ttl, route=url) if snapshot else None
+        self.transport = transport
+        self.limits = limits
+        self.idle_timeout = idle_timeout
+        self._app_like = app
+        self._context_options = dict(max_sessions=max_sessions, max_pending_sessions=max_pending_sessions,
+                                     spill_after=spill_after, shared=shared, diff_data=diff_data)
+        self._app: Application | None = None
+        self._app_context: DjangoApplicationContext | None = None
+
+    @property
+    def app(self) -> Application:
+        if self._app is None:
+            self._app = self._fixup(self._normalize(self._app_like))
+        return self._app
+
+    @property
+    def app_context(self) -> DjangoApplicationContext:
+        if self._app_context is None:
+            from .context import DjangoApplicationContext
+            self._app_context = DjangoApplicationContext(self.app, url=self.url, **self._context_options)
+        return self._app_context
+
+    def __repr__(self):
+        doc = 'document' if self.document else ''
+        return f'<{self.__module__}.{self.__class__.__name__} url="{self.url}" {doc}>'
+
+    async def warm(self) -> None:
+        """ Build and discard one throwaway document.
 
-        After this method is first executed, ``safe_to_fork`` will return
-        ``False``.
+        This imports the application modules and whatever they load lazily
+        (data, templates, extensions) before the first real session needs them.
 
         """
+        from .consumers import synthetic_request
+
+        if re.compile(self.url).groups:
+            log.debug("Not warming %r, its handler needs URL arguments", self)
+            return
+
         try:
-            await self._func(doc)
+            await self._build_document(synthetic_request(self.url))
         except Exception as e:
-            if self._trap_exceptions:
-                handle_exception(self, e)
-            else:
-                raise
-        finally:
-            self._safe_to_fork = False
+            log.warning("Could not warm %r: %s", self, e)
 
+    async def render_snapshot(self, request: Any, resources: Resources) -> str:
+        """ Build a document without a session and render it as a standalone page.
 
-ApplicationLike = Union[Application, Callable, Path, AsyncApplication]
+        """
+        from bokeh.embed import file_html
 
-# -----------------------------------------------------------------------------
-# General API
-# -----------------------------------------------------------------------------
+        from .templates import templates
 
+        doc = await self._build_document(request)
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: file_html(
+            doc,
+            resources=resources,
+            title=doc.title,
+            template=templates.compiled(doc.template),
+            template_variables=doc.template_variables,
+        ))
 
-class DjangoApplicationContext(ApplicationContext):
-    async def create_session_if_needed(self, session_id: ID, request: HTTPServerRequest | None = None,
-            token: str | None = None) -> ServerSession:
-        # this is because empty session_ids would be "falsey" and
-        # potentially open up a way for clients to confuse us
-        if len(session_id) == 0:
-            raise ProtocolError("Session ID must not be empty")
-
-        if session_id not in self._sessions and \
-           session_id not in self._pending_sessions:
-            future = self._pending_sessions[session_id] = gen.Future()
-
-            doc = Document()
-
-            session_context = BokehSessionContext(session_id,
-                                                  self.server_context,
-                                                  doc,
-                                                  logout_url=self._logout_url)
-            if request is not None:
-                payload = get_token_payload(token) if token else {}
-                if ('cookies' in payload and 'headers' in payload
-                    and not 'Cookie' in payload['headers']):
-                    # Restore Cookie header from cookies dictionary
-                    payload['headers']['Cookie'] = '; '.join([
-                        f'{k}={v}' for k, v in payload['cookies'].items()
-                    ])
-                # using private attr so users only have access to a read-only property
-                session_context._request = _RequestProxy(request,
-                                                         cookies=payload.get('cookies'),
-                                                         headers=payload.get('headers'))
-            session_context._token = token
-
-            # expose the session context to the document
-            # use the _attribute to set the public property .session_context
-            doc._session_context = weakref.ref(session_context)
-
-            try:
-                await self._application.on_session_created(session_context)
-            except Exception as e:
-                log.error("Failed to run session creation hooks %r", e, exc_info=True)
-
-            if isinstance(self._application, AsyncApplication):
-                await self._application.initialize_document(doc)
-            else:
-                # This needs to be wrapped in the database_sync_to_async wrapper just in case the handler function
-                # accesses Django ORM.
-                await database_sync_to_async(self._application.initialize_document)(doc)
-
-            session = ServerSession(session_id, doc, io_loop=self._loop, token=token)
-            del self._pending_sessions[session_id]
-            self._sessions[session_id] = session
-            session_context._set_session(session)
-            self._session_contexts[session_id] = session_context
-
-            # notify anyone waiting on the pending session
-            future.set_result(session)
-
-        if session_id in self._pending_sessions:
-            # another create_session_if_needed is working on
-            # creating this session
-            session = await self._pending_sessions[session_id]
-        else:
-            session = self._sessions[session_id]
+    def invalidate(self, path: str | None = None) -> None:
+        """ Render the snapshot of ``path`` (or of every path of the route) again on the next request.
 
-        return session
+        """
+        if self.snapshots is not None:
+            self.snapshots.invalidate(path)
 
+    async def _build_document(self, request: Any) -> Document:
+        from bokeh.document import Document
+        from bokeh.server.contexts import BokehSessionContext, _RequestProxy
+        from bokeh.util.token import generate_session_id
 
-class Routing:
-    url: str
-    app: Application
-    app_context: ApplicationContext
-    document: bool
-    autoload: bool
+        doc = Document()
+        session_context = BokehSessionContext(generate_session_id(secret_key=None, signed=False),
+                                              self.app_context.server_context,
+                                              doc)
+        session_context._request = _RequestProxy(request)
+        doc._session_context = weakref.ref(session_context)
+        await self.app_context._initialize_document(doc)
+        return doc
 
-    def __init__(self, url: str, app: ApplicationLike, *, document: bool = False, autoload: bool = False) -> None:
-        self.url = url
-        self.app = self._fixup(self._normalize(app))
-        self.app_context = DjangoApplicationContext(self.app, url=self.url)
-        self.document = document
-        self.autoload = autoload
+    def _normalize(self, obj: ApplicationLike) -> Application:
+        from bokeh.application import Application
+        from bokeh.application.handlers.function import FunctionHandler
+        from bokeh.command.util import build_single_handler_application
 
-    def __repr__(self):
-        doc = 'document' if self.document else ''
-        return f'<{self.__module__}.{self.__class__.__name__} url="{self.url}" {doc}>'
+        from .context import AsyncApplication, AsyncFunctionHandler
 
-    def _normalize(self, obj: ApplicationLike) -> Application:
         if callable(obj):
             if inspect.iscoroutinefunction(obj):
                 return AsyncApplication(AsyncFunctionHandler(obj, trap_exceptions=True))
             return Application(FunctionHandler(obj, trap_exceptions=True))
         elif isinstance(obj, Path):
-            return build_single_handler_application(obj)
+            return build_single_handler_application(str(obj))
         else:
             return obj
 
     def _fixup(self, app: Application) -> Application:
+        from bokeh.application.handlers.document_lifecycle import DocumentLifecycleHandler
+
         if not any(isinstance(handler, DocumentLifecycleHandler) for handler in app.handlers):
             app.add(DocumentLifecycleHandler())
         return app
 
 
-def document(url: str, app: ApplicationLike) -> Routing:
-    return Routing(url, app, document=True)
+def document(url: str, app: ApplicationLike, **options: Any) -> Routing:
+    return Routing(url, app, document=True, **options)
 
 
-def autoload(url: str, app: ApplicationLike) -> Routing:
-    return Routing(url, app, autoload=True)
+def autoload(url: str, app: ApplicationLike, **options: Any) -> Routing:
+    return Routing(url, app, autoload=True, **options)
 
 
 def directory(*apps_paths: Path) -> List[Routing]:
+    """ A ``document`` route for every Bokeh app (script, notebook or
+    directory) in ``apps_paths``, at the name of the app.
+
+    The apps are built when they are first used.
+
+    """
     paths: List[Path] = []
 
-    for apps_path in apps_paths:
+    for apps_path in map(Path, apps_paths):
         if apps_path.exists():
             paths += [entry for entry in apps_path.glob("*") if is_bokeh_app(entry)]
         else:
             log.warning(f"bokeh applications directory '{apps_path}' doesn't exist")
 
-    paths = [str(p) for p in paths]
-    return [document(url, app) for url, app in build_single_handler_applications(paths).items()]
+    routings: Dict[str, Routing] = {}
+    for path in paths:
+        # the URL that bokeh.command.util.build_single_handler_applications gives the app
+        url = "/" + (path.name if path.is_dir() else path.stem)
+        if url in routings:
+            raise RuntimeError(f"Don't know the URL path to use for {path}")
+        routings[url] = document(url, path)
+    return list(routings.values())
 
 
 class RoutingConfiguration:
     _http_urlpatterns: List[str] = []
     _websocket_urlpatterns: List[str] = []
+    _autoload_routings: List[Tuple[Pattern[str], Routing]]
+
+    def __init__(self, routings: List[Routing], *, batch_autoload_url: str | None = BATCH_AUTOLOAD_URL,
+            load_url: str | None = None) -> None:
+        from django.urls import re_path
+
+        from .consumers import BatchAutoloadJsConsumer, LoadConsumer
 
-    def __init__(self, routings: List[Routing]) -> None:
+        self.routings = list(routings)
+        self._autoload_routings = []
         for routing in routings:
             self._add_new_routing(routing)
 
+        if batch_autoload_url is not None and self._autoload_routings:
+            kwargs = dict(routings=self._autoload_routings)
+            self._http_urlpatterns.append(re_path(f"^{batch_autoload_url.strip('^$/')}$",
+                                                  BatchAutoloadJsConsumer.as_asgi(**kwargs)))
+        if load_url is not None:
+            self._http_urlpatterns.append(re_path(f"^{load_url.strip('^$/')}$", LoadConsumer.as_asgi()))
+
     def get_http_urlpatterns(self) -> List[URLPattern]:
+        from django.core.asgi import get_asgi_application
+        from django.urls import re_path
+
         return self._http_urlpatterns + [re_path(r"", get_asgi_application())]
 
     def get_websocket_urlpatterns(self) -> List[URLPattern]:
         return self._websocket_urlpatterns
 
+    def get_http_router(self) -> CompiledRouter:
+        """ A ``URLRouter`` for ``get_http_urlpatterns`` that does not try every pattern in turn. """
+        from .router import CompiledRouter
+
+        return CompiledRouter(self.get_http_urlpatterns())
+
+    def get_websocket_router(self) -> CompiledRouter:
+        """ A ``URLRouter`` for ``get_websocket_urlpatterns`` that does not try every pattern in turn. """
+        from .router import CompiledRouter
+
+        return CompiledRouter(self.get_websocket_urlpatterns())
+
+    def lifespan(self, app: Callable[..., Any], **options: Any) -> Lifespan:
+        """ Wrap the ASGI application to warm these routes on startup and close
+        their sessions on shutdown, see ``bokeh_django.lifespan.Lifespan``.
+
+        """
+        from .lifespan import Lifespan
+
+        return Lifespan(app, self, **options)
+
+    def resolve_autoload(self, path: str) -> Tuple[ApplicationContext, Dict[str, Any]] | None:
+        from .consumers import resolve_routing
+
+        return resolve_routing(self._autoload_routings, path)
+
     def _add_new_routing(self, routing: Routing) -> None:
-        kwargs = dict(app_context=routing.app_context)
+        from django.urls import re_path
+
+        from .consumers import AutoloadJsConsumer, DocConsumer, WSConsumer
+
+        # the consumers get the application context from the routing when a request first needs it
+        kwargs = dict(routing=routing)
 
         def urlpattern(suffix=""):
             return f"^{routing.url.strip('^$/')}{suffix}$"
@@ -260,13 +303,23 @@ class RoutingConfiguration:
             self._http_urlpatterns.append(re_path(urlpattern(), DocConsumer.as_asgi(**kwargs)))
         if routing.autoload:
             self._http_urlpatterns.append(re_path(urlpattern("/autoload.js"), AutoloadJsConsumer.as_asgi(**kwargs)))
+            self._autoload_routings.append((re.compile(urlpattern()), routing))
 
-        self._websocket_urlpatterns.append(re_path(urlpattern("/ws"), WSConsumer.as_asgi(**kwargs)))
+        if routing.snapshots is None or routing.autoload:
+            self._websocket_urlpatterns.append(re_path(urlpattern("/ws"), WSConsumer.as_asgi(**kwargs)))
 
 # -----------------------------------------------------------------------------
 # Dev API
 # -----------------------------------------------------------------------------
 
+
+def __getattr__(name: str) -> Any:
+    # the application classes live in bokeh_django.context, which imports the Bokeh server
+    if name in ("AsyncApplication", "AsyncFunctionHandler", "DjangoApplicationContext"):
+        from . import context
+        return getattr(context, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # -----------------------------------------------------------------------------
 # Private API
 # -----------------------------------------------------------------------------
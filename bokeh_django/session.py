@@ -0,0 +1,283 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import weakref
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Tuple, TypeVar
+
+# External imports
+import numpy as np
+
+# Bokeh imports
+from bokeh.document.events import (
+    ColumnDataChangedEvent,
+    ColumnsPatchedEvent,
+    ColumnsStreamedEvent,
+    ModelChangedEvent,
+)
+from bokeh.models import ColumnDataSource
+from bokeh.server.session import ServerSession, _needs_document_lock
+
+# Local imports
+from . import metrics, timing
+from .footprint import SessionFootprint
+
+if TYPE_CHECKING:
+    from bokeh.document.events import DocumentPatchedEvent
+    from bokeh.protocol import messages as msg
+    from bokeh.server.callbacks import SessionCallback
+    from bokeh.server.connection import ServerConnection
+
+    from .spill import SpillStore
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'DjangoServerSession',
+)
+
+T = TypeVar("T")
+
+# Rough size of one ``(index, value)`` entry of a ``ColumnsPatched`` message, in bytes
+PATCH_ITEM_BYTES = 24
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+class DjangoServerSession(ServerSession):
+    """ A ``ServerSession`` that encodes each document change once for all of its connections.
+
+    A ``shared`` session is viewed by every client of its route. Changes sent
+    by the clients (``PATCH-DOC`` and ``PUSH-DOC``) are acknowledged but not
+    applied, so that one viewer cannot change what the others see; they stay
+    local to the browser that made them.
+
+    With ``diff_data``, replacing the whole ``data`` of a ``ColumnDataSource``
+    is compared with the columns sent before, and only what differs goes to
+    the clients: the appended rows (``ColumnsStreamed``), the changed rows
+    (``ColumnsPatched``) or the changed columns (``ColumnDataChanged``).
+    Columns are compared by value only if they are distinct numeric arrays;
+    a column that is the same object as before counts as unchanged, so
+    changes made in place must be followed by assigning a new array.
+
+    The callbacks of the document are timed and accounted to the session and
+    its ``route``, see ``bokeh_django.timing``, and its memory is estimated in
+    ``footprint``, see ``bokeh_django.footprint``. With a ``spill`` store, the
+    changes of the document count as use of the session and the spilled
+    columns are loaded back before anything runs with the document locked.
+
+    """
+
+    _sent_data: weakref.WeakKeyDictionary[ColumnDataSource, Dict[str, Any]] | None
+
+    def __init__(self, *args: Any, shared: bool = False, diff_data: bool = False, route: str = "",
+            spill: SpillStore | None = None, **kwargs: Any) -> None:
+        # set before the base class wraps the session callbacks of the document
+        self.route = route
+        self.spill = spill
+        super().__init__(*args, **kwargs)
+        self.shared = shared
+        timing.instrument(self, route)
+        self.footprint = SessionFootprint(self.document)
+        self._sent_data = None
+        if diff_data:
+            self._sent_data = weakref.WeakKeyDictionary()
+            for model in self.document.models:
+                if isinstance(model, ColumnDataSource):
+                    self._sent_data[model] = dict(model.data)
+
+    @_needs_document_lock
+    def with_document_locked(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        # session callbacks and push handlers run through here, they must not write into spilled columns
+        if self.spill is not None:
+            self.spill.restore(self)
+        return func(*args, **kwargs)
+
+    def _document_patched(self, event: DocumentPatchedEvent) -> None:
+        may_suppress = event.setter is self
+        if self.spill is not None:
+            # what changes is sent to the browser, the session is in use
+            self.spill.active(self)
+
+        if self._pending_writes is None:
+            raise RuntimeError("_pending_writes should be non-None when we have a document lock, and we should have the lock when the document changes")
+
+        events = self._diff_data(event) if self._sent_data is not None else [event]
+
+        connections = [connection for connection in self._subscribed_connections
+                       if not (may_suppress and connection is self._current_patch_connection)]
+        if not connections or not events:
+            return
+
+        # A message caches its serialized parts, so all connections share one encoding
+        message = connections[0].protocol.create('PATCH-DOC', events)
+        for connection in connections:
+            self._pending_writes.append(connection._socket.send_message(message))
+
+    def _wrap_session_callback(self, callback: SessionCallback) -> SessionCallback:
+        wrapped = super()._wrap_session_callback(callback)
+        locked = wrapped._callback
+        kind = type(callback).__name__
+        name = getattr(callback.callback, "__qualname__", repr(callback.callback))
+        wrapped._callback = lambda: timing.timed_call(kind, name, self, self.route, locked)
+        return wrapped
+
+    async def _handle_patch(self, message: msg.patch_doc, connection: ServerConnection) -> msg.ok:
+        if self.shared:
+            return self._ignore_client_change(message, connection)
+        return await super()._handle_patch(message, connection)
+
+    async def _handle_push(self, message: msg.push_doc, connection: ServerConnection) -> msg.ok:
+        if self.shared:
+            return self._ignore_client_change(message, connection)
+        return await super()._handle_push(message, connection)
+
+    def columns_replaced(self, source: ColumnDataSource) -> None:
+        """ Take note that columns of ``source`` were swapped without a change event.
+
+        """
+        self.footprint.columns_replaced(source)
+        if self._sent_data is not None and source in self._sent_data:
+            self._sent_data[source] = dict(source.data)
+
+    def _diff_data(self, event: DocumentPatchedEvent) -> List[DocumentPatchedEvent]:
+        model = getattr(event, "model", None)
+        if not isinstance(model, ColumnDataSource) or getattr(event, "attr", None) != "data":
+            return [event]
+
+        previous = self._sent_data.get(model)
+        self._sent_data[model] = dict(model.data)
+        if previous is None or not _replaces_data(event):
+            return [event]
+
+        diff = _diff_columns(previous, model.data)
+        if diff is None:
+            metrics.increment("cds_diff_events", kind="full")
+            return [event]
+
+        streamed, patches, columns = diff
+        events: List[DocumentPatchedEvent] = []
+        sent = 0
+        if streamed:
+            events.append(ColumnsStreamedEvent(self.document, model, "data", streamed, setter=event.setter))
+            sent += sum(_nbytes(column) for column in streamed.values())
+            metrics.increment("cds_diff_events", kind="stream")
+        if patches:
+            events.append(ColumnsPatchedEvent(self.document, model, "data", patches, setter=event.setter))
+            sent += PATCH_ITEM_BYTES * sum(len(patch) for patch in patches.values())
+            metrics.increment("cds_diff_events", kind="patch")
+        if columns:
+            events.append(ColumnDataChangedEvent(self.document, model, "data", cols=columns, setter=event.setter))
+            sent += sum(_nbytes(model.data[name]) for name in columns)
+            metrics.increment("cds_diff_events", kind="columns")
+
+        full = sum(_nbytes(column) for column in model.data.values())
+        metrics.increment("cds_diff_bytes_saved", max(full - sent, 0))
+        return events
+
+    def _ignore_client_change(self, message: msg.patch_doc | msg.push_doc, connection: ServerConnection) -> msg.ok:
+        log.debug("Ignoring %s sent to shared session %r", message.msgtype, self.id)
+        metrics.increment("shared_session_changes_ignored")
+        return connection.ok(message)
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+
+def _diff_columns(old: Dict[str, Any], new: Dict[str, Any]) \
+        -> Tuple[Dict[str, Any], Dict[str, List[Tuple[int, Any]]], List[str]] | None:
+    """ Compare two versions of ``ColumnDataSource.data``.
+
+    Returns the rows appended to every column, or the changed rows and the
+    changed columns of data that kept its length, or ``None`` if the new data
+    has to be sent as a whole.
+
+    """
+    if not new or old.keys() != new.keys():
+        return None
+    old_lengths = {len(column) for column in old.values()}
+    new_lengths = {len(column) for column in new.values()}
+    if len(old_lengths) != 1 or len(new_lengths) != 1:
+        return None
+    old_length, new_length = old_lengths.pop(), new_lengths.pop()
+
+    if new_length > old_length:
+        for name, column in new.items():
+            if not _same_values(old[name], column[:old_length]):
+                return None
+        return {name: column[old_length:] for name, column in new.items()}, {}, []
+    if new_length != old_length:
+        return None
+
+    patches: Dict[str, List[Tuple[int, Any]]] = {}
+    columns: List[str] = []
+    for name, column in new.items():
+        if column is old[name]:
+            continue
+        rows = _changed_rows(old[name], column)
+        if rows is None or len(rows) * PATCH_ITEM_BYTES >= _nbytes(column):
+            columns.append(name)
+        elif len(rows):
+            patches[name] = list(zip(rows.tolist(), column[rows].tolist()))
+    return {}, patches, columns
+
+
+def _replaces_data(event: DocumentPatchedEvent) -> bool:
+    # ``source.data = ...`` gives a ColumnDataChangedEvent for all columns, a ModelChangedEvent in older Bokeh
+    if isinstance(event, ColumnDataChangedEvent):
+        return event.cols is None and event.data is None
+    return type(event) is ModelChangedEvent
+
+
+def _is_numeric(column: Any) -> bool:
+    return isinstance(column, np.ndarray) and column.ndim == 1 and column.dtype.kind in "biuf"
+
+
+def _changed_rows(old: Any, new: Any) -> np.ndarray | None:
+    if not (_is_numeric(old) and _is_numeric(new)):
+        return None
+    changed = old != new
+    if new.dtype.kind == "f" and old.dtype.kind == "f":
+        changed &= ~(np.isnan(old) & np.isnan(new))
+    return np.flatnonzero(changed)
+
+
+def _same_values(old: Any, new: Any) -> bool:
+    if old is new:
+        return True
+    if not (_is_numeric(old) and _is_numeric(new)):
+        return False
+    return np.array_equal(old, new, equal_nan=old.dtype.kind == "f" and new.dtype.kind == "f")
+
+
+def _nbytes(column: Any) -> int:
+    return column.nbytes if isinstance(column, np.ndarray) else 8 * len(column)
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
@@ -0,0 +1,123 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, NamedTuple
+
+# Local imports
+from . import metrics
+from .conf import get_setting
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'Snapshot',
+    'SnapshotCache',
+)
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+class Snapshot(NamedTuple):
+    html: bytes
+    etag: str
+    created: float
+
+
+class SnapshotCache:
+    """ Standalone pages of a ``snapshot`` route, rendered once per path.
+
+    A snapshot is rendered again once it is older than ``ttl`` seconds (never,
+    if ``ttl`` is ``None``) or after ``invalidate``. Concurrent requests for a
+    missing snapshot wait for a single rendering. Holds the snapshots of
+    ``maxsize`` paths (default: ``BOKEH_DJANGO_SNAPSHOT_CACHE_SIZE`` or 128),
+    least recently used first out. Hits and renders are counted by ``route``.
+
+    """
+
+    def __init__(self, ttl: float | None = None, maxsize: int | None = None, route: str = "") -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.route = route
+        self._snapshots: OrderedDict[str, Snapshot] = OrderedDict()
+        # the current rendering of each path, invalidate drops it so that it is not kept
+        self._rendering: Dict[str, asyncio.Future[Snapshot]] = {}
+
+    async def get(self, path: str, render: Callable[[], Awaitable[str]]) -> Snapshot:
+        snapshot = self._snapshots.get(path)
+        if snapshot is not None and (self.ttl is None or time.monotonic() - snapshot.created < self.ttl):
+            self._snapshots.move_to_end(path)
+            metrics.increment("snapshot_hits", route=self.route)
+            return snapshot
+
+        rendering = self._rendering.get(path)
+        if rendering is None:
+            rendering = self._rendering[path] = asyncio.ensure_future(self._render(path, render))
+            rendering.add_done_callback(lambda done: self._rendered(path, done))
+        return await asyncio.shield(rendering)
+
+    def invalidate(self, path: str | None = None) -> None:
+        """ Drop the snapshot of ``path``, or all snapshots. """
+        if path is None:
+            self._snapshots.clear()
+            self._rendering.clear()
+        else:
+            self._snapshots.pop(path, None)
+            self._rendering.pop(path, None)
+
+    async def _render(self, path: str, render: Callable[[], Awaitable[str]]) -> Snapshot:
+        started = time.monotonic()
+        html = (await render()).encode()
+        snapshot = Snapshot(html, f'"{hashlib.sha1(html).hexdigest()}"', time.monotonic())
+        metrics.increment("snapshot_renders", route=self.route)
+        log.debug("Rendered snapshot of %r (%d bytes) in %.3fs", path, len(html), snapshot.created - started)
+        if self._rendering.get(path) is not asyncio.current_task():
+            # invalidated while rendering, the requests already waiting get this snapshot but later ones don't
+            return snapshot
+
+        self._snapshots[path] = snapshot
+        self._snapshots.move_to_end(path)
+        maxsize = self.maxsize if self.maxsize is not None else get_setting("SNAPSHOT_CACHE_SIZE", 128)
+        while len(self._snapshots) > maxsize:
+            self._snapshots.popitem(last=False)
+        return snapshot
+
+    def _rendered(self, path: str, rendering: asyncio.Future[Snapshot]) -> None:
+        if self._rendering.get(path) is rendering:
+            del self._rendering[path]
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
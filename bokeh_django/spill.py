@@ -0,0 +1,230 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import asyncio
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, List, Set, Tuple
+
+# External imports
+import numpy as np
+
+# Bokeh imports
+from bokeh.models import ColumnDataSource
+
+# Local imports
+from . import metrics
+from .conf import get_setting
+
+if TYPE_CHECKING:
+    from bokeh.document import Document
+    from bokeh.server.session import ServerSession
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'SpillStore',
+)
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+class SpillStore:
+    """ Move the column data of idle sessions out of the worker's memory.
+
+    Once a session has not been used for ``idle_seconds``, every numeric
+    ``ndarray`` column of its ``ColumnDataSource`` models larger than
+    ``BOKEH_DJANGO_SPILL_MIN_BYTES`` (default 64 KiB) is saved as a ``.npy``
+    file under ``BOKEH_DJANGO_SPILL_DIR`` (default: a directory in the system
+    temporary directory) and replaced by a copy-on-write memory map of that
+    file. The models and their callbacks stay as they are; the data stops
+    counting towards the resident memory of the worker until it is read
+    again.
+
+    A session is used by the messages of its browser, a new connection, a
+    change of its document (which is sent to the browser) and every callback
+    or push handler run with its document locked. The spilled columns are
+    loaded back into memory before any of these runs.
+
+    Replacing columns does not emit change events, since the data seen by the
+    browser does not change. Every worker spills to a directory of its own,
+    removed on ``close``; the directories of workers that are gone are
+    removed the first time a process spills.
+
+    """
+
+    def __init__(self, idle_seconds: float, directory: str | os.PathLike[str] | None = None,
+            min_bytes: int | None = None) -> None:
+        self.idle_seconds = idle_seconds
+        if directory is None:
+            directory = get_setting("SPILL_DIR") or Path(tempfile.gettempdir()) / "bokeh_django_spill"
+        self.root = Path(directory)
+        self.min_bytes = min_bytes if min_bytes is not None else get_setting("SPILL_MIN_BYTES", 64 * 1024)
+        self._last_touched: Dict[str, float] = {}
+        self._spilled: Dict[str, List[Tuple[ColumnDataSource, str, Path]]] = {}
+
+    @property
+    def directory(self) -> Path:
+        # the stores are created before runbokeh forks its workers
+        return self.root / str(os.getpid())
+
+    def is_spilled(self, session: ServerSession) -> bool:
+        return session.id in self._spilled
+
+    def active(self, session: ServerSession) -> None:
+        """ Mark the session as used. """
+        self._last_touched[session.id] = time.monotonic()
+
+    async def touch(self, session: ServerSession) -> None:
+        """ Mark the session as used, loading its spilled columns back if needed. """
+        self.active(session)
+        if session.id in self._spilled and not session.destroyed:
+            await session.with_document_locked(self.restore, session)
+
+    def restore(self, session: ServerSession) -> None:
+        """ Mark the session as used and load its spilled columns back, with its document locked. """
+        self.active(session)
+        spilled = self._spilled.pop(session.id, None)
+        if spilled is None:
+            return
+        for source, name, path in spilled:
+            column = source.data.get(name)
+            if isinstance(column, np.memmap) and column.filename is not None and Path(column.filename) == path:
+                dict.__setitem__(source.data, name, np.array(column))
+        _columns_replaced(session, spilled)
+        shutil.rmtree(self.directory / session.id, ignore_errors=True)
+        metrics.increment("sessions_restored")
+
+    async def sweep(self, sessions: Iterable[ServerSession], route: str = "") -> None:
+        """ Spill every session that has been idle for longer than ``idle_seconds``. """
+        now = time.monotonic()
+        for session in list(sessions):
+            last_touched = self._last_touched.setdefault(session.id, now)
+            if session.destroyed or session.id in self._spilled or now - last_touched < self.idle_seconds:
+                continue
+            await session.with_document_locked(self._spill, session, route)
+
+    def forget(self, session: ServerSession) -> None:
+        """ Drop the bookkeeping and files of a discarded session. """
+        self._last_touched.pop(session.id, None)
+        self._spilled.pop(session.id, None)
+        shutil.rmtree(self.directory / session.id, ignore_errors=True)
+
+    def close(self) -> None:
+        """ Remove the files of every spilled session, and the directory of the worker once it is empty. """
+        for session_id in list(self._spilled):
+            shutil.rmtree(self.directory / session_id, ignore_errors=True)
+        self._spilled.clear()
+        self._last_touched.clear()
+        with contextlib.suppress(OSError):
+            self.directory.rmdir()
+
+    async def _spill(self, session: ServerSession, route: str) -> None:
+        columns = list(_spillable_columns(session.document, self.min_bytes))
+        if not columns:
+            return
+
+        directory = self.directory / session.id
+        paths = [directory / f"{source.id}-{i}.npy" for i, (source, _, _) in enumerate(columns)]
+
+        def save() -> None:
+            _remove_stale_directories(self.root)
+            directory.mkdir(parents=True, exist_ok=True)
+            for (_, _, array), path in zip(columns, paths):
+                np.save(path, array, allow_pickle=False)
+
+        await asyncio.get_running_loop().run_in_executor(None, save)
+
+        spilled = []
+        for (source, name, array), path in zip(columns, paths):
+            # the column may have been replaced while the files were written
+            if source.data.get(name) is array:
+                dict.__setitem__(source.data, name, np.load(path, mmap_mode="c"))
+                spilled.append((source, name, path))
+        self._spilled[session.id] = spilled
+        _columns_replaced(session, spilled)
+
+        nbytes = sum(array.nbytes for _, _, array in columns)
+        metrics.increment("sessions_spilled", route=route)
+        metrics.increment("spilled_bytes", nbytes, route=route)
+        log.debug("Spilled %d columns (%d bytes) of idle session %r", len(spilled), nbytes, session.id)
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+
+# The processes whose spill directory was already cleaned of the directories of dead workers
+_cleaned: Set[int] = set()
+
+
+def _remove_stale_directories(root: Path) -> None:
+    # files left behind by workers that crashed or were killed
+    pid = os.getpid()
+    if pid in _cleaned:
+        return
+    _cleaned.add(pid)
+    for entry in root.glob("*"):
+        if entry.is_dir() and entry.name.isdigit() and int(entry.name) != pid and not _is_running(int(entry.name)):
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _columns_replaced(session: ServerSession, spilled: List[Tuple[ColumnDataSource, str, Path]]) -> None:
+    # the session must not keep the swapped out arrays alive
+    columns_replaced = getattr(session, "columns_replaced", None)
+    if columns_replaced is not None:
+        for source in {source for source, _, _ in spilled}:
+            columns_replaced(source)
+
+
+def _spillable_columns(document: Document, min_bytes: int) -> Iterable[Tuple[ColumnDataSource, str, np.ndarray]]:
+    for model in document.models:
+        if not isinstance(model, ColumnDataSource):
+            continue
+        for name, column in model.data.items():
+            if isinstance(column, np.ndarray) and not isinstance(column, np.memmap) \
+                    and column.dtype.kind in "biufcmM" and column.nbytes >= min_bytes:
+                yield model, name, column
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
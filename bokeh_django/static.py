@@ -28,9 +28,6 @@ from django.views import static
 from django.contrib.staticfiles.finders import BaseFinder
 from django.utils._os import safe_join
 
-# Bokeh imports
-from bokeh.embed.bundle import extension_dirs
-
 # -----------------------------------------------------------------------------
 # General API
 # -----------------------------------------------------------------------------
@@ -43,9 +40,14 @@ class BokehExtensionFinder(BaseFinder):
         When using `django.contrib.staticfiles' in `INSTALLED_APPS` then add
         `bokeh_django.static.BokehExtensionFinder` to `STATICFILES_FINDERS`
     """
-    _root = extension_dirs
     _prefix = 'extensions/'
 
+    @classmethod
+    def _root(cls):
+        # bokeh.embed is slow to import, and this module is imported by every process using the finder
+        from bokeh.embed.bundle import extension_dirs
+        return extension_dirs
+
     def find(self, path, all=False):
         """
         Given a relative file path, find an absolute file path.
@@ -82,7 +84,7 @@ class BokehExtensionFinder(BaseFinder):
             except ValueError:
                 pass
             else:
-                artifacts_dir = cls._root.get(name, None)
+                artifacts_dir = cls._root().get(name, None)
                 if artifacts_dir is not None:
                     path = safe_join(artifacts_dir, artifact_path)
                     if os.path.exists(path):
@@ -0,0 +1,135 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+""" Compile the page templates of documents once.
+
+A handler setting ``doc.template`` to a Jinja source string does so for every
+session, and Bokeh parses and compiles the string again for every page. The
+pages of bokeh_django render ``templates.compiled(doc.template)`` instead,
+which keeps the compiled templates of the most recently used sources.
+
+"""
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict
+
+# Local imports
+from . import metrics
+from .conf import get_setting
+
+if TYPE_CHECKING:
+    from jinja2 import Template
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'TemplateCache',
+    'templates',
+)
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+class TemplateCache:
+    """ Compiled templates by hash of their source, least recently used first out.
+
+    Holds ``maxsize`` templates (default: ``BOKEH_DJANGO_TEMPLATE_CACHE_SIZE``
+    or 128). Lookups count as ``template_cache_hits`` or
+    ``template_cache_misses`` and compiling adds to ``template_compile_seconds``.
+
+    """
+
+    def __init__(self, maxsize: int | None = None) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.compile_seconds = 0.0
+        self._templates: OrderedDict[bytes, Template] = OrderedDict()
+        # snapshots are rendered in executor threads
+        self._lock = threading.Lock()
+
+    def compiled(self, template: Template | str | None) -> Template | None:
+        """ The compiled ``template`` if it is a source string, else ``template`` itself. """
+        if not isinstance(template, str):
+            return template
+
+        key = hashlib.blake2b(template.encode(), digest_size=16).digest()
+        with self._lock:
+            compiled = self._templates.get(key)
+            if compiled is not None:
+                self._templates.move_to_end(key)
+                self.hits += 1
+        if compiled is not None:
+            metrics.increment("template_cache_hits")
+            return compiled
+
+        from bokeh.core.templates import get_env
+
+        started = time.perf_counter()
+        # the same as bokeh.embed.elements.html_page_for_render_items does for every page
+        compiled = get_env().from_string("{% extends base %}\n" + template)
+        elapsed = time.perf_counter() - started
+
+        maxsize = self.maxsize if self.maxsize is not None else get_setting("TEMPLATE_CACHE_SIZE", 128)
+        with self._lock:
+            self.misses += 1
+            self.compile_seconds += elapsed
+            self._templates[key] = compiled
+            while len(self._templates) > maxsize:
+                self._templates.popitem(last=False)
+        metrics.increment("template_cache_misses")
+        metrics.increment("template_compile_seconds", elapsed)
+        return compiled
+
+    def clear(self) -> None:
+        with self._lock:
+            self._templates.clear()
+
+    def report(self) -> Dict[str, Any]:
+        """ Size, hit rate and total compile time of the cache. """
+        lookups = self.hits + self.misses
+        return dict(
+            size=len(self._templates),
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / lookups if lookups else None,
+            compile_seconds=self.compile_seconds,
+        )
+
+
+templates = TemplateCache()
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
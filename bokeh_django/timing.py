@@ -0,0 +1,313 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+""" Time the Python code that sessions run on the event loop.
+
+Inbound websocket messages, ``on_change`` and ``on_event`` callbacks and
+periodic, timeout and next tick callbacks are timed per session. Each stretch
+of code blocking the event loop for longer than ``BOKEH_DJANGO_SLOW_CALLBACK_MS``
+(default: 250) is logged with the route, the session, the callback and the
+stack sampled as soon as it reaches the threshold. The CPU time of every
+session and route is accumulated, see ``report``.
+
+Document callbacks that ``bokeh_django`` registers itself, like the footprint
+of the session, are wrapped with ``untimed`` and are not accounted to the
+code whose changes they follow.
+
+"""
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import functools
+import inspect
+import math
+import sys
+import threading
+import time
+import traceback
+import weakref
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Generator,
+    List,
+    TypeVar,
+    cast,
+)
+
+# Local imports
+from . import metrics
+from .conf import get_setting
+
+if TYPE_CHECKING:
+    from bokeh.server.session import ServerSession
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'instrument',
+    'report',
+    'session_cpu_seconds',
+    'timed_call',
+    'untimed',
+)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+def timed_call(kind: str, name: str, session: ServerSession, route: str,
+        func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """ Call ``func`` and account its time to ``session``.
+
+    An awaitable result is returned wrapped, so that the time of each of its
+    steps is accounted too.
+
+    """
+    timing = _start(kind, name, session, route)
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        _finish(timing)
+    if inspect.isawaitable(result):
+        return _timed_awaitable(result, kind, name, session, route)
+    return result
+
+
+def instrument(session: ServerSession, route: str) -> None:
+    """ Time the ``on_change`` and ``on_event`` callbacks of the document of ``session``. """
+    callbacks = session.document.callbacks
+    trigger_on_change = callbacks.trigger_on_change
+    trigger_event = callbacks.trigger_event
+
+    def timed_trigger_on_change(event: Any) -> None:
+        invoker = event.callback_invoker
+        # held events come back through here when the hold is released
+        if invoker is not None and callbacks._hold is None:
+            model, attr = getattr(event, "model", None), getattr(event, "attr", None)
+            name = f"{type(model).__name__}.{attr}" if model is not None else type(event).__name__
+            event.callback_invoker = lambda: timed_call("on_change", name, session, route, invoker)
+        trigger_on_change(event)
+
+    def timed_trigger_event(event: Any) -> None:
+        timed_call("on_event", event.event_name, session, route, trigger_event, event)
+
+    callbacks.trigger_on_change = timed_trigger_on_change
+    callbacks.trigger_event = timed_trigger_event
+
+
+def untimed(func: F) -> F:
+    """ Leave the time spent in ``func`` out of the timings it runs in. """
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        running = _running.get(threading.get_ident())
+        if not running:
+            return func(*args, **kwargs)
+        sampled = running[-1].stack is not None
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            wall, cpu = time.perf_counter() - started, time.thread_time() - cpu_started
+            for timing in running:
+                timing.started += wall
+                timing.cpu_started += cpu
+            if not sampled:
+                # a stack sampled meanwhile shows func
+                running[-1].stack = None
+    return cast(F, wrapper)
+
+
+def session_cpu_seconds(session: ServerSession) -> float:
+    return _session_cpu.get(session, 0.0)
+
+
+def report(top: int = 10) -> Dict[str, Any]:
+    """ CPU seconds spent per route, and the ``top`` sessions that spent the most. """
+    routes: Dict[str, float] = {}
+    for counter in metrics.snapshot():
+        if counter["name"] == "callback_cpu_seconds":
+            route = counter["labels"].get("route", "")
+            routes[route] = routes.get(route, 0.0) + counter["value"]
+    sessions = sorted(((session.id, _session_route.get(session, ""), seconds)
+                       for session, seconds in list(_session_cpu.items())), key=lambda s: s[2], reverse=True)
+    return dict(
+        routes=routes,
+        sessions=[dict(id=id, route=route, cpu_seconds=seconds) for id, route, seconds in sessions[:top]],
+    )
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+
+class _Timing:
+    __slots__ = ("kind", "name", "session", "route", "started", "cpu_started", "stack", "slow_inside")
+
+    def __init__(self, kind: str, name: str, session: ServerSession, route: str) -> None:
+        self.kind = kind
+        self.name = name
+        self.session = session
+        self.route = route
+        self.stack: str | None = None
+        self.slow_inside = False
+        self.started = time.perf_counter()
+        self.cpu_started = time.thread_time()
+
+
+# What each thread is running, innermost last; read by the watchdog thread
+_running: Dict[int, List[_Timing]] = {}
+
+_session_cpu: weakref.WeakKeyDictionary[ServerSession, float] = weakref.WeakKeyDictionary()
+_session_route: weakref.WeakKeyDictionary[ServerSession, str] = weakref.WeakKeyDictionary()
+
+_watchdog: threading.Thread | None = None
+
+# Set by _start for the watchdog while it waits with nothing to watch
+_wake = threading.Event()
+_idle = False
+
+
+def _start(kind: str, name: str, session: ServerSession, route: str) -> _Timing:
+    if _watchdog is None:
+        _start_watchdog()
+    timing = _Timing(kind, name, session, route)
+    _running.setdefault(threading.get_ident(), []).append(timing)
+    if _idle:
+        _wake.set()
+    return timing
+
+
+def _finish(timing: _Timing) -> None:
+    wall = time.perf_counter() - timing.started
+    cpu = time.thread_time() - timing.cpu_started
+    running = _running[threading.get_ident()]
+    running.pop()
+
+    if not running:
+        # only the outermost timing is accounted, the inner ones are part of it
+        session = timing.session
+        _session_cpu[session] = _session_cpu.get(session, 0.0) + cpu
+        _session_route[session] = timing.route
+        metrics.increment("callback_cpu_seconds", cpu, route=timing.route, kind=timing.kind)
+
+    threshold = _threshold()
+    if threshold is None or wall < threshold:
+        return
+    if running:
+        running[-1].slow_inside = True
+    if timing.slow_inside:
+        return  # the slow inner callback was already logged
+    metrics.increment("callbacks_slow", route=timing.route, kind=timing.kind)
+    log.warning("Slow %s %s in session %r of route %r: %.0f ms (%.0f ms CPU)\n%s",
+                timing.kind, timing.name, timing.session.id, timing.route, wall * 1000, cpu * 1000,
+                timing.stack or "(no stack sampled)")
+
+
+async def _timed_awaitable(awaitable: Awaitable[Any], kind: str, name: str, session: ServerSession, route: str) -> Any:
+    return await _TimedSteps(awaitable, kind, name, session, route)
+
+
+class _TimedSteps:
+    """ Times every step of an awaitable, leaving out the time it is suspended. """
+
+    def __init__(self, awaitable: Awaitable[Any], kind: str, name: str, session: ServerSession, route: str) -> None:
+        self._awaitable = awaitable
+        self._labels = (kind, name, session, route)
+
+    def __await__(self) -> Generator[Any, Any, Any]:
+        iterator = self._awaitable.__await__()
+        send: Callable[[Any], Any] = iterator.send
+        value: Any = None
+        while True:
+            timing = _start(*self._labels)
+            try:
+                signal = send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                _finish(timing)
+            try:
+                value = yield signal
+                send = iterator.send
+            except GeneratorExit:
+                iterator.close()
+                raise
+            except BaseException as e:
+                value = e
+                send = iterator.throw
+
+
+def _threshold() -> float | None:
+    threshold_ms = get_setting("SLOW_CALLBACK_MS", 250)
+    return threshold_ms / 1000 if threshold_ms is not None else None
+
+
+def _start_watchdog() -> None:
+    global _watchdog
+    _watchdog = threading.Thread(target=_watch, name="bokeh-django-slow-callbacks", daemon=True)
+    _watchdog.start()
+
+
+def _watch() -> None:
+    # Samples the stack of code that runs past the threshold while it is still running: sleeps until the
+    # innermost timing of a thread reaches the threshold, or until _start wakes it when nothing is timed
+    global _idle
+    while True:
+        threshold = _threshold()
+        if not threshold:
+            time.sleep(1)
+            continue
+        _idle = True
+        _wake.clear()
+        now = time.perf_counter()
+        frames = None
+        deadline = None
+        for thread_id, running in list(_running.items()):
+            timing = running[-1] if running else None
+            if timing is None or timing.stack is not None:
+                continue
+            if now - timing.started < threshold:
+                deadline = min(deadline or math.inf, timing.started + threshold)
+                continue
+            if frames is None:
+                frames = sys._current_frames()
+            frame = frames.get(thread_id)
+            if frame is not None:
+                timing.stack = "".join(traceback.format_stack(frame))
+        if deadline is None:
+            _wake.wait()
+        else:
+            _idle = False
+            # a timing started meanwhile reaches the threshold after this one
+            time.sleep(deadline - now)
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
@@ -0,0 +1,264 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+""" Trace the stages of opening a session.
+
+The stages of a page load and of the websocket that follows it are wrapped in
+spans carrying the route and session id:
+
+* ``resolve``: matching the URL route (needs ``TracingMiddleware``)
+* ``get_session``, with ``on_session_created`` and ``initialize_document``
+* ``html_page``: rendering the page, ``server_html_page_for_session``
+* ``connect``, with ``check_token``: the websocket handshake
+* ``async_open``: attaching the websocket to its session
+* ``ack`` and ``pull_doc``: the first messages of the connection
+
+Tracing is off until a tracer is configured, for example to write the spans
+to a file as JSON lines:
+
+.. code-block:: python
+
+    # settings.py
+    from bokeh_django.tracing import LogTracer
+    BOKEH_DJANGO_TRACER = LogTracer("/var/log/bokeh/spans.jsonl")
+
+``BOKEH_DJANGO_TRACER`` may also be the dotted path of a ``Tracer`` class.
+Other backends subclass ``Tracer`` and implement ``export``.
+
+"""
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator
+
+# Local imports
+from .conf import get_setting
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'LogTracer',
+    'Span',
+    'Tracer',
+    'TracingMiddleware',
+    'current_span',
+    'get_tracer',
+    'set_tracer',
+    'span',
+)
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+class Span:
+    """ One timed stage; spans started while it is open are its children. """
+
+    def __init__(self, name: str, parent: Span | None = None, **attributes: Any) -> None:
+        self.name = name
+        self.attributes: Dict[str, Any] = attributes
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start = time.time()
+        self.duration: float | None = None
+        self._started = time.perf_counter()
+        self._token: contextvars.Token[Span | None] | None = None
+
+    def set_attribute(self, name: str, value: Any) -> None:
+        self.attributes[name] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(
+            name=self.name,
+            trace_id=self.trace_id,
+            span_id=self.span_id,
+            parent_id=self.parent_id,
+            start=self.start,
+            duration=self.duration,
+            attributes=self.attributes,
+        )
+
+    def _end(self) -> None:
+        self.duration = time.perf_counter() - self._started
+
+    def __repr__(self) -> str:
+        return f"<Span {self.name} {self.attributes}>"
+
+
+class Tracer:
+    """ Receives every finished span. The base class drops them, and spans
+    are not even created while the configured tracer is not ``enabled``.
+
+    """
+
+    enabled = False
+
+    def export(self, span: Span) -> None:
+        pass
+
+
+class LogTracer(Tracer):
+    """ Write spans as JSON lines to ``path``, or to this module's logger at ``INFO`` level. """
+
+    enabled = True
+
+    def __init__(self, path: str | os.PathLike[str] | None = None) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str)
+        if self.path is None:
+            log.info(line)
+            return
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+class TracingMiddleware:
+    """ ASGI middleware opening a span for each request and timing how long
+    routing takes to reach a Bokeh consumer. Wrap the ``URLRouter``:
+
+    .. code-block:: python
+
+        "http": AuthMiddlewareStack(TracingMiddleware(URLRouter(...))),
+
+    """
+
+    def __init__(self, app: Callable[..., Any]) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable[..., Any], send: Callable[..., Any]) -> Any:
+        if scope["type"] not in ("http", "websocket") or not get_tracer().enabled:
+            return await self.app(scope, receive, send)
+        with span(scope["type"], path=scope["path"]):
+            resolving = start_span("resolve")
+            _resolving.set(resolving)
+            try:
+                return await self.app(scope, receive, send)
+            finally:
+                # not routed to a Bokeh consumer
+                end_span(resolving)
+
+
+def get_tracer() -> Tracer:
+    global _tracer
+    if _tracer is None:
+        tracer = get_setting("TRACER")
+        if isinstance(tracer, str):
+            from django.utils.module_loading import import_string
+            tracer = import_string(tracer)
+        if isinstance(tracer, type):
+            tracer = tracer()
+        _tracer = tracer or Tracer()
+    return _tracer
+
+
+def set_tracer(tracer: Tracer | None) -> None:
+    """ Use ``tracer`` instead of the ``BOKEH_DJANGO_TRACER`` setting (``None`` reads the setting again). """
+    global _tracer
+    _tracer = tracer
+
+
+def current_span() -> Span | None:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span | None]:
+    """ Time the enclosed block as a child of the current span.
+
+    Yields ``None`` when tracing is off.
+
+    """
+    if not get_tracer().enabled:
+        yield None
+        return
+    current = start_span(name, **attributes)
+    try:
+        yield current
+    except BaseException as e:
+        current.set_attribute("error", repr(e))
+        raise
+    finally:
+        end_span(current)
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+
+def start_span(name: str, **attributes: Any) -> Span:
+    current = Span(name, _current.get(), **attributes)
+    current._token = _current.set(current)
+    return current
+
+
+def end_span(current: Span) -> None:
+    if current.duration is not None:
+        return
+    current._end()
+    try:
+        _current.reset(current._token)
+    except ValueError:
+        # ended in another context than it started in
+        pass
+    try:
+        get_tracer().export(current)
+    except Exception as e:
+        log.error("Error exporting span %r: %s", current, e, exc_info=True)
+
+
+def routed() -> None:
+    """ End the ``resolve`` span of ``TracingMiddleware``, called when a consumer is created. """
+    resolving = _resolving.get()
+    if resolving is not None:
+        _resolving.set(None)
+        end_span(resolving)
+
+
+def annotate(**attributes: Any) -> None:
+    """ Set attributes of the current span, if tracing. """
+    current = _current.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+
+_tracer: Tracer | None = None
+
+_current: contextvars.ContextVar[Span | None] = contextvars.ContextVar("bokeh_django_span", default=None)
+
+_resolving: contextvars.ContextVar[Span | None] = contextvars.ContextVar("bokeh_django_resolving", default=None)
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
@@ -0,0 +1,176 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2012 - 2022, Anaconda, Inc., and Bokeh Contributors.
+# All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Boilerplate
+# -----------------------------------------------------------------------------
+from __future__ import annotations
+
+import logging # isort:skip
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+# Standard library imports
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List
+
+# External imports
+import numpy as np
+
+# Bokeh imports
+from bokeh.core.serialization import Buffer
+from bokeh.util.serialization import make_id
+
+# Local imports
+from . import metrics
+
+if TYPE_CHECKING:
+    from bokeh.protocol.message import Message
+
+# -----------------------------------------------------------------------------
+# Globals and constants
+# -----------------------------------------------------------------------------
+
+__all__ = (
+    'TransportPolicy',
+)
+
+# Integers above this lose precision as float64
+MAX_EXACT_INTEGER = 2 ** 53
+
+# -----------------------------------------------------------------------------
+# General API
+# -----------------------------------------------------------------------------
+
+
+class TransportPolicy:
+    """ How the arrays of the websocket messages of a route are encoded.
+
+    Args:
+        float32_tolerance (float, optional) :
+            send ``float64`` arrays as ``float32`` when no value changes by
+            more than this relative tolerance (default: ``None``, never)
+
+        binary (bool, optional) :
+            send numeric arrays that Bokeh falls back to encoding as JSON lists
+            (like ``int64`` values outside of the ``int32`` range) as ``float64``
+            buffers, when that is exact (default: ``True``)
+
+        compress_above (int, optional) :
+            gzip buffers of at least this many bytes and inline them in the
+            message as base64, which BokehJS decodes, when that is smaller
+            (default: ``None``, never)
+
+    The policy is applied once per message, before the message is encoded,
+    and the bytes it saves are counted in ``transport_bytes_saved``.
+
+    """
+
+    def __init__(self, float32_tolerance: float | None = None, binary: bool = True,
+            compress_above: int | None = None) -> None:
+        self.float32_tolerance = float32_tolerance
+        self.binary = binary
+        self.compress_above = compress_above
+
+    def apply(self, message: Message[Any], route: str = "") -> None:
+        if getattr(message, "_transport_policy", None) is self:
+            return
+        message._transport_policy = self
+
+        changed = False
+        for rep in _ndarray_reps(message.content):
+            if self.binary and rep.get("dtype") == "object":
+                changed |= self._to_binary(message, rep)
+            if self.float32_tolerance is not None and rep.get("dtype") == "float64":
+                changed |= self._to_float32(rep, route)
+            if self.compress_above is not None:
+                changed |= self._compress(message, rep, route)
+
+        if changed:
+            message._content_json = None
+        # add_buffer counts the buffers it adds in the header, compressed buffers are removed from it here
+        if message._header.get("num_buffers", 0) != len(message._buffers):
+            if message._buffers:
+                message._header["num_buffers"] = len(message._buffers)
+            else:
+                message._header.pop("num_buffers", None)
+            message._header_json = None
+
+    def _to_binary(self, message: Message[Any], rep: Dict[str, Any]) -> bool:
+        values = rep.get("array")
+        if not isinstance(values, list) or not values or \
+                not all(type(value) in (int, float) for value in values):
+            return False
+        array = np.array(values, dtype=np.float64)
+        if any(type(value) is int for value in values) and np.abs(array).max() > MAX_EXACT_INTEGER:
+            return False
+        buffer = Buffer(make_id(), array.tobytes())
+        message.add_buffer(buffer)
+        rep["array"] = dict(type="bytes", data=buffer)
+        rep["dtype"] = "float64"
+        return True
+
+    def _to_float32(self, rep: Dict[str, Any], route: str) -> bool:
+        buffer = _buffer_of(rep)
+        if buffer is None:
+            return False
+        array = np.frombuffer(buffer.data, dtype=np.float64)
+        with np.errstate(over="ignore", invalid="ignore"):
+            downcast = array.astype(np.float32)
+            if not np.allclose(downcast, array, rtol=self.float32_tolerance, atol=0, equal_nan=True):
+                return False
+        buffer.data = downcast.tobytes()
+        rep["dtype"] = "float32"
+        metrics.increment("transport_bytes_saved", array.nbytes - downcast.nbytes, route=route, kind="float32")
+        return True
+
+    def _compress(self, message: Message[Any], rep: Dict[str, Any], route: str) -> bool:
+        buffer = _buffer_of(rep)
+        if buffer is None or len(buffer.data) < self.compress_above:
+            return False
+        compressed = buffer.to_base64()
+        if len(compressed) >= len(buffer.data):
+            return False
+        message._buffers.remove(buffer)
+        rep["array"] = dict(type="bytes", data=compressed)
+        metrics.increment("transport_bytes_saved", len(buffer.data) - len(compressed), route=route, kind="compress")
+        return True
+
+# -----------------------------------------------------------------------------
+# Dev API
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Private API
+# -----------------------------------------------------------------------------
+
+
+def _ndarray_reps(content: Any) -> Iterator[Dict[str, Any]]:
+    stack: List[Any] = [content]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, dict):
+            if obj.get("type") == "ndarray":
+                yield obj
+            else:
+                stack.extend(obj.values())
+        # lists of numbers (JSON encoded columns) are skipped without looking at every item
+        elif isinstance(obj, (list, tuple)) and obj and not (obj[0] is None or isinstance(obj[0], (int, float))):
+            stack.extend(item for item in obj if isinstance(item, (dict, list, tuple)))
+
+
+def _buffer_of(rep: Dict[str, Any]) -> Buffer | None:
+    array = rep.get("array")
+    if isinstance(array, dict) and array.get("type") == "bytes" and isinstance(array.get("data"), Buffer):
+        return array["data"]
+    return None
+
+# -----------------------------------------------------------------------------
+# Code
+# -----------------------------------------------------------------------------
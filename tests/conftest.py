@@ -0,0 +1,11 @@
+import django
+from django.conf import settings
+
+
+def pytest_configure(config):
+    if not settings.configured:
+        settings.configure(
+            INSTALLED_APPS=["channels", "bokeh_django"],
+            ROOT_URLCONF="tests.urls",
+        )
+        django.setup()
@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+from bokeh.models import Div
+from channels.routing import URLRouter
+from channels.testing import HttpCommunicator
+from django.test import override_settings
+
+from bokeh_django import document
+from bokeh_django.admission import AdmissionControl, worker_load
+from bokeh_django.routing import RoutingConfiguration
+
+from .util import get, session_of
+
+
+def handler(doc):
+    doc.add_root(Div(text="admitted"))
+
+
+def test_route_at_max_sessions_answers_503():
+    async def run():
+        routing = document("admission-full", handler, max_sessions=1)
+        first = await get([routing], "/admission-full")
+        second = await get([routing], "/admission-full")
+        return routing, first, second
+
+    with override_settings(BOKEH_DJANGO_RETRY_AFTER=7):
+        routing, first, second = asyncio.run(run())
+    assert first[0]["status"] == 200
+    assert second[0]["status"] == 503
+    assert (b"Retry-After", b"7") in second[0]["headers"]
+    load = worker_load([routing.app_context])
+    assert load["shed"] == 1 and load["queued"] == 0
+    assert load["routes"]["admission-full"]["shed"] == 1
+
+
+def test_queued_session_is_admitted_once_there_is_room():
+    async def run():
+        routing = document("admission-queued", handler, max_sessions=1)
+        await get([routing], "/admission-queued")
+        waiting = asyncio.ensure_future(get([routing], "/admission-queued"))
+        await asyncio.sleep(0.2)
+        assert not waiting.done()
+        await routing.app_context.discard_session(session_of(routing))
+        return routing, await waiting
+
+    with override_settings(BOKEH_DJANGO_ADMISSION_QUEUE_TIMEOUT=5):
+        routing, messages = asyncio.run(run())
+    assert messages[0]["status"] == 200
+    route = worker_load([routing.app_context])["routes"]["admission-queued"]
+    assert (route["queued"], route["shed"]) == (1, 0)
+
+
+def test_queued_session_is_shed_after_the_timeout():
+    async def run():
+        routing = document("admission-timeout", handler, max_sessions=1)
+        await get([routing], "/admission-timeout")
+        return routing, await get([routing], "/admission-timeout")
+
+    with override_settings(BOKEH_DJANGO_ADMISSION_QUEUE_TIMEOUT=0.1):
+        routing, messages = asyncio.run(run())
+    assert messages[0]["status"] == 503
+    load = worker_load([routing.app_context])
+    assert (load["queued"], load["shed"]) == (1, 1)
+
+
+def test_load_endpoint(monkeypatch):
+    async def run():
+        routing = document("admission-load", handler)
+        config = RoutingConfiguration([routing], load_url="/admission-load-report")
+        application = URLRouter(config.get_http_urlpatterns())
+        await get([routing], "/admission-load")
+        ready = await HttpCommunicator(application, "GET", "/admission-load-report").get_response(timeout=10)
+        monkeypatch.setattr(AdmissionControl, "draining", True)
+        draining = await HttpCommunicator(application, "GET", "/admission-load-report").get_response(timeout=10)
+        return ready, draining
+
+    monkeypatch.setattr(AdmissionControl, "draining", False)
+    ready, draining = asyncio.run(run())
+    assert ready["status"] == 200
+    assert (b"Cache-Control", b"no-store") in ready["headers"]
+    load = json.loads(ready["body"])
+    route = load["routes"]["admission-load"]
+    assert (route["sessions"], route["pending"], route["connections"], route["shed"]) == (1, 0, 0, 0)
+    assert route["session_bytes"] > 0
+    assert load["sessions"] >= 1 and not load["draining"]
+    assert draining["status"] == 503 and json.loads(draining["body"])["draining"]
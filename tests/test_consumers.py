@@ -0,0 +1,90 @@
+import asyncio
+
+from bokeh.models import Div
+from channels.testing import HttpCommunicator
+from django.test import override_settings
+
+from bokeh_django import consumers, document
+from bokeh_django.push import apublish, on_push
+
+from .util import application, connect, get, receive, session_of
+
+
+def handler(doc):
+    doc.add_root(Div(text="streamed"))
+
+
+def test_streamed_page_is_ended_when_rendering_fails(monkeypatch):
+    def fail(session):
+        raise RuntimeError("rendering failed")
+    monkeypatch.setattr(consumers, "stream_tail", fail)
+
+    messages = asyncio.run(get([document("streamed-failing", handler, stream=True)], "/streamed-failing"))
+    assert messages[0]["status"] == 200
+    assert not messages[-1]["more_body"]
+    assert messages[-1]["body"].endswith(b"</html>\n")
+
+
+def test_streamed_page_over_the_limits_answers_503():
+    async def run():
+        routing = document("streamed-full", handler, stream=True, max_sessions=1)
+        first = await get([routing], "/streamed-full")
+        second = await get([routing], "/streamed-full")
+        return first, second
+
+    with override_settings(BOKEH_DJANGO_ADMISSION_QUEUE_TIMEOUT=0.1):
+        first, second = asyncio.run(run())
+    assert first[0]["status"] == 200 and first[-1]["body"].rstrip().endswith(b"</html>")
+    assert second[0]["status"] == 503
+    assert any(name == b"Retry-After" for name, _ in second[0]["headers"])
+
+
+def test_queued_streamed_page_is_sent_once_admitted():
+    async def run():
+        routing = document("streamed-queued", handler, stream=True, max_sessions=1)
+        await get([routing], "/streamed-queued")
+        waiting = HttpCommunicator(application([routing]), "GET", "/streamed-queued")
+        await waiting.send_input({"type": "http.request", "body": b""})
+        # nothing, not even the status, goes out while the request waits for room
+        assert await waiting.receive_nothing(timeout=0.2)
+        await routing.app_context.discard_session(session_of(routing))
+        start = await waiting.receive_output(timeout=5)
+        await waiting.wait(timeout=5)
+        return start
+
+    with override_settings(BOKEH_DJANGO_ADMISSION_QUEUE_TIMEOUT=5):
+        start = asyncio.run(run())
+    assert start["status"] == 200
+
+
+def test_published_payload_is_applied_once_per_session():
+    applied = []
+
+    def push_handler(doc):
+        div = Div(text="before")
+        doc.add_root(div)
+
+        def update(payload):
+            applied.append(payload)
+            div.text = payload["text"]
+        on_push(doc, update, topic="news")
+
+    async def run():
+        routing = document("pushed", push_handler)
+        first = await connect(routing)
+        # a second connection to the same session joins the group too
+        second = await connect(routing, session_of(routing).id)
+        await apublish("pushed", dict(text="after"), topic="news")
+        for ws in (first, second):
+            header, content, _ = await receive(ws)
+            assert header["msgtype"] == "PATCH-DOC"
+            [event] = content["events"]
+            assert (event["attr"], event["new"]) == ("text", "after")
+        assert await first.receive_nothing()
+        assert session_of(routing).document.roots[0].text == "after"
+        await first.disconnect()
+        await second.disconnect()
+
+    with override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}):
+        asyncio.run(run())
+    assert applied == [dict(text="after")]
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bokeh_django.datasets import DatasetStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return DatasetStore(tmp_path)
+
+
+def roundtrip(store, data):
+    store.register("data", data)
+    with store.attach("data") as dataset:
+        return dataset.data
+
+
+def test_string_columns_keep_missing_values(store):
+    df = pd.DataFrame({"name": ["a", None, "c", np.nan], "value": [1.0, 2.0, 3.0, 4.0]})
+    name = roundtrip(store, df)["name"]
+    assert list(name[[0, 2]]) == ["a", "c"]
+    assert name[[1, 3]].isna().all()
+
+
+def test_tz_aware_columns(store):
+    time = pd.date_range("2024-03-30", periods=48, freq="h", tz="Europe/Paris")
+    df = pd.DataFrame({"time": time}, index=pd.DatetimeIndex(time, name=None))
+    result = roundtrip(store, df)
+    assert str(result["time"].dt.tz) == "Europe/Paris"
+    pd.testing.assert_series_equal(result["time"], df["time"], check_names=False, check_index=False, check_freq=False)
+    assert result.index.equals(df.index) and str(result.index.tz) == "Europe/Paris"
+
+
+def test_dict_and_ndarray(store):
+    result = roundtrip(store, {"x": np.arange(3), "s": np.array(["a", None, "b"], dtype=object)})
+    assert list(result["s"]) == ["a", None, "b"]
+    assert isinstance(result["x"], np.memmap)
+
+
+def test_mixed_object_columns_are_refused(store):
+    with pytest.raises(TypeError, match="'mixed'"):
+        store.register("mixed", pd.DataFrame({"mixed": ["a", 1, 2.5]}))
+
+
+@pytest.mark.parametrize("name", ["", ".", "..", "../escaped", "a/b", ".hidden"])
+def test_names_that_are_not_a_file_name_are_refused(store, tmp_path, name):
+    with pytest.raises(ValueError, match="Invalid dataset name"):
+        store.register(name, np.arange(3))
+    with pytest.raises(ValueError, match="Invalid dataset name"):
+        store.attach(name)
+    assert not (tmp_path.parent / "escaped").exists()
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.mark.parametrize("name", ["__index__", "__missing__name"])
+def test_reserved_column_names_are_refused(store, name):
+    with pytest.raises(ValueError, match="Invalid column name"):
+        store.register("reserved", pd.DataFrame({name: [1, 2]}))
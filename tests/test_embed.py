@@ -0,0 +1,39 @@
+import asyncio
+import gc
+import logging
+from types import SimpleNamespace
+
+from bokeh.models import Div
+from django.apps import apps
+from django.http import QueryDict
+
+from bokeh_django import autoload, server_session_for_request
+from bokeh_django.routing import RoutingConfiguration
+
+
+def handler(doc):
+    doc.add_root(Div(text="embedded"))
+
+
+def view_request(path):
+    scope = dict(type="http", path=path, query_string=b"", headers=[], scheme="http")
+    return SimpleNamespace(scope=scope, path=path, GET=QueryDict(), COOKIES={})
+
+
+def test_rejected_session_of_a_view_is_logged(monkeypatch, caplog):
+    routes = RoutingConfiguration([autoload("embed-rejected", handler, max_sessions=0)])
+    monkeypatch.setattr(apps.get_app_config("bokeh_django"), "_routes", routes)
+
+    async def run():
+        script = await server_session_for_request(view_request("/embed-rejected"))
+        # the session is created in the background
+        await asyncio.sleep(0.1)
+        return script
+
+    with caplog.at_level(logging.WARNING):
+        script = asyncio.run(run())
+        gc.collect()
+    assert "embed-rejected/autoload.js" in script
+    messages = [record.getMessage() for record in caplog.records]
+    assert any("for a view was not created" in message for message in messages)
+    assert not any("never retrieved" in message for message in messages)
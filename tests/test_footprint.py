@@ -0,0 +1,39 @@
+import numpy as np
+from bokeh.document import Document
+from bokeh.models import ColumnDataSource, Div
+
+from bokeh_django.footprint import ITEM_BYTES, MODEL_BYTES, SessionFootprint
+
+
+def test_footprint_follows_the_changes_of_the_document(tmp_path):
+    doc = Document()
+    source = ColumnDataSource(data=dict(x=np.zeros(100), y=list(range(100))))
+    doc.add_root(source)
+    footprint = SessionFootprint(doc)
+    assert footprint.data_bytes == 800 + 100 * ITEM_BYTES
+
+    source.data = dict(x=np.zeros(200), y=list(range(200)))
+    assert footprint.data_bytes == 1600 + 200 * ITEM_BYTES
+    source.stream(dict(x=np.zeros(10), y=[2] * 10))
+    assert footprint.data_bytes == 1680 + 210 * ITEM_BYTES
+    source.patch(dict(y=[(0, 5)]))
+    assert footprint.data_bytes == 1680 + 210 * ITEM_BYTES
+
+    np.save(tmp_path / "x.npy", np.zeros(1000))
+    source.data = dict(x=np.load(tmp_path / "x.npy", mmap_mode="r"))
+    assert (footprint.data_bytes, footprint.mapped_bytes) == (0, 8000)
+
+    other = ColumnDataSource(data=dict(x=np.zeros(50)))
+    doc.add_root(other)
+    assert footprint.data_bytes == 400
+    doc.remove_root(source)
+    assert (footprint.data_bytes, footprint.mapped_bytes) == (400, 0)
+
+
+def test_estimated_bytes_counts_the_models():
+    doc = Document()
+    doc.add_root(Div(text="footprint"))
+    footprint = SessionFootprint(doc)
+    doc.add_periodic_callback(lambda: None, 1000)
+    assert footprint.to_dict() == dict(models=1, data_bytes=0, mapped_bytes=0, periodic_callbacks=1,
+                                       estimated_bytes=MODEL_BYTES)
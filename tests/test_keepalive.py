@@ -0,0 +1,70 @@
+import asyncio
+
+from bokeh.models import ColumnDataSource
+
+from bokeh_django import document, metrics
+from bokeh_django.keepalive import idle_reaper
+
+from .util import connect, receive, session_of
+
+IDLE_TIMEOUT = 0.2
+
+
+def handler(doc):
+    doc.add_root(ColumnDataSource(data=dict(x=[0])))
+
+
+def periodic_handler(doc):
+    handler(doc)
+    doc.add_periodic_callback(lambda: None, 60_000)
+
+
+def test_silent_viewer_is_kept_while_the_server_sends():
+    async def run():
+        routing = document("keepalive-sending", handler, idle_timeout=IDLE_TIMEOUT)
+        ws = await connect(routing)
+        session = session_of(routing)
+        source = session.document.roots[0]
+
+        def change(i):
+            source.data = dict(x=[i])
+
+        for i in range(6):
+            await asyncio.sleep(IDLE_TIMEOUT / 2)
+            await session.with_document_locked(change, i)
+            header, _, _ = await receive(ws)
+            assert header["msgtype"] == "PATCH-DOC"
+            await idle_reaper.reap()
+        assert await ws.receive_nothing()
+        await ws.disconnect()
+
+    metrics.reset()
+    asyncio.run(run())
+    assert metrics.get("ws_reaped", route="keepalive-sending") == 0
+
+
+def test_documents_fed_by_the_server_are_not_reaped():
+    async def run():
+        ws = await connect(document("keepalive-periodic", periodic_handler, idle_timeout=IDLE_TIMEOUT))
+        await asyncio.sleep(2 * IDLE_TIMEOUT)
+        await idle_reaper.reap()
+        assert await ws.receive_nothing()
+        await ws.disconnect()
+
+    metrics.reset()
+    asyncio.run(run())
+    assert metrics.get("ws_reaped", route="keepalive-periodic") == 0
+
+
+def test_silent_peer_is_reaped():
+    async def run():
+        routing = document("keepalive-silent", handler, idle_timeout=IDLE_TIMEOUT)
+        ws = await connect(routing)
+        await asyncio.sleep(2 * IDLE_TIMEOUT)
+        await idle_reaper.reap()
+        assert (await ws.receive_output(timeout=1)) == {"type": "websocket.close", "code": 1001}
+        assert not routing.app_context._sessions
+
+    metrics.reset()
+    asyncio.run(run())
+    assert metrics.get("ws_reaped", route="keepalive-silent") == 1
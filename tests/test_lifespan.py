@@ -0,0 +1,42 @@
+import asyncio
+
+from asgiref.testing import ApplicationCommunicator
+from bokeh.models import Div
+
+from bokeh_django import document
+from bokeh_django.admission import AdmissionControl
+from bokeh_django.lifespan import Lifespan
+from bokeh_django.routing import RoutingConfiguration
+
+from .util import connect
+
+
+def test_startup_warms_and_shutdown_closes(monkeypatch):
+    monkeypatch.setattr(AdmissionControl, "draining", False)
+    built = []
+    destroyed = []
+
+    def handler(doc):
+        built.append(doc)
+        doc.add_root(Div(text="lifespan"))
+        doc.on_session_destroyed(lambda session_context: destroyed.append(session_context.id))
+
+    async def run():
+        routing = document("lifespan", handler)
+        lifespan = ApplicationCommunicator(Lifespan(None, RoutingConfiguration([routing])), dict(type="lifespan"))
+
+        await lifespan.send_input(dict(type="lifespan.startup"))
+        assert await lifespan.receive_output(timeout=10) == dict(type="lifespan.startup.complete")
+        # the throwaway document of the route
+        assert len(built) == 1
+
+        ws = await connect(routing)
+        assert len(built) == 2
+        await lifespan.send_input(dict(type="lifespan.shutdown"))
+        assert await ws.receive_output(timeout=10) == dict(type="websocket.close", code=1001)
+        assert await lifespan.receive_output(timeout=10) == dict(type="lifespan.shutdown.complete")
+        assert AdmissionControl.draining
+        assert not routing.app_context._sessions
+
+    asyncio.run(run())
+    assert len(destroyed) == 1
@@ -0,0 +1,59 @@
+import asyncio
+
+from bokeh.models import Div
+
+from bokeh_django import MessageLimits, document, metrics
+
+from .util import connect, receive, send
+
+
+def handler(doc):
+    doc.add_root(Div(text="limited"))
+
+
+def test_large_frame_is_closed_with_1009():
+    async def run():
+        ws = await connect(document("limits-frame", handler, limits=MessageLimits(max_frame_bytes=1000)))
+        await ws.send_to(text_data="x" * 1001)
+        return await ws.receive_output(timeout=1)
+
+    metrics.reset()
+    assert asyncio.run(run()) == {"type": "websocket.close", "code": 1009}
+    assert metrics.get("ws_limit_exceeded", route="limits-frame", limit="frame") == 1
+
+
+def test_large_message_is_closed_with_1009():
+    async def run():
+        ws = await connect(document("limits-message", handler, limits=MessageLimits(max_message_bytes=200)))
+        # header and metadata of a message, then a content that is too big for what is buffered
+        await ws.send_to(text_data='{"msgid": "1", "msgtype": "SERVER-INFO-REQ"}')
+        await ws.send_to(text_data="{}")
+        await ws.send_to(text_data="{" + " " * 200 + "}")
+        return await ws.receive_output(timeout=1)
+
+    metrics.reset()
+    assert asyncio.run(run())["code"] == 1009
+    assert metrics.get("ws_limit_exceeded", route="limits-message", limit="message") == 1
+
+
+def test_sustained_rate_is_throttled_then_closed_with_1008():
+    async def run():
+        limits = MessageLimits(rate=30, burst=3, throttle_timeout=0.2)
+        ws = await connect(document("limits-rate", handler, limits=limits))
+        # the burst covers one message, the next ones wait for the bucket
+        for _ in range(2):
+            await send(ws, "SERVER-INFO-REQ")
+            header, _, _ = await receive(ws)
+            assert header["msgtype"] == "SERVER-INFO-REPLY"
+        for _ in range(10):
+            await send(ws, "SERVER-INFO-REQ")
+        while True:
+            output = await ws.receive_output(timeout=2)
+            if output["type"] == "websocket.close":
+                return output
+
+    metrics.reset()
+    closed = asyncio.run(run())
+    assert (closed["type"], closed["code"]) == ("websocket.close", 1008)
+    assert metrics.get("ws_throttled", route="limits-rate") > 0
+    assert metrics.get("ws_limit_exceeded", route="limits-rate", limit="rate") == 1
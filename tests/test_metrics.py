@@ -0,0 +1,25 @@
+import sys
+import threading
+
+from bokeh_django import metrics
+
+
+def test_increment_from_threads():
+    # switch threads as often as possible, so that unguarded updates get lost
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    def work():
+        for _ in range(20_000):
+            metrics.increment("threads_test", route="metrics")
+
+    metrics.reset()
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert metrics.get("threads_test", route="metrics") == 80_000
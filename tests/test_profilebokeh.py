@@ -0,0 +1,45 @@
+import io
+import pstats
+
+import pytest
+from bokeh.models import ColumnDataSource, Div
+from django.apps import apps
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from bokeh_django import document
+from bokeh_django.routing import RoutingConfiguration
+
+built = []
+
+
+def handler(doc):
+    built.append(doc)
+    doc.add_root(Div(text="profiled"))
+    doc.add_root(ColumnDataSource(data=dict(x=list(range(100)))))
+
+
+@pytest.fixture(autouse=True)
+def routes(monkeypatch):
+    routes = RoutingConfiguration([document(r"^profiled/(?P<n>[0-9]+)$", handler)])
+    monkeypatch.setattr(apps.get_app_config("bokeh_django"), "_routes", routes)
+    built.clear()
+
+
+def test_profile_of_a_route(tmp_path):
+    out = io.StringIO()
+    call_command("profilebokeh", "/profiled/42", count=3, top=5, output=str(tmp_path / "profile"), stdout=out)
+    output = out.getvalue()
+
+    # the cold build, one traced for memory and the profiled ones
+    assert len(built) == 5
+    assert "Profiled 3 documents of /profiled/42" in output
+    for stage in ("first build", "build", "serialize", "models", "peak memory"):
+        assert f"  {stage} " in output
+    assert "Top 5 functions by cumulative:" in output
+    assert pstats.Stats(str(tmp_path / "profile")).total_calls > 0
+
+
+def test_unknown_path():
+    with pytest.raises(CommandError, match="No Bokeh route matches /elsewhere"):
+        call_command("profilebokeh", "/elsewhere", stdout=io.StringIO())
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+from channels.routing import URLRouter
+from django.urls import path, re_path
+
+from bokeh_django import document
+from bokeh_django.router import CompiledRouter
+from bokeh_django.routing import RoutingConfiguration
+
+
+def app(name):
+    async def application(scope, receive, send):
+        return name, scope["url_route"]
+    return application
+
+
+def routes():
+    return [
+        re_path(r"^plain/autoload\.js$", app("plain-autoload")),
+        re_path(r"^plain$", app("plain")),
+        re_path(r"^users/(?P<user>[0-9]+)$", app("user")),
+        re_path(r"^users/me$", app("me")),
+        path("items/<int:item>/", app("item")),
+        path("items/new/", app("new-item")),
+        re_path(r"^(?:en|de)/about$", app("about")),
+        re_path(r"^a.?b$", app("optional")),
+        re_path(r"^nested/", URLRouter([
+            re_path(r"^(?P<inner>[a-z]+)$", app("nested")),
+        ])),
+        re_path(r"^plain$", app("plain-shadowed")),
+        re_path(r".*", app("fallback")),
+    ]
+
+
+PATHS = ["/plain", "/plain/autoload.js", "/plainautoload.js", "/users/42", "/users/me", "/users/",
+         "/items/7/", "/items/new/", "/en/about", "/de/about", "/ab", "/axb", "/nested/deep",
+         "/nested/42", "/", "/unknown/path"]
+
+
+def resolve(router, path):
+    try:
+        return asyncio.run(router(dict(type="http", path=path), None, None))
+    except ValueError as e:
+        return str(e)
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_same_routes_as_url_router(path):
+    assert resolve(CompiledRouter(routes()), path) == resolve(URLRouter(routes()), path)
+
+
+@pytest.mark.parametrize("path", ["router-page", "router-page/autoload.js", "router-page/ws", "router-other"])
+def test_same_routes_of_bokeh_apps(path):
+    config = RoutingConfiguration([document("router-page", lambda doc: None)])
+    routes = config.get_http_urlpatterns() + config.get_websocket_urlpatterns()
+
+    def first(indices):
+        return next(index for index in indices if routes[index].pattern.match(path))
+
+    assert first(CompiledRouter(routes).candidates(path)) == first(range(len(routes)))
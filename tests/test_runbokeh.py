@@ -0,0 +1,82 @@
+import io
+import itertools
+import os
+import signal
+
+import pytest
+from django.core.management.base import CommandError
+
+from bokeh_django.management.commands import runbokeh
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+
+@pytest.fixture
+def command(monkeypatch):
+    """ A runbokeh command supervising one fake worker, which fails with the statuses in ``command.statuses``. """
+    command = runbokeh.Command(stdout=io.StringIO(), stderr=io.StringIO())
+    command.options = dict(ready_timeout=1)
+    command.sock = io.BytesIO()
+    command.workers = {0: 100}
+    command.ready = {0: False}
+    command.statuses = []
+    command.spawned = []
+    pids = itertools.count(101)
+
+    def spawn(index):
+        command.spawned.append(command.time.now)
+        command.workers[index] = next(pids)
+        return -1
+
+    def wait():
+        return command.workers[0], command.statuses.pop(0)
+
+    command.time = FakeTime()
+    monkeypatch.setattr(command, "_spawn", spawn)
+    monkeypatch.setattr(runbokeh, "time", command.time)
+    monkeypatch.setattr(runbokeh, "_wait_ready", lambda fd, timeout: None)
+    monkeypatch.setattr(runbokeh, "_kill", lambda pid, signum: None)
+    monkeypatch.setattr(runbokeh.os, "wait", wait)
+    monkeypatch.setattr(runbokeh.signal, "signal", lambda signum, handler: None)
+    return command
+
+
+def test_failing_worker_is_restarted_with_backoff_then_stops(command):
+    command.statuses = [1 << 8] * runbokeh.MAX_START_FAILURES
+    with pytest.raises(CommandError, match="kept exiting"):
+        command._supervise()
+
+    # restarted after 1, 2, 4 and 8 seconds, the fifth failure stops the server
+    assert command.spawned == [1, 3, 7, 15]
+    assert command.sock.closed
+    errors = command.stderr._out.getvalue()
+    assert "exited with status 1 before reporting ready, restarting in 1s" in errors
+    assert f"{runbokeh.MAX_START_FAILURES} times in a row, stopping" in errors
+
+
+def test_ready_worker_is_restarted_right_away(command):
+    command.ready = {0: True}
+    command.statuses = [signal.SIGKILL] + [1 << 8] * runbokeh.MAX_START_FAILURES
+    with pytest.raises(CommandError):
+        command._supervise()
+
+    assert command.spawned == [0, 1, 3, 7, 15]
+    assert f"exited with status -{int(signal.SIGKILL)}, restarting" in command.stderr._out.getvalue()
+
+
+def test_exit_code():
+    assert runbokeh._exit_code(3 << 8) == 3
+    assert runbokeh._exit_code(int(signal.SIGTERM)) == -signal.SIGTERM
+    if hasattr(os, "waitstatus_to_exitcode"):
+        assert runbokeh._exit_code(3 << 8) == os.waitstatus_to_exitcode(3 << 8)
@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+import numpy as np
+from bokeh.models import ColumnDataSource, Div
+
+from bokeh_django import document, metrics
+
+from .util import connect, receive, session_of
+
+
+def div_handler(doc):
+    doc.add_root(Div(text="shared"))
+
+
+def source_handler(doc):
+    doc.add_root(ColumnDataSource(data=dict(x=np.arange(1000, dtype=np.float64), y=np.zeros(1000))))
+
+
+async def send_patch(ws, events):
+    # a PATCH-DOC as BokehJS sends it
+    header = dict(msgid="client-1", msgtype="PATCH-DOC")
+    for part in (header, {}, dict(events=events)):
+        await ws.send_to(text_data=json.dumps(part))
+
+
+def test_shared_session_ignores_client_changes():
+    async def run():
+        routing = document("session-shared", div_handler, shared=True)
+        first = await connect(routing)
+        second = await connect(routing)
+        session = session_of(routing)
+        div = session.document.roots[0]
+
+        await send_patch(first, [dict(kind="ModelChanged", model=dict(id=div.id), attr="text", new="changed")])
+        header, _, _ = await receive(first)
+        assert (header["msgtype"], header["reqid"]) == ("OK", "client-1")
+        assert div.text == "shared"
+        assert await second.receive_nothing()
+        await first.disconnect()
+        await second.disconnect()
+
+    metrics.reset()
+    asyncio.run(run())
+    assert metrics.get("shared_session_changes_ignored") == 1
+
+
+def test_replaced_data_is_sent_as_stream_and_patch():
+    async def run():
+        routing = document("session-diff", source_handler, diff_data=True)
+        ws = await connect(routing)
+        session = session_of(routing)
+        source = session.document.roots[0]
+
+        def stream():
+            source.data = dict(x=np.arange(1002, dtype=np.float64), y=np.zeros(1002))
+
+        def patch():
+            y = np.zeros(1002)
+            y[5] = 1
+            source.data = dict(x=source.data["x"], y=y)
+
+        await session.with_document_locked(stream)
+        _, content, buffers = await receive(ws)
+        [event] = content["events"]
+        assert event["kind"] == "ColumnsStreamed"
+        x, y = (column for _, column in event["data"]["entries"])
+        assert (x["shape"], y["shape"]) == ([2], [2])
+        np.testing.assert_array_equal(np.frombuffer(buffers[x["array"]["data"]["id"]]), [1000, 1001])
+
+        await session.with_document_locked(patch)
+        _, content, _ = await receive(ws)
+        [event] = content["events"]
+        assert event["kind"] == "ColumnsPatched"
+        assert event["patches"]["entries"] == [["y", [[5, 1.0]]]]
+        await ws.disconnect()
+
+    metrics.reset()
+    asyncio.run(run())
+    assert metrics.get("cds_diff_events", kind="stream") == 1
+    assert metrics.get("cds_diff_events", kind="patch") == 1
+    assert metrics.get("cds_diff_bytes_saved") > 0
@@ -0,0 +1,48 @@
+import asyncio
+
+from bokeh_django import metrics
+from bokeh_django.snapshot import SnapshotCache
+
+
+def renderer(html="page"):
+    calls = []
+
+    async def render():
+        calls.append(html)
+        return html
+    return render, calls
+
+
+def test_least_recently_used_path_is_evicted():
+    async def run():
+        cache = SnapshotCache(maxsize=2, route="snap/(?P<id>\\d+)")
+        render, calls = renderer()
+        for path in ("/snap/1", "/snap/2", "/snap/1", "/snap/3", "/snap/1", "/snap/2"):
+            await cache.get(path, render)
+        return calls
+
+    metrics.reset()
+    assert len(asyncio.run(run())) == 4
+    assert metrics.get("snapshot_hits", route="snap/(?P<id>\\d+)") == 2
+    assert metrics.get("snapshot_renders", route="snap/(?P<id>\\d+)") == 4
+
+
+def test_invalidate_during_render_drops_the_result():
+    async def run():
+        cache = SnapshotCache()
+        rendering = asyncio.Event()
+        release = asyncio.Event()
+
+        async def stale():
+            rendering.set()
+            await release.wait()
+            return "stale"
+
+        waiting = asyncio.ensure_future(cache.get("/snap", stale))
+        await rendering.wait()
+        cache.invalidate("/snap")
+        release.set()
+        assert (await waiting).html == b"stale"
+        return (await cache.get("/snap", renderer("fresh")[0])).html
+
+    assert asyncio.run(run()) == b"fresh"
@@ -0,0 +1,86 @@
+import asyncio
+import os
+
+import numpy as np
+import pytest
+from bokeh.models import ColumnDataSource
+from django.test import override_settings
+
+from bokeh_django import document
+
+from .util import connect, receive, session_of
+
+ROWS = 1000
+
+
+def handler(doc):
+    doc.add_root(ColumnDataSource(data=dict(x=np.arange(ROWS, dtype=np.float64))))
+
+
+@pytest.fixture
+def spill_dir(tmp_path):
+    with override_settings(BOKEH_DJANGO_SPILL_DIR=str(tmp_path), BOKEH_DJANGO_SPILL_MIN_BYTES=0):
+        yield tmp_path
+
+
+def test_spill_and_restore_before_callbacks(spill_dir):
+    # left behind by a worker that is gone
+    stale = spill_dir / "999999999" / "session"
+    stale.mkdir(parents=True)
+
+    async def run():
+        routing = document("spill-restore", handler, spill_after=0)
+        ws = await connect(routing)
+        context = routing.app_context
+        session = session_of(routing)
+        source = session.document.roots[0]
+
+        await context._spill.sweep([session])
+        assert isinstance(source.data["x"], np.memmap)
+        assert (spill_dir / str(os.getpid()) / session.id).is_dir()
+        assert not stale.exists()
+
+        def callback():
+            column = source.data["x"]
+            assert not isinstance(column, np.memmap)
+            column[0] = -1
+            return column
+
+        column = await session.with_document_locked(callback)
+        assert not (spill_dir / str(os.getpid()) / session.id).exists()
+        np.testing.assert_array_equal(source.data["x"][:3], [-1, 1, 2])
+        assert source.data["x"] is column
+
+        await context._spill.sweep([session])
+        assert isinstance(source.data["x"], np.memmap)
+        await ws.disconnect()
+        await context.close()
+        assert not (spill_dir / str(os.getpid())).exists()
+
+    asyncio.run(run())
+
+
+def test_changed_sessions_are_not_spilled(spill_dir):
+    async def run():
+        routing = document("spill-changed", handler, spill_after=0.2)
+        ws = await connect(routing)
+        context = routing.app_context
+        session = session_of(routing)
+        source = session.document.roots[0]
+
+        def change():
+            source.data = dict(x=np.arange(ROWS, dtype=np.float64) + 1)
+
+        for _ in range(4):
+            await asyncio.sleep(0.1)
+            await session.with_document_locked(change)
+            await receive(ws)
+            await context._spill.sweep([session])
+            assert not context._spill.is_spilled(session)
+
+        await asyncio.sleep(0.3)
+        await context._spill.sweep([session])
+        assert context._spill.is_spilled(session)
+        await ws.disconnect()
+
+    asyncio.run(run())
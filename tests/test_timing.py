@@ -0,0 +1,61 @@
+import asyncio
+import logging
+import time
+
+import numpy as np
+from bokeh.models import ColumnDataSource
+from django.test import override_settings
+
+from bokeh_django import document, footprint, metrics, timing
+
+from .util import connect, session_of
+
+
+class Session:
+    id = "timing"
+
+
+def handler(doc):
+    doc.add_root(ColumnDataSource(data=dict(x=np.arange(10))))
+
+
+def overrun():
+    time.sleep(0.11)
+
+
+def test_short_overrun_has_a_stack(caplog):
+    session = Session()
+    with override_settings(BOKEH_DJANGO_SLOW_CALLBACK_MS=100), caplog.at_level(logging.WARNING):
+        for _ in range(5):
+            timing.timed_call("test", "overrun", session, "timing-overrun", overrun)
+    records = [record for record in caplog.records if "Slow test overrun" in record.getMessage()]
+    assert len(records) == 5
+    assert all("in overrun" in record.getMessage() for record in records)
+
+
+def test_footprint_is_not_timed(monkeypatch, caplog):
+    source_bytes = footprint._source_bytes
+
+    def slow_source_bytes(source):
+        time.sleep(0.1)
+        return source_bytes(source)
+
+    async def run():
+        routing = document("timing-footprint", handler)
+        ws = await connect(routing)
+        session = session_of(routing)
+        source = session.document.roots[0]
+
+        def change():
+            source.data = dict(x=np.arange(20))
+
+        monkeypatch.setattr(footprint, "_source_bytes", slow_source_bytes)
+        await session.with_document_locked(timing.timed_call, "test", "change", session, session.route, change)
+        assert session.footprint.data_bytes == source.data["x"].nbytes
+        await ws.disconnect()
+
+    metrics.reset()
+    with override_settings(BOKEH_DJANGO_SLOW_CALLBACK_MS=50), caplog.at_level(logging.WARNING):
+        asyncio.run(run())
+    assert not [record for record in caplog.records if "Slow test change" in record.getMessage()]
+    assert metrics.get("callbacks_slow", route="timing-footprint", kind="test") == 0
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+from bokeh.models import Div
+from channels.testing import HttpCommunicator
+
+from bokeh_django import document, tracing
+
+from .util import application, connect, receive, send
+
+
+class Collector(tracing.Tracer):
+    enabled = True
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+@pytest.fixture
+def tracer():
+    tracer = Collector()
+    tracing.set_tracer(tracer)
+    yield tracer
+    tracing.set_tracer(None)
+
+
+def handler(doc):
+    doc.add_root(Div(text="traced"))
+
+
+def test_page_load_spans(tracer):
+    async def run():
+        routing = document("traced-page", handler)
+        communicator = HttpCommunicator(tracing.TracingMiddleware(application([routing])), "GET", "/traced-page")
+        response = await communicator.get_response(timeout=10)
+        assert response["status"] == 200
+
+    asyncio.run(run())
+    spans = {span.name: span for span in tracer.spans}
+    assert {"http", "resolve", "get_session", "on_session_created", "initialize_document", "html_page"} <= set(spans)
+    request = spans["http"]
+    assert request.parent_id is None and request.attributes["path"] == "/traced-page"
+    assert all(span.trace_id == request.trace_id for span in tracer.spans)
+    assert spans["resolve"].parent_id == request.span_id
+    assert spans["initialize_document"].parent_id == spans["get_session"].span_id
+    session_id = spans["get_session"].attributes["session_id"]
+    assert spans["html_page"].attributes == dict(route="traced-page", session_id=session_id)
+
+
+def test_websocket_spans(tracer):
+    async def run():
+        ws = await connect(document("traced-ws", handler))
+        await send(ws, "PULL-DOC-REQ")
+        header, _, _ = await receive(ws)
+        assert header["msgtype"] == "PULL-DOC-REPLY"
+        await ws.disconnect()
+
+    asyncio.run(run())
+    names = [span.name for span in tracer.spans]
+    assert {"connect", "check_token", "async_open", "ack", "pull_doc"} <= set(names)
+    assert all(span.duration is not None and span.duration >= 0 for span in tracer.spans)
+
+
+def test_disabled_tracer_creates_no_spans():
+    tracing.set_tracer(tracing.Tracer())
+    try:
+        with tracing.span("anything") as current:
+            assert current is None
+            assert tracing.current_span() is None
+    finally:
+        tracing.set_tracer(None)
@@ -0,0 +1,77 @@
+import asyncio
+import base64
+import gzip
+
+import numpy as np
+import pytest
+from bokeh.models import ColumnDataSource
+
+from bokeh_django import TransportPolicy, document
+
+from .util import connect, receive, send
+
+ROWS = 2000
+
+
+def handler(doc):
+    doc.add_root(ColumnDataSource(data=dict(
+        x=np.arange(ROWS, dtype=np.float64),
+        # out of the int32 range, which Bokeh sends as a JSON list
+        big=np.arange(ROWS, dtype=np.int64) + 2 ** 40,
+    )))
+
+
+async def pull(url, policy):
+    ws = await connect(document(url, handler, transport=policy))
+    try:
+        await send(ws, "PULL-DOC-REQ")
+        while True:
+            header, content, buffers = await receive(ws)
+            if header["msgtype"] == "PULL-DOC-REPLY":
+                return header, content, buffers
+    finally:
+        await ws.disconnect()
+
+
+def columns(content, buffers):
+    """ The arrays of the pulled document by column name, decoded like BokehJS does. """
+    source = content["doc"]["roots"][0]
+    data = source["attributes"]["data"]["entries"]
+    arrays = {}
+    for name, rep in data:
+        if isinstance(rep, list):
+            arrays[name] = np.array(rep)
+            continue
+        array = rep["array"]
+        if isinstance(array, list):
+            arrays[name] = np.array(array)
+            continue
+        assert array["type"] == "bytes"
+        if isinstance(array["data"], dict):
+            raw = buffers[array["data"]["id"]]
+        else:
+            raw = gzip.decompress(base64.b64decode(array["data"]))
+        arrays[name] = np.frombuffer(raw, dtype=rep["dtype"])
+    return arrays
+
+
+@pytest.mark.parametrize("policy", [
+    None,
+    TransportPolicy(binary=False),
+    TransportPolicy(),
+    TransportPolicy(float32_tolerance=1e-3),
+    TransportPolicy(compress_above=1024),
+    TransportPolicy(float32_tolerance=1e-3, compress_above=1024),
+], ids=["none", "no-binary", "binary", "float32", "compress", "float32-compress"])
+def test_pull_document(request, policy):
+    url = f"transport-{request.node.callspec.id}"
+    header, content, buffers = asyncio.run(pull(url, policy))
+    assert header["msgtype"] == "PULL-DOC-REPLY"
+    assert header.get("num_buffers", 0) == len(buffers)
+
+    arrays = columns(content, buffers)
+    rtol = policy.float32_tolerance if policy is not None and policy.float32_tolerance is not None else 0
+    np.testing.assert_array_equal(arrays["x"], np.arange(ROWS, dtype=np.float64))
+    np.testing.assert_allclose(arrays["big"].astype(np.float64), np.arange(ROWS) + 2.0 ** 40, rtol=rtol)
+    if rtol:
+        assert arrays["x"].dtype == np.float32
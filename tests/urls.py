@@ -0,0 +1,3 @@
+urlpatterns = []
+
+bokeh_apps = []
@@ -0,0 +1,66 @@
+import json
+
+from bokeh.protocol import Protocol
+from bokeh.util.token import generate_jwt_token, generate_session_id
+from channels.routing import URLRouter
+from channels.sessions import CookieMiddleware
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+
+from bokeh_django.routing import RoutingConfiguration
+
+# The URL patterns of all RoutingConfiguration instances are kept together, every test needs routes of its own
+
+
+async def connect(routing, session_id=None):
+    """ Open the websocket of a new session of ``routing`` and return it once the ACK arrived. """
+    application = CookieMiddleware(URLRouter(RoutingConfiguration([routing]).get_websocket_urlpatterns()))
+    session_id = session_id or generate_session_id(secret_key=None, signed=False)
+    token = generate_jwt_token(session_id, secret_key=None, signed=False, expiration=300)
+    ws = WebsocketCommunicator(application, f"/{routing.url}/ws", subprotocols=["bokeh", token])
+    connected, _ = await ws.connect()
+    assert connected
+    header, _, _ = await receive(ws)
+    assert header["msgtype"] == "ACK"
+    return ws
+
+
+async def receive(ws, timeout=10):
+    """ The header, content and buffers (by id) of the next Bokeh message. """
+    header = json.loads(await ws.receive_from(timeout=timeout))
+    json.loads(await ws.receive_from(timeout=timeout))
+    content = json.loads(await ws.receive_from(timeout=timeout))
+    buffers = {}
+    for _ in range(header.get("num_buffers", 0)):
+        buffer_header = json.loads(await ws.receive_from(timeout=timeout))
+        buffers[buffer_header["id"]] = (await ws.receive_output(timeout=timeout))["bytes"]
+    return header, content, buffers
+
+
+async def send(ws, msgtype, *args, **kwargs):
+    """ Send a Bokeh message like BokehJS does, returning it. """
+    message = Protocol().create(msgtype, *args, **kwargs)
+    for fragment in (message.header_json, message.metadata_json, message.content_json):
+        await ws.send_to(text_data=fragment)
+    return message
+
+
+def application(routings):
+    """ The HTTP application of ``routings``. """
+    return CookieMiddleware(URLRouter(RoutingConfiguration(routings).get_http_urlpatterns()))
+
+
+async def get(routings, path):
+    """ All the ASGI messages of the response to a GET of ``path``. """
+    communicator = HttpCommunicator(application(routings), "GET", path)
+    await communicator.send_input({"type": "http.request", "body": b""})
+    messages = [await communicator.receive_output(timeout=10)]
+    while messages[-1]["type"] == "http.response.start" or messages[-1].get("more_body", False):
+        messages.append(await communicator.receive_output(timeout=10))
+    return messages
+
+
+def session_of(routing):
+    """ The one session of ``routing``. """
+    sessions = list(routing.app_context._sessions.values())
+    assert len(sessions) == 1
+    return sessions[0]